@@ -4,6 +4,10 @@ slack_max_block_text_length = 3000
 slack_max_message_blocks = 50
 slack_max_message_attachments = 100
 
+# messages with lower values are posted first
+slack_post_priority_high = 0
+slack_post_priority_default = 10
+
 plural = lambda x: "s" if x != 1 else ""
 yes_no = lambda x: "Yes" if x > 0 else "No"
 enabled_disabled = lambda x: "✓ Enabled" if x else ":exclamation: Disabled"
@@ -0,0 +1,464 @@
+####
+#
+#   Run confirmed Icinga2 actions as jobs in the background
+#
+
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+# internal
+from . import plural, slack_post_priority_high
+from .classes import BotResponse
+from .slack_helper import slack_error_response
+from .slack_post_pipeline import slack_post_pipeline
+
+default_action_job_workers = 2
+
+# number of finished jobs which are still listed with the "jobs" command
+max_finished_action_jobs = 20
+
+# seconds between two updates of a progress message
+action_job_progress_update_interval = 2
+
+# seconds to wait for the progress message to be posted before the result is posted
+action_job_progress_message_timeout = 30
+
+
+class ActionJob:
+    """
+    A single confirmed action which is performed in the background
+
+    The action is performed by calling action_function(action_job=job),
+    which has to return a BotResponse. Actions which send multiple requests
+    report their progress with add_chunks() and chunk_done(). Actions can
+    add a follow-up with set_followup() which runs after the result has been
+    posted and is able to update the result message (i.e. a verification).
+    """
+
+    def __init__(self, job_id, user_name, description, action_function):
+
+        self.id = job_id
+        self.user_name = user_name
+        self.description = description
+        self.action_function = action_function
+        self.status = "queued"
+        self.num_chunks = 0
+        self.chunks_done = 0
+        self.created = datetime.now().timestamp()
+        self.started = None
+        self.finished = None
+        self.response = None
+        self.followup_function = None
+        self.followup_status = None
+        self.followup_cancel_function = None
+
+        self.progress_handle = None
+        self.progress_channel = None
+        self.progress_ts = None
+        self.progress_message_set = asyncio.Event()
+        self.progress_update_lock = asyncio.Lock()
+        self.last_progress_update = 0
+        self.last_progress_text = None
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+    def is_done(self):
+        return self.status in ["finished", "failed"]
+
+    def set_followup(self, followup_function, status=None, cancel_function=None):
+        """
+        run a follow-up once the result of the action has been posted
+
+        Parameters
+        ----------
+        followup_function: function
+            coroutine function called with the keyword argument update_result, a coroutine
+            function which takes the keyword arguments text (new result text) and status
+        status: str
+            status of the follow-up shown in the progress message until it's updated
+        cancel_function: function
+            called if the follow-up won't run, used to release resources the follow-up holds
+        """
+
+        self.followup_function = followup_function
+        self.followup_status = status
+        self.followup_cancel_function = cancel_function
+
+    def cancel_followup(self):
+        """
+        drop the follow-up of this job and release its resources
+        """
+
+        if self.followup_function is None:
+            return
+
+        logging.debug("Canceling follow-up of job #%d" % self.id)
+
+        if self.followup_cancel_function is not None:
+            self.followup_cancel_function()
+
+        self.followup_function = None
+        self.followup_status = None
+        self.followup_cancel_function = None
+
+    def add_chunks(self, num_chunks):
+        """
+        add the number of requests an action is going to send
+
+        Parameters
+        ----------
+        num_chunks: int
+            number of requests
+        """
+
+        self.num_chunks += num_chunks
+
+    def chunk_done(self):
+        """
+        count a finished request and update the progress message
+        """
+
+        self.chunks_done += 1
+
+        asyncio.ensure_future(self.update_progress_message())
+
+    def get_status_text(self):
+        """
+        Returns
+        -------
+        str: a single line describing the current state of this job
+        """
+
+        status_text = "Job #%d: %s (%s)" % (self.id, self.description, self.status)
+
+        if self.status == "running" and self.num_chunks > 0:
+            status_text += " %d of %d request%s done" % (self.chunks_done, self.num_chunks, plural(self.num_chunks))
+
+        if self.followup_function is not None and self.followup_status and self.status == "finished":
+            status_text += ", %s" % self.followup_status
+
+        if self.is_done() and self.started is not None:
+            status_text += " in %.1fs" % (self.finished - self.started)
+
+        return status_text
+
+    def get_progress_response(self):
+        """
+        Returns
+        -------
+        BotResponse: with the progress message of this job
+        """
+
+        response = BotResponse(text=self.get_status_text())
+        response.add_block(self.get_status_text())
+        response.action_job = self
+
+        return response
+
+    def set_reply_channel(self, handle, channel):
+        """
+        set the Slack channel the progress message is going to be posted to
+
+        The result is posted to this channel even if posting the progress message failed.
+
+        Parameters
+        ----------
+        handle: slack.WebClient
+            the Slack client handle to use
+        channel: str
+            Slack channel to post to
+        """
+
+        self.progress_handle = handle
+        self.progress_channel = channel
+
+    def set_progress_message(self, handle, channel, ts):
+        """
+        set the posted progress message which will be updated
+
+        Parameters
+        ----------
+        handle: slack.WebClient
+            the Slack client handle to use
+        channel: str
+            Slack channel the progress message was posted to
+        ts: str
+            time stamp of the progress message, None if posting the progress message failed
+        """
+
+        self.progress_handle = handle
+        self.progress_channel = channel
+        self.progress_ts = ts
+        self.progress_message_set.set()
+
+        asyncio.ensure_future(self.update_progress_message(force=True))
+
+    async def update_progress_message(self, force=False):
+        """
+        update the progress message with the current job state
+
+        Parameters
+        ----------
+        force: bool
+            update even if last update was less then action_job_progress_update_interval seconds ago
+        """
+
+        if self.progress_ts is None:
+            return
+
+        now = datetime.now().timestamp()
+
+        if force is False and now - self.last_progress_update < action_job_progress_update_interval:
+            return
+
+        self.last_progress_update = now
+
+        # updates are sent one after another, the last update always shows the current state
+        async with self.progress_update_lock:
+
+            progress_response = self.get_progress_response()
+
+            # nothing changed since last update
+            if progress_response.text == self.last_progress_text:
+                return
+
+            self.last_progress_text = progress_response.text
+
+            update_response = await slack_post_pipeline.call_api(
+                self.progress_handle, "chat.update", self.progress_channel,
+                ts=self.progress_ts, text=progress_response.text, blocks=progress_response.blocks
+            )
+
+        if update_response.error:
+            logging.error("Unable to update progress message of job #%d: %s" % (self.id, update_response.error))
+
+
+class ActionJobQueue:
+    """
+    Queues action jobs which are performed by a few background workers.
+    """
+
+    def __init__(self):
+
+        self.jobs = OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.queue = None
+        self.workers = list()
+        self.num_workers = default_action_job_workers
+
+    @staticmethod
+    def get_num_workers(config):
+        """
+        Return the number of action jobs which can run at the same time
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+
+        Returns
+        -------
+        int: number of workers
+        """
+
+        if config.get("icinga.action_workers") is not None and str(config.get("icinga.action_workers")) != "":
+            return max(1, int(config.get("icinga.action_workers")))
+
+        return default_action_job_workers
+
+    def setup(self, config):
+        """
+        Set number of workers from config
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+        """
+
+        self.num_workers = self.get_num_workers(config)
+
+    def submit(self, slack_user, description, action_function, slack_user_id=None):
+        """
+        add a new job to the queue
+
+        Parameters
+        ----------
+        slack_user: SlackUser
+            user who requested the action
+        description: str
+            short description of the action
+        action_function: function
+            coroutine function which performs the action
+        slack_user_id: str, optional
+            Slack id of the user, used if the user data has not been loaded (yet)
+
+        Returns
+        -------
+        ActionJob: the new job
+        """
+
+        user_name = None
+        if slack_user is not None:
+            user_name = slack_user.data.get("real_name")
+
+        # Slack shows the name of a mentioned user
+        if user_name is None and slack_user_id is not None:
+            user_name = "<@%s>" % slack_user_id
+
+        job = ActionJob(next(self.job_ids), user_name, description, action_function)
+
+        self.jobs[job.id] = job
+
+        # start workers once they are needed, within the running loop
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.ensure_future(self.worker()) for _ in range(self.num_workers)]
+
+        self.queue.put_nowait(job)
+
+        logging.debug("Queued job #%d: %s" % (job.id, description))
+
+        return job
+
+    def get_jobs(self):
+        """
+        Returns
+        -------
+        list: all queued, running and recently finished jobs
+        """
+
+        return list(self.jobs.values())
+
+    async def worker(self):
+        """
+        run queued jobs one after another
+        """
+
+        while True:
+            job = await self.queue.get()
+
+            try:
+                await self.run_job(job)
+            except Exception as e:
+                logging.error("Unable to finish job #%d: %s" % (job.id, str(e)))
+
+    async def run_job(self, job):
+        """
+        perform the action of a job and post the result
+
+        Parameters
+        ----------
+        job: ActionJob
+            job to run
+        """
+
+        logging.debug("Starting job #%d: %s" % (job.id, job.description))
+
+        job.status = "running"
+        job.started = datetime.now().timestamp()
+        await job.update_progress_message(force=True)
+
+        try:
+            job.response = await job.action_function(action_job=job)
+            job.status = "finished"
+        except Exception as e:
+            logging.error("Job #%d failed: %s" % (job.id, str(e)))
+            job.response = slack_error_response(header="Job #%d failed" % job.id, error_message=str(e))
+            job.status = "failed"
+
+        job.finished = datetime.now().timestamp()
+
+        logging.debug(job.get_status_text())
+
+        self.remove_finished_jobs()
+
+        # the job might have been faster than posting the progress message
+        try:
+            await asyncio.wait_for(job.progress_message_set.wait(), timeout=action_job_progress_message_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Progress message of job #%d has not been posted, posting result as new message" % job.id)
+
+        await job.update_progress_message(force=True)
+
+        if job.response is None or job.progress_channel is None:
+            if job.response is not None:
+                logging.error("Unable to post result of job #%d: Slack channel unknown" % job.id)
+            job.cancel_followup()
+            return
+
+        # results of confirmed actions are conversation replies, post them before status responses
+        job.response.post_priority = slack_post_priority_high
+
+        post_response = await slack_post_pipeline.post(job.progress_handle, job.progress_channel, job.response)
+
+        if post_response.error:
+            logging.error("Unable to post result of job #%d: %s" % (job.id, post_response.error))
+
+        if job.status == "finished" and job.followup_function is not None and not post_response.error:
+            # don't block this worker while waiting for the follow-up
+            asyncio.ensure_future(self.run_followup(job, post_response.text.get("channel"),
+                                                    post_response.text.get("ts")))
+        else:
+            job.cancel_followup()
+
+    @staticmethod
+    async def run_followup(job, channel, ts):
+        """
+        run the follow-up of a job which can update the posted result message
+
+        Parameters
+        ----------
+        job: ActionJob
+            job to run the follow-up for
+        channel: str
+            Slack channel the result was posted to
+        ts: str
+            time stamp of the result message
+        """
+
+        last_result_text = job.response.text
+
+        async def update_result(text=None, status=None):
+
+            nonlocal last_result_text
+
+            if status is not None and status != job.followup_status:
+                job.followup_status = status
+                await job.update_progress_message(force=True)
+
+            if text is None or text == last_result_text:
+                return
+
+            last_result_text = text
+
+            update_response = await slack_post_pipeline.call_api(
+                job.progress_handle, "chat.update", channel, ts=ts, text=text
+            )
+
+            if update_response.error:
+                logging.error("Unable to update result message of job #%d: %s" % (job.id, update_response.error))
+
+        try:
+            await job.followup_function(update_result=update_result)
+        except Exception as e:
+            logging.error("Follow-up of job #%d failed: %s" % (job.id, str(e)))
+
+    def remove_finished_jobs(self):
+        """
+        keep only the last max_finished_action_jobs finished jobs
+        """
+
+        finished_jobs = [job_id for job_id, job in self.jobs.items() if job.is_done()]
+
+        for job_id in finished_jobs[0:max(0, len(finished_jobs) - max_finished_action_jobs)]:
+            del self.jobs[job_id]
+
+
+action_job_queue = ActionJobQueue()
+
+# EOF
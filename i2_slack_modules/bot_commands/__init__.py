@@ -9,3 +9,5 @@ from .run_icinga_status_query import run_icinga_status_query
 from .slack_command_help import slack_command_help
 from .slack_command_ping import slack_command_ping
 from .show_command import show_command
+from .show_more_results import show_more_results
+from .show_jobs import show_jobs
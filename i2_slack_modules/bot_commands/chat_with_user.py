@@ -1,16 +1,27 @@
 
-from i2_slack_modules.common import ts_to_date, parse_relative_date, my_own_function_name
+import asyncio
+import json
+from functools import partial
+from i2_slack_modules.action_jobs import action_job_queue
+from i2_slack_modules.icinga_action_verification import (
+    verify_action,
+    get_acknowledged_objects,
+    get_objects_with_downtime
+)
+from i2_slack_modules.icinga_check_result_waiter import CheckResultWaiter
+from i2_slack_modules.common import ts_to_date, async_parse_relative_date, my_own_function_name
 from i2_slack_modules.slack_helper import *
 from i2_slack_modules.icinga_connection import *
 from datetime import datetime
 
 
 # noinspection PyUnusedLocal
-def chat_with_user(
+async def chat_with_user(
         config=None,
         bot_commands=None,
         slack_message=None,
         slack_user=None,
+        slack_user_id=None,
         *args, **kwargs):
     """
     Have a conversation with the user about the action the user wants to perform
@@ -25,6 +36,8 @@ def chat_with_user(
         slack message to parse
     slack_user : SlackUser
         SlackUser object
+    slack_user_id : str
+        Slack id of the user who sent the message
     args, kwargs: None
         used to hold additional args which are just ignored
 
@@ -63,6 +76,13 @@ def chat_with_user(
             "need_comment": False,
             "filter_question": "What do you want to reschedule?"
         },
+        "reschedule and wait": {
+            "filter_end_marker": None,
+            "need_start_date": False,
+            "need_end_date": False,
+            "need_comment": False,
+            "filter_question": "What do you want to reschedule?"
+        },
         "send notification": {
             "filter_end_marker": "with",
             "need_start_date": False,
@@ -211,7 +231,7 @@ def chat_with_user(
                 else:
                     object_type = "HostComment"
 
-            i2_result = get_i2_object(config, object_type, host_filter, conversation.filter)
+            i2_result = await async_get_i2_object(config, object_type, host_filter, conversation.filter)
 
             if i2_result.error is None and len(i2_result.data) == 0:
                 object_type = "Service"
@@ -221,7 +241,7 @@ def chat_with_user(
                     else:
                         object_type = "ServiceComment"
 
-                i2_result = get_i2_object(config, object_type, service_filter, conversation.filter)
+                i2_result = await async_get_i2_object(config, object_type, service_filter, conversation.filter)
 
         # just query services
         else:
@@ -232,7 +252,7 @@ def chat_with_user(
                 else:
                     object_type = "ServiceComment"
 
-            i2_result = get_i2_object(config, object_type, service_filter, conversation.filter)
+            i2_result = await async_get_i2_object(config, object_type, service_filter, conversation.filter)
 
         # encountered Icinga request issue
         if i2_result.error:
@@ -316,7 +336,7 @@ def chat_with_user(
                     date_string_parse = " ".join(cma[0:until_index])
                     cma = cma[until_index:]
 
-            start_date_data = parse_relative_date(date_string_parse)
+            start_date_data = await async_parse_relative_date(date_string_parse)
 
             if start_date_data:
 
@@ -354,7 +374,7 @@ def chat_with_user(
 
             else:
                 string_parse = " ".join(cma)
-                end_date_data = parse_relative_date(string_parse)
+                end_date_data = await async_parse_relative_date(string_parse)
 
                 if end_date_data:
 
@@ -616,38 +636,66 @@ def chat_with_user(
         # delete conversation history
         slack_user.reset_conversation()
 
-        i2_handle, i2_error = setup_icinga_connection(config)
+        # get username to add as comment
+        this_user_info = slack_user.data
 
-        if not i2_handle:
-            if i2_error is not None:
-                error_message = i2_error
-            else:
-                error_message = "Unknown error while setting up Icinga2 connection"
+        author_name = "Anonymous Slack user"
+        if this_user_info is not None and this_user_info.get("real_name"):
+            author_name = this_user_info.get("real_name")
 
-            return slack_error_response(header="Icinga request error", error_message=error_message)
+        num_objects = len(conversation.filter_result)
 
-        # define filters
-        filter_list = list()
-        if conversation.object_type == "Host":
-            for i2_object in conversation.filter_result:
-                filter_list.append('host.name=="%s"' % i2_object.get("name"))
+        if conversation.command.name == "remove":
+            job_description = "remove %d %s%s" % \
+                              (num_objects, conversation.sub_command.name, plural(num_objects))
         else:
-            for i2_object in conversation.filter_result:
-                filter_list.append('( host.name=="%s" && service.name=="%s" )' %
-                                   (i2_object.get("host_name"), i2_object.get("name")))
+            job_description = "%s %d %s%s" % \
+                              (conversation.command.name, num_objects, conversation.object_type, plural(num_objects))
 
-        success_message = None
-        i2_error = None
+        # perform action in the background, progress will be posted
+        action_job = action_job_queue.submit(
+            slack_user, job_description, partial(perform_confirmed_action, config, conversation, author_name),
+            slack_user_id=slack_user_id
+        )
 
-        # get username to add as comment
-        this_user_info = slack_user.data
+        return action_job.get_progress_response()
 
-        author_name = "Anonymous Slack user"
-        if this_user_info is not None and this_user_info.get("real_name"):
-            author_name = this_user_info.get("real_name")
+    return None
+
+
+async def perform_confirmed_action(config, conversation, author_name, action_job=None):
+    """
+    Perform the action the user confirmed
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    conversation : SlackConversation
+        the conversation with all details about this action
+    author_name : str
+        name of the user to add as author
+    action_job : ActionJob
+        job this action is performed in, used to report progress
+
+    Returns
+    -------
+    BotResponse: confirmation or error
+    """
 
-        icinga2_filters = '(' + ' || '.join(filter_list) + ')'
+    # define filters, services are grouped by host
+    filter_list = list()
+    if conversation.command.name != "remove":
+        filter_list = get_i2_action_filters(conversation.object_type, conversation.filter_result)
+    num_objects = len(conversation.filter_result)
 
+    success_message = None
+    i2_error = None
+    i2_response = None
+    check_result_waiter = None
+
+    # once subscribed, the check result streams stay open until the follow-up or an error closes them
+    try:
         try:
 
             if conversation.command.name == "downtime":
@@ -656,9 +704,12 @@ def chat_with_user(
 
                 success_message = "Successfully scheduled downtime!"
 
-                i2_response = i2_handle.actions.schedule_downtime(
-                    object_type=conversation.object_type,
-                    filters=icinga2_filters,
+                i2_response = await async_perform_i2_action(
+                    config,
+                    "schedule-downtime",
+                    conversation.object_type,
+                    filter_list,
+                    action_job=action_job,
                     author=author_name,
                     comment=conversation.description,
                     start_time=conversation.start_date,
@@ -671,11 +722,14 @@ def chat_with_user(
                 logging.debug("Sending Acknowledgement to Icinga2")
 
                 success_message = "Successfully acknowledged %s problem%s!" % \
-                                  (conversation.object_type, plural(len(filter_list)))
-
-                i2_response = i2_handle.actions.acknowledge_problem(
-                    object_type=conversation.object_type,
-                    filters=icinga2_filters,
+                                  (conversation.object_type, plural(num_objects))
+
+                i2_response = await async_perform_i2_action(
+                    config,
+                    "acknowledge-problem",
+                    conversation.object_type,
+                    filter_list,
+                    action_job=action_job,
                     author=author_name,
                     comment=conversation.description,
                     expiry=None if conversation.end_date == -1 else conversation.end_date,
@@ -686,35 +740,55 @@ def chat_with_user(
                 logging.debug("Sending Comment to Icinga2")
 
                 success_message = "Successfully added %s comment%s!" % \
-                                  (conversation.object_type, plural(len(filter_list)))
-
-                i2_response = i2_handle.actions.add_comment(
-                    object_type=conversation.object_type,
-                    filters=icinga2_filters,
+                                  (conversation.object_type, plural(num_objects))
+
+                i2_response = await async_perform_i2_action(
+                    config,
+                    "add-comment",
+                    conversation.object_type,
+                    filter_list,
+                    action_job=action_job,
                     author=author_name,
                     comment=conversation.description
                 )
 
-            elif conversation.command.name == "reschedule":
+            elif conversation.command.name in ["reschedule", "reschedule and wait"]:
                 logging.debug("Sending reschedule check to Icinga2")
 
                 success_message = "Successfully rescheduled %s check%s!" % \
-                                  (conversation.object_type, plural(len(filter_list)))
-
-                i2_response = i2_handle.actions.reschedule_check(
-                    object_type=conversation.object_type,
-                    filters=icinga2_filters,
+                                  (conversation.object_type, plural(num_objects))
+
+                # subscribe before rescheduling, otherwise fast check results would be missed
+                if conversation.command.name == "reschedule and wait" and action_job is not None:
+                    check_result_waiter = CheckResultWaiter(config, conversation.object_type,
+                                                            conversation.filter_result)
+                    try:
+                        await check_result_waiter.subscribe()
+                    except Exception as e:
+                        logging.error("Unable to subscribe to Icinga2 check results: %s" % str(e))
+                        success_message += "\n_Unable to wait for the check results: %s_" % str(e)
+                        check_result_waiter = None
+
+                i2_response = await async_perform_i2_action(
+                    config,
+                    "reschedule-check",
+                    conversation.object_type,
+                    filter_list,
+                    action_job=action_job,
                 )
 
             elif conversation.command.name == "send notification":
                 logging.debug("Sending custom notification to Icinga2")
 
                 success_message = "Successfully sent %s notification%s!" % \
-                                  (conversation.object_type, plural(len(filter_list)))
-
-                i2_response = i2_handle.actions.send_custom_notification(
-                    object_type=conversation.object_type,
-                    filters=icinga2_filters,
+                                  (conversation.object_type, plural(num_objects))
+
+                i2_response = await async_perform_i2_action(
+                    config,
+                    "send-custom-notification",
+                    conversation.object_type,
+                    filter_list,
+                    action_job=action_job,
                     author=author_name,
                     comment=conversation.description
                 )
@@ -723,66 +797,131 @@ def chat_with_user(
                 logging.debug("Sending delay notification to Icinga2")
 
                 success_message = "Successfully delayed %s notification%s!" % \
-                                  (conversation.object_type, plural(len(filter_list)))
-
-                i2_response = i2_handle.actions.delay_notification(
-                    object_type=conversation.object_type,
-                    filters=icinga2_filters,
+                                  (conversation.object_type, plural(num_objects))
+
+                i2_response = await async_perform_i2_action(
+                    config,
+                    "delay-notification",
+                    conversation.object_type,
+                    filter_list,
+                    action_job=action_job,
                     timestamp=conversation.end_date
                 )
             elif conversation.command.name == "remove":
 
                 logging.debug(f"Sending remove {conversation.sub_command.name} to Icinga2")
 
-                success_message = f"Successfully removed {conversation.sub_command.name}!"
+                # remove all selected objects with as few filter based requests as possible
+                remove_requests = list()
 
                 if conversation.sub_command.name == "acknowledgement":
 
-                    for acknowledgement in conversation.filter_result:
-
-                        this_object_type = "Host"
-                        this_filter = 'host.name=="%s"' % acknowledgement.get("host_name")
-                        if len(acknowledgement.get("service_name", "")) > 0:
-                            this_object_type = "Service"
-                            this_filter += ' && service.name=="%s"' % acknowledgement.get("service_name")
-
-                        i2_response = i2_handle.actions.remove_acknowledgement(
-                            object_type=this_object_type,
-                            filters=this_filter,
-                        )
-
-                if conversation.sub_command.name == "comment":
-
-                    for comment in conversation.filter_result:
-                        name = "!".join(
-                            [comment.get("host_name"), comment.get("service_name"), comment.get("name")]
-                        ).replace("!!", "!")
-                        i2_response = i2_handle.actions.remove_comment(
-                            object_type="Comment",
-                            name=name,
-                            filters=None  # bug in icinga2apic
-                        )
+                    # select the objects the acknowledgements belong to, names are quoted by the filter helper
+                    acknowledged_hosts = [{"name": x.get("host_name")} for x in conversation.filter_result
+                                          if len(x.get("service_name") or "") == 0]
+                    acknowledged_services = [{"host_name": x.get("host_name"), "name": x.get("service_name")}
+                                             for x in conversation.filter_result
+                                             if len(x.get("service_name") or "") > 0]
+
+                    remove_requests.append(("remove-acknowledgement", "Host",
+                                            get_i2_action_filters("Host", acknowledged_hosts)))
+                    remove_requests.append(("remove-acknowledgement", "Service",
+                                            get_i2_action_filters("Service", acknowledged_services)))
+
+                if conversation.sub_command.name in ["comment", "downtime"]:
+
+                    filter_list = list()
+                    for i2_object in conversation.filter_result:
+                        # full object name is "host!name" or "host!service!name"
+                        name = "!".join([x for x in [i2_object.get("host_name"), i2_object.get("service_name"),
+                                                     i2_object.get("name")] if x])
+                        filter_list.append('%s.__name==%s' % (conversation.sub_command.name, json.dumps(name)))
+
+                    remove_requests.append(("remove-%s" % conversation.sub_command.name,
+                                            conversation.sub_command.name.capitalize(), filter_list))
+
+                remove_responses = await asyncio.gather(
+                    *[async_perform_i2_action(config, action, object_type, filter_list, action_job=action_job)
+                      for action, object_type, filter_list in remove_requests if len(filter_list) > 0]
+                )
 
-                if conversation.sub_command.name == "downtime":
+                num_removed = len([x for remove_response in remove_responses for x in remove_response.data
+                                   if int(x.get("code", 0)) == 200])
+                remove_errors = [x.error for x in remove_responses if x.error]
 
-                    for downtime in conversation.filter_result:
-                        name = "!".join(
-                            [downtime.get("host_name"), downtime.get("service_name"), downtime.get("name")]
-                        ).replace("!!", "!")
-                        i2_response = i2_handle.actions.remove_downtime(
-                            object_type="Downtime",
-                            name=name,
-                            filters=None
-                        )
+                if len(remove_errors) > 0:
+                    i2_error = "Removed %d of %d %s%s.\n%s" % \
+                               (num_removed, len(conversation.filter_result), conversation.sub_command.name,
+                                plural(len(conversation.filter_result)), "\n".join(remove_errors))
+                else:
+                    success_message = "Successfully removed %d %s%s!" % \
+                                      (num_removed, conversation.sub_command.name, plural(num_removed))
 
         except Exception as e:
             i2_error = str(e)
             logging.error("Unable to perform Icinga2 action: %s" % i2_error)
             pass
 
+        # some or all chunks of this action failed
+        if i2_response is not None and i2_response.error:
+            i2_error = "Action succeeded for %d of %d object%s.\n%s" % \
+                       (len([x for x in i2_response.data if int(x.get("code", 0)) == 200]), num_objects,
+                        plural(num_objects), i2_response.error)
+
+        # objects have changed, don't answer the next requests from cache
+        response_cache.invalidate()
+
         if i2_error:
+            if check_result_waiter is not None:
+                check_result_waiter.close()
             return slack_error_response(header="Icinga request error", error_message=i2_error)
 
-        return BotResponse(text=success_message)
+        # add the fresh check results to the result message as they come in
+        if check_result_waiter is not None:
+            action_job.set_followup(partial(check_result_waiter.stream_results, success_message),
+                                    status=check_result_waiter.get_status_text(),
+                                    cancel_function=check_result_waiter.close)
+    except BaseException:
+        if check_result_waiter is not None:
+            check_result_waiter.close()
+        raise
 
-    return None
+    # check if acknowledgements/downtimes are visible once the result has been posted
+    if config.get("icinga.verify_actions") is True and action_job is not None:
+
+        verify_function = None
+        if conversation.command.name == "acknowledge":
+            verify_function = partial(verify_action, config, conversation.object_type, conversation.filter_result,
+                                      get_acknowledged_objects)
+        elif conversation.command.name == "downtime":
+            verify_function = partial(verify_action, config, conversation.object_type, conversation.filter_result,
+                                      get_objects_with_downtime, author=author_name, comment=conversation.description)
+
+        if verify_function is not None:
+            action_job.set_followup(partial(verify_confirmed_action, verify_function, num_objects, success_message),
+                                    status="_verifying ..._")
+
+    return BotResponse(text=success_message)
+
+
+async def verify_confirmed_action(verify_function, num_objects, result_text, update_result):
+    """
+    Verify a confirmed action and add the result of the verification to the result message
+
+    Parameters
+    ----------
+    verify_function : function
+        coroutine function which returns the number of objects the action took effect on
+    num_objects : int
+        number of objects the action was performed on
+    result_text : str
+        text of the posted result message
+    update_result : function
+        coroutine function called with the keyword arguments text and status to update the result
+    """
+
+    num_verified_objects = await verify_function()
+
+    verification_text = "_verified for %d of %d object%s_" % (num_verified_objects, num_objects, plural(num_objects))
+
+    await update_result(text="%s\n%s" % (result_text, verification_text), status=verification_text)
@@ -1,4 +1,6 @@
 
+from functools import partial
+from i2_slack_modules.action_jobs import action_job_queue
 from i2_slack_modules.common import my_own_function_name
 from i2_slack_modules.slack_helper import BotResponse, slack_error_response
 from i2_slack_modules.icinga_connection import *
@@ -6,11 +8,12 @@ from i2_slack_modules.icinga_connection import *
 
 # noinspection PyTypeChecker
 # noinspection PyUnusedLocal
-def enable_disable_action(
+async def enable_disable_action(
         config=None,
         bot_commands=None,
         slack_message=None,
         slack_user=None,
+        slack_user_id=None,
         *args, **kwargs):
     """
     Have a conversation with the user about the attribute the user wants to enable/disable
@@ -25,6 +28,8 @@ def enable_disable_action(
         slack message to parse
     slack_user : SlackUser
         SlackUser object
+    slack_user_id : str
+        Slack id of the user who sent the message
     args, kwargs: None
         used to hold additional args which are just ignored
 
@@ -96,7 +101,8 @@ def enable_disable_action(
         logging.debug("Filter result list empty. Query Icinga for objects.")
 
         # query hosts and services
-        i2_result = get_i2_object(config, this_conversation.sub_command.object_type, None, this_conversation.filter)
+        i2_result = await async_get_i2_object(config, this_conversation.sub_command.object_type, None,
+                                              this_conversation.filter)
 
         # encountered Icinga request issue
         if i2_result.error:
@@ -208,72 +214,94 @@ def enable_disable_action(
         # delete conversation history
         slack_user.reset_conversation()
 
-        i2_handle: object
-        i2_handle, i2_error = setup_icinga_connection(config)
+        job_description = "%s %s" % (this_conversation.command.name, this_conversation.sub_command.name)
+        if this_conversation.sub_command.object_type != "global":
+            job_description += " for %s" % " ".join(this_conversation.filter)
 
-        if not i2_handle:
-            if i2_error is not None:
-                error_message = i2_error
-            else:
-                error_message = "Unknown error while setting up Icinga2 connection"
+        # perform action in the background, progress will be posted
+        action_job = action_job_queue.submit(
+            slack_user, job_description, partial(perform_confirmed_action, config, this_conversation),
+            slack_user_id=slack_user_id
+        )
+
+        return action_job.get_progress_response()
+
+    return None
+
+
+# noinspection PyUnusedLocal
+async def perform_confirmed_action(config, this_conversation, action_job=None):
+    """
+    Perform the enable/disable action the user confirmed
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    this_conversation : SlackConversation
+        the conversation with all details about this action
+    action_job : ActionJob
+        job this action is performed in
 
-            return slack_error_response(header="Icinga request error", error_message=error_message)
+    Returns
+    -------
+    BotResponse: confirmation or error
+    """
 
-        success_message = None
-        i2_error = None
+    i2_handle, i2_error = setup_async_icinga_connection(config)
 
-        enable = True
-        if this_conversation.command.name == "disable":
-            enable = False
+    if not i2_handle:
+        if i2_error is not None:
+            error_message = i2_error
+        else:
+            error_message = "Unknown error while setting up Icinga2 connection"
 
-        logging.debug("Sending command '%s %s' to Icinga2" %
-                      (this_conversation.command.name, this_conversation.sub_command.name))
+        return slack_error_response(header="Icinga request error", error_message=error_message)
 
-        try:
+    success_message = None
+    i2_error = None
 
-            if this_conversation.sub_command.object_type == "global":
+    enable = True
+    if this_conversation.command.name == "disable":
+        enable = False
 
-                success_message = "Successfully %sd %s!" % \
-                                  (this_conversation.command.name, this_conversation.sub_command.name)
+    logging.debug("Sending command '%s %s' to Icinga2" %
+                  (this_conversation.command.name, this_conversation.sub_command.name))
 
-                i2_response = i2_handle.objects.update(
-                    object_type="IcingaApplication",
-                    name="app", attrs={"attrs": {this_conversation.sub_command.icinga_attr_name: enable}}
-                )
+    try:
 
-            else:
+        if this_conversation.sub_command.object_type == "global":
 
-                success_message = "Successfully %sd %s for %s!" % \
-                                  (this_conversation.command.name,
-                                   this_conversation.sub_command.name,
-                                   " ".join(this_conversation.filter))
+            success_message = "Successfully %sd %s!" % \
+                              (this_conversation.command.name, this_conversation.sub_command.name)
 
-                # noinspection PyProtectedMember
-                url_path = '{}/{}'.format(
-                    i2_handle.objects.base_url_path,
-                    i2_handle.objects._convert_object_type(this_conversation.sub_command.object_type)
-                )
+            i2_response = await i2_handle.objects_update(
+                object_type="IcingaApplication",
+                name="app", attrs={this_conversation.sub_command.icinga_attr_name: enable}
+            )
 
-                logging.debug(url_path)
+        else:
 
-                payload = {
-                    'attrs': {
-                        this_conversation.sub_command.icinga_attr_name: enable
-                    },
-                    'filter': this_conversation.filter_used
-                }
+            success_message = "Successfully %sd %s for %s!" % \
+                              (this_conversation.command.name,
+                               this_conversation.sub_command.name,
+                               " ".join(this_conversation.filter))
 
-                # noinspection PyProtectedMember
-                i2_response = i2_handle.objects._request('POST', url_path, payload)
+            i2_response = await i2_handle.objects_update(
+                object_type=this_conversation.sub_command.object_type,
+                attrs={this_conversation.sub_command.icinga_attr_name: enable},
+                filters=this_conversation.filter_used
+            )
 
-        except Exception as e:
-            i2_error = str(e)
-            logging.error("Unable to perform Icinga2 object update: %s" % i2_error)
-            pass
+    except Exception as e:
+        i2_error = str(e)
+        logging.error("Unable to perform Icinga2 object update: %s" % i2_error)
+        pass
 
-        if i2_error:
-            return slack_error_response(header="Icinga request error", error_message=i2_error)
+    # objects have changed, don't answer the next requests from cache
+    response_cache.invalidate()
 
-        return BotResponse(text=success_message)
+    if i2_error:
+        return slack_error_response(header="Icinga request error", error_message=i2_error)
 
-    return None
+    return BotResponse(text=success_message)
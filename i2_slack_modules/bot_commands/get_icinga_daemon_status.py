@@ -2,12 +2,12 @@
 from i2_slack_modules import enabled_disabled
 from i2_slack_modules.common import ts_to_date
 from i2_slack_modules.slack_helper import BotResponse
-from i2_slack_modules.icinga_connection import get_i2_status
+from i2_slack_modules.icinga_connection import async_get_i2_status
 
 
 # noinspection PyTypeChecker
 # noinspection PyUnusedLocal
-def get_icinga_daemon_status(config=None, startup=False, *args, **kwargs):
+async def get_icinga_daemon_status(config=None, startup=False, *args, **kwargs):
     """
     Get the current status of the Icinga2 instance
 
@@ -25,7 +25,7 @@ def get_icinga_daemon_status(config=None, startup=False, *args, **kwargs):
     BotResponse: questions about the action, confirmations or errors
     """
 
-    i2_status = get_i2_status(config, "")
+    i2_status = await async_get_i2_status(config, "")
 
     icingaapplication = {
         "component_name": "IcingaApplication",
@@ -1,10 +1,10 @@
 
 from i2_slack_modules.slack_helper import *
-from i2_slack_modules.icinga_connection import get_i2_status
+from i2_slack_modules.icinga_connection import async_get_i2_status
 
 
 # noinspection PyUnusedLocal
-def get_icinga_status_overview(config=None, *args, **kwargs):
+async def get_icinga_status_overview(config=None, *args, **kwargs):
     """return overview of current host and service status
 
     Parameters
@@ -21,7 +21,7 @@ def get_icinga_status_overview(config=None, *args, **kwargs):
 
     response = BotResponse(text="Status Overview")
 
-    i2_status = get_i2_status(config, "CIB")
+    i2_status = await async_get_i2_status(config, "CIB")
 
     if i2_status.error:
         return slack_error_response(header="Icinga request error", error_message=i2_status.error)
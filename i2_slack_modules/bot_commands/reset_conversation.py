@@ -3,7 +3,7 @@ from i2_slack_modules.classes import BotResponse
 
 
 # noinspection PyUnusedLocal
-def reset_conversation(slack_user=None, *args, **kwargs):
+async def reset_conversation(slack_user=None, *args, **kwargs):
     """
     reset a conversation
 
@@ -1,18 +1,39 @@
 
-from i2_slack_modules import yes_no, enabled_disabled
+from i2_slack_modules import yes_no, enabled_disabled, slack_max_message_blocks
 from i2_slack_modules.common import ts_to_date
+from i2_slack_modules.classes import CommentDowntimeIndex, ResultCursor, SlackFile
 from i2_slack_modules.slack_helper import *
 from i2_slack_modules.icinga_connection import *
 
 max_messages_to_display_detailed_status = 4
 
+# leave room for the header and the page hint
+max_result_page_blocks = slack_max_message_blocks - 2
+
+
+def get_result_page_hint(result_cursor):
+    """
+    Return a hint how to get the next page of a status result
+
+    Parameters
+    ----------
+    result_cursor : ResultCursor
+        the result cursor of the Slack user
+
+    Returns
+    -------
+    str: hint to display below the page
+    """
+
+    return "_Page %d, there are more results. Use `more` to display the next page._" % result_cursor.page
+
 
 # noinspection PyUnusedLocal
-def run_icinga_status_query(config=None,
-                            slack_message=None,
-                            bot_commands=None,
-                            slack_user=None,
-                            *args, **kwargs):
+async def run_icinga_status_query(config=None,
+                                  slack_message=None,
+                                  bot_commands=None,
+                                  slack_user=None,
+                                  *args, **kwargs):
     """
     Query Icinga2 to get host/service status based on Slack command
 
@@ -102,9 +123,36 @@ def run_icinga_status_query(config=None,
 
         slack_user.add_last_filter(i2_filter_names)
 
-        i2_response = get_i2_object(config, status_type, i2_filter_status, i2_filter_names, acknowledged, downtime)
-        i2_comments_response = get_i2_object(config, f"{status_type}Comment", i2_filter_status, i2_filter_names)
-        i2_downtime_response = get_i2_object(config, f"{status_type}Downtime", i2_filter_status, i2_filter_names)
+        # request objects, comments and downtimes at the same time
+        i2_response, i2_comments_response, i2_downtime_response = await async_get_i2_objects(config, [
+            {
+                "object_type": status_type,
+                "filter_states": i2_filter_status,
+                "filter_names": i2_filter_names,
+                "acknowledged": acknowledged,
+                "downtime": downtime
+            },
+            {
+                "object_type": f"{status_type}Comment",
+                "filter_states": i2_filter_status,
+                "filter_names": i2_filter_names
+            },
+            {
+                "object_type": f"{status_type}Downtime",
+                "filter_states": i2_filter_status,
+                "filter_names": i2_filter_names
+            }
+        ])
+
+        # objects can still be displayed, just without comment and downtime details
+        missing_details = list()
+        for detail_name, detail_response in [("comments", i2_comments_response), ("downtimes", i2_downtime_response)]:
+            if detail_response.error:
+                missing_details.append(detail_name)
+                detail_response.data = list()
+
+        # index comments and downtimes once to look them up for each object
+        comment_downtime_index = CommentDowntimeIndex(i2_comments_response.data, i2_downtime_response.data)
 
         if i2_response.error:
             response = slack_error_response(header="Icinga request error", error_message=i2_response.error)
@@ -121,6 +169,9 @@ def run_icinga_status_query(config=None,
             block_text = "Found %d matching %s%s" % \
                          (len(i2_response.data), status_type.lower(), plural(len(i2_response.data)))
 
+            if len(missing_details) > 0:
+                block_text += "\n_(unable to get %s in time)_" % " and ".join(missing_details)
+
             response.add_block(block_text)
 
             for icinga_object in i2_response.data:
@@ -147,13 +198,11 @@ def run_icinga_status_query(config=None,
 
                 # get comments for this object
                 object_comment_list = \
-                    [item for item in i2_comments_response.data
-                     if item["host_name"] == host_name and item["service_name"] == comment_downtime_service_name]
+                    comment_downtime_index.get(host_name, comment_downtime_service_name, "Comment")
 
                 # get downtimes for this object
                 object_downtime_list = \
-                    [item for item in i2_downtime_response.data
-                     if item["host_name"] == host_name and item["service_name"] == comment_downtime_service_name]
+                    comment_downtime_index.get(host_name, comment_downtime_service_name, "Downtime")
 
                 # add speech bubble if object has comments
                 if len(object_comment_list) > 0:
@@ -244,10 +293,45 @@ def run_icinga_status_query(config=None,
             block_text = "Found %d matching %s%s" % \
                          (len(i2_response.data), status_type.lower(), plural(len(i2_response.data)))
 
+            if len(missing_details) > 0:
+                block_text += "\n_(unable to get %s in time)_" % " and ".join(missing_details)
+
             response.text = "Icinga status response"
-            response.add_block(block_text)
-            response.add_block(format_slack_response(config, status_type, i2_response.data,
-                                                     [*i2_comments_response.data, *i2_downtime_response.data]))
+
+            # upload big results as file and just post a summary
+            file_upload_threshold = get_file_upload_threshold(config)
+            if 0 < file_upload_threshold < len(i2_response.data):
+
+                response.add_block(block_text + "\n_Too many results to display, see attached file._")
+                response.add_file(SlackFile(
+                    filename="%s_status.csv" % status_type.lower(),
+                    title="Icinga %s status" % status_type.lower(),
+                    filetype="csv",
+                    lines=iterate_csv_lines(
+                        iterate_status_csv_rows(status_type, i2_response.data, comment_downtime_index))
+                ))
+
+                slack_user.set_result_cursor(None)
+
+            else:
+                response.add_block(block_text)
+
+                # format only one page of the result, the next pages can be requested with the "more" command
+                result_cursor = ResultCursor(
+                    iterate_slack_block_texts(
+                        iterate_formatted_objects(config, status_type, i2_response.data, comment_downtime_index)),
+                    description="Found %d matching %s%s" %
+                                (len(i2_response.data), status_type.lower(), plural(len(i2_response.data))),
+                    page_size=max_result_page_blocks
+                )
+
+                response.add_block(result_cursor.get_next_page())
+
+                if result_cursor.has_more():
+                    slack_user.set_result_cursor(result_cursor)
+                    response.add_block(get_result_page_hint(result_cursor))
+                else:
+                    slack_user.set_result_cursor(None)
 
         # the result returned empty
         else:
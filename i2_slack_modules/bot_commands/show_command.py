@@ -1,11 +1,53 @@
 
+from i2_slack_modules import yes_no
 from i2_slack_modules.common import ts_to_date, my_own_function_name
 from i2_slack_modules.slack_helper import *
 from i2_slack_modules.icinga_connection import *
+from i2_slack_modules.classes import SlackFile
+
+
+def iterate_comment_downtime_csv_rows(sub_command_name, result_list):
+    """
+    Return comments, acknowledgements or downtimes lazily as rows
+
+    Parameters
+    ----------
+    sub_command_name : str
+        name of the show sub command (comment, acknowledgement or downtime)
+    result_list : list
+        list of Icinga comment or downtime objects
+
+    Returns
+    -------
+    Generator: yields a header row and a row for each object
+    """
+
+    if sub_command_name == "downtime":
+        yield ["host", "service", "author", "entry time", "comment", "fixed", "start time", "end time", "duration"]
+    else:
+        yield ["host", "service", "author", "entry time", "text", "expire time"]
+
+    for result in result_list:
+
+        row = [result.get("host_name"), result.get("service_name") or "", result.get("author"),
+               ts_to_date(result.get("entry_time"))]
+
+        if sub_command_name == "downtime":
+            row.extend([result.get("comment"), yes_no(result.get("fixed") is True),
+                        ts_to_date(result.get("start_time")), ts_to_date(result.get("end_time")),
+                        result.get("duration")])
+        else:
+            expire_time = ""
+            if result.get("expire_time") is not None and result.get("expire_time") > 0:
+                expire_time = ts_to_date(result.get("expire_time"))
+
+            row.extend([result.get("text"), expire_time])
+
+        yield row
 
 
 # noinspection PyUnusedLocal
-def show_command(
+async def show_command(
         config=None,
         bot_commands=None,
         slack_message=None,
@@ -86,13 +128,13 @@ def show_command(
     result_list = list()
     if len(split_slack_message) <= 1:
 
-        i2_result = get_i2_object(config, f"Host{object_type}", object_filter, split_slack_message)
+        i2_result = await async_get_i2_object(config, f"Host{object_type}", object_filter, split_slack_message)
 
         result_list.extend(i2_result.data)
 
     if i2_result is None or (i2_result.error is None and len(i2_result.data) == 0):
 
-        i2_result = get_i2_object(config, f"Service{object_type}", object_filter, split_slack_message)
+        i2_result = await async_get_i2_object(config, f"Service{object_type}", object_filter, split_slack_message)
 
         result_list.extend(i2_result.data)
 
@@ -116,6 +158,22 @@ def show_command(
 
     result_list = sorted(result_list, key=lambda k: (k['host_name'], k['service_name'], k['entry_time']))
 
+    # upload big results as file and just post a summary
+    file_upload_threshold = get_file_upload_threshold(config)
+    if 0 < file_upload_threshold < len(result_list):
+
+        response = BotResponse(text="Icinga %s %ss response" % (called_command.name, called_sub_command.name))
+        response.add_block("Found %d matching %s%s\n_Too many results to display, see attached file._" %
+                           (len(result_list), called_sub_command.name, plural(len(result_list))))
+        response.add_file(SlackFile(
+            filename="%ss.csv" % called_sub_command.name,
+            title="Icinga %ss" % called_sub_command.name,
+            filetype="csv",
+            lines=iterate_csv_lines(iterate_comment_downtime_csv_rows(called_sub_command.name, result_list))
+        ))
+
+        return response
+
     block_text_list = list()
     for result in result_list:
 
@@ -0,0 +1,47 @@
+
+from i2_slack_modules.classes import BotResponse
+from i2_slack_modules.common import ts_to_date
+from i2_slack_modules.action_jobs import action_job_queue
+
+
+# noinspection PyUnusedLocal
+async def show_jobs(*args, **kwargs):
+    """
+    List all queued, running and recently finished action jobs
+
+    Parameters
+    ----------
+    args, kwargs: None
+        used to hold additional args which are just ignored
+
+    Returns
+    -------
+    BotResponse: with a list of jobs
+    """
+
+    jobs = action_job_queue.get_jobs()
+
+    if len(jobs) == 0:
+        return BotResponse(text="There are no running or recent jobs.")
+
+    active_lines = list()
+    finished_lines = list()
+
+    for job in reversed(jobs):
+        job_line = "• %s\n\t_requested by %s at %s_" % \
+                   (job.get_status_text(), job.user_name or "unknown user", ts_to_date(job.created))
+
+        if job.is_done():
+            finished_lines.append(job_line)
+        else:
+            active_lines.append(job_line)
+
+    response = BotResponse(text="Action jobs")
+
+    if len(active_lines) > 0:
+        response.add_block("*Running and queued jobs*\n" + "\n".join(active_lines))
+
+    if len(finished_lines) > 0:
+        response.add_block("*Recently finished jobs*\n" + "\n".join(finished_lines))
+
+    return response
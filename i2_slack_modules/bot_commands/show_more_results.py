@@ -0,0 +1,36 @@
+from i2_slack_modules.classes import BotResponse
+from i2_slack_modules.bot_commands.run_icinga_status_query import get_result_page_hint
+
+
+# noinspection PyUnusedLocal
+async def show_more_results(slack_user=None, *args, **kwargs):
+    """
+    return the next page of the last status result of this user
+
+    Parameters
+    ----------
+    slack_user : SlackUser
+        SlackUser object
+    args, kwargs: None
+        used to hold additional args which are just ignored
+
+    Returns
+    -------
+    BotResponse: with the next page of results
+    """
+
+    if slack_user is None or slack_user.result_cursor is None or not slack_user.result_cursor.has_more():
+        return BotResponse(text="There are no more results to display. Please run a status command first.")
+
+    result_cursor = slack_user.result_cursor
+
+    response = BotResponse(text="Icinga status response")
+    response.add_block("%s (page %d)" % (result_cursor.description, result_cursor.page + 1))
+    response.add_block(result_cursor.get_next_page())
+
+    if result_cursor.has_more():
+        response.add_block(get_result_page_hint(result_cursor))
+    else:
+        slack_user.set_result_cursor(None)
+
+    return response
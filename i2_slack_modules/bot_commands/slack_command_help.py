@@ -3,7 +3,7 @@ from i2_slack_modules.slack_helper import BotResponse
 
 
 # noinspection PyUnusedLocal
-def slack_command_help(config=None, slack_message=None, bot_commands=None, *args, **kwargs):
+async def slack_command_help(config=None, slack_message=None, bot_commands=None, *args, **kwargs):
     """
     Return a short command description
 
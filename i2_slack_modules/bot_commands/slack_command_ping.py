@@ -3,7 +3,7 @@ from i2_slack_modules.classes import BotResponse
 
 
 # noinspection PyUnusedLocal
-def slack_command_ping(*args, **kwargs):
+async def slack_command_ping(*args, **kwargs):
     """
     Just respond with a simple pong
 
@@ -3,11 +3,15 @@
 # Define commonly used classes
 #
 
+import asyncio
 import json
 import logging
+import os
+import random
 from datetime import datetime
 import i2_slack_modules
 from i2_slack_modules.common import my_own_function_name
+from i2_slack_modules.slack_post_pipeline import slack_post_pipeline
 from slack import WebClient
 
 
@@ -23,6 +27,12 @@ class BotResponse:
         holds all the Slack message blocks
     attachments : list, dict, SlackAttachment
         holds all the Slack message attachments
+    post_priority : int
+        messages with lower priority values are posted to Slack first
+    files : list
+        holds all SlackFile objects which will be uploaded with this response
+    action_job : ActionJob
+        the job this response reports the progress of
 
     Methods
     -------
@@ -31,6 +41,8 @@ class BotResponse:
         a block using method get_single_block()
     add_attachment(attachment)
         adds a new attachment to this response.
+    add_file(slack_file)
+        adds a SlackFile which will be uploaded after the message has been posted.
     dump_attachments()
         returns this.attachments as json blob
     get_single_block(text)
@@ -44,6 +56,9 @@ class BotResponse:
         self.text = text
         self.blocks = []
         self.attachments = []
+        self.post_priority = i2_slack_modules.slack_post_priority_default
+        self.files = []
+        self.action_job = None
 
         if blocks:
             self.add_block(blocks)
@@ -74,6 +89,11 @@ class BotResponse:
         elif isinstance(attachment, SlackAttachment):
             self.attachments.append(vars(attachment))
 
+    def add_file(self, slack_file):
+
+        if slack_file is not None:
+            self.files.append(slack_file)
+
     def dump_attachments(self):
 
         if len(self.attachments) == 0:
@@ -115,6 +135,122 @@ class SlackAttachment:
         pass
 
 
+class SlackFile:
+    """
+    A class used to represent a file which will be uploaded to Slack
+
+    Attributes
+    ----------
+    filename : str
+        name of the file
+    title : str
+        title of the file displayed in Slack
+    filetype : str
+        Slack file type like "csv" or "text"
+    lines : iterable
+        the lines of the file, will be consumed once while uploading the file
+    """
+
+    def __init__(self, filename, title=None, filetype="text", lines=None):
+        self.filename = filename
+        self.title = title or filename
+        self.filetype = filetype
+        self.lines = lines or list()
+
+
+class CommentDowntimeIndex:
+    """
+    A class used to index Icinga2 comments and downtimes by the object they belong to
+
+    Attributes
+    ----------
+    index : dict
+        holds a dict with a list of items per item type for each (host_name, service_name)
+
+    Methods
+    -------
+    add(item)
+        adds a comment or downtime to the index
+    get(host_name, service_name, item_type)
+        returns a list of all comments or downtimes of this object
+    count(host_name, service_name, item_type)
+        returns the number of comments or downtimes of this object
+    """
+
+    def __init__(self, *item_lists):
+
+        self.index = dict()
+
+        for item_list in item_lists:
+            for item in item_list or list():
+                self.add(item)
+
+    def add(self, item):
+
+        key = (item.get("host_name"), item.get("service_name") or "")
+
+        self.index.setdefault(key, dict()).setdefault(item.get("type"), list()).append(item)
+
+    def get(self, host_name, service_name=None, item_type="Comment"):
+
+        return self.index.get((host_name, service_name or ""), dict()).get(item_type, list())
+
+    def count(self, host_name, service_name=None, item_type="Comment"):
+
+        return len(self.get(host_name, service_name, item_type))
+
+
+class ResultCursor:
+    """
+    A class used to hold a lazily formatted status result which
+    will be returned page by page.
+
+    Attributes
+    ----------
+    block_texts : iterator
+        yields the text of each block of the formatted result
+    description : str
+        description of the result used as header on each page
+    page_size : int
+        number of blocks per page
+    page : int
+        number of pages returned so far
+
+    Methods
+    -------
+    get_next_page()
+        returns the blocks of the next page
+    has_more()
+        returns True if more blocks can be returned
+    """
+
+    _exhausted = object()
+
+    def __init__(self, block_texts, description=None, page_size=None):
+        self.block_texts = iter(block_texts)
+        self.description = description
+        self.page_size = page_size or i2_slack_modules.slack_max_message_blocks
+        self.page = 0
+        self._next_block_text = next(self.block_texts, self._exhausted)
+
+    def has_more(self):
+
+        return self._next_block_text is not self._exhausted
+
+    def get_next_page(self):
+
+        blocks = list()
+
+        while self.has_more() and len(blocks) < self.page_size:
+            blocks.extend(BotResponse.get_single_block(self._next_block_text))
+            self._next_block_text = next(self.block_texts, self._exhausted)
+
+        if len(blocks) > 0:
+            self.page += 1
+
+        return blocks
+
+
 class SlackConversation:
     command = None
     filter = None
@@ -154,9 +290,11 @@ class SlackUser:
 
     last_filter = None
     conversation = None
+    result_cursor = None
     id = None
     data = dict()
     data_last_updated = 0
+    data_expire_jitter = 0
 
     def __init__(self, data: dict = None):
 
@@ -172,6 +310,9 @@ class SlackUser:
         if self.conversation is None:
             self.conversation = SlackConversation()
 
+    def set_result_cursor(self, result_cursor=None):
+        self.result_cursor = result_cursor
+
     def add_last_filter(self, filter_expression):
         self.last_filter = filter_expression
 
@@ -189,15 +330,36 @@ class SlackUsers:
     """
     A class used to fetch and hold information about
     the slack user talking to this bot.
+
+    All users of the workspace are loaded at startup and
+    are kept in a cache file to be available right after a restart.
     """
 
     # user_data_cache_timeout defines after how many seconds
     # user date should be fetched again
     user_data_cache_timeout = 1800
 
+    # up to this many seconds are added randomly to the timeout of each user
+    # to spread refreshes of users fetched at the same time
+    user_data_cache_jitter = 300
+
+    # only these user attributes are kept
+    user_data_attributes = ["id", "name", "real_name", "tz", "deleted", "is_bot"]
+
+    # number of users requested per users.list page
+    user_list_page_size = 200
+
+    # changed user data is written to the cache file after this many seconds
+    user_cache_write_delay = 60
+
     web_handle = None
+    cache_file = None
+    cache_dirty = False
+    cache_write_task = None
+    cache_write_lock = None
     user_data = dict()
     users = dict()
+    refresh_tasks = dict()
 
     def get(self, user_id: str) -> SlackUser:
         """
@@ -237,6 +399,185 @@ class SlackUsers:
 
         self.web_handle = web_handle
 
+    def set_user_data(self, user_id: str, data: dict, data_last_updated: float = None) -> None:
+        """
+        Set the data of a user
+
+        Parameters
+        ----------
+        user_id: str
+            user id to set data for
+        data: dict
+            user data as returned by Slack
+        data_last_updated: float, optional
+            time stamp when data has been fetched (default: now)
+        """
+
+        user = self.get(user_id)
+        user.data = {key: value for key, value in data.items() if key in self.user_data_attributes}
+        user.data_last_updated = data_last_updated or datetime.now().timestamp()
+        user.data_expire_jitter = random.uniform(0, self.user_data_cache_jitter)
+
+    def set_cache_file(self, cache_file: str = None) -> None:
+        """
+        Set the path of the user data cache file
+
+        Parameters
+        ----------
+        cache_file: str
+            path to cache file, if empty user data won't be cached
+        """
+
+        self.cache_file = cache_file or None
+
+    def load_cache_file(self) -> None:
+        """
+        Load user data from cache file
+        """
+
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+
+        try:
+            with open(self.cache_file) as cache_file:
+                cached_users = json.load(cache_file)
+        except Exception as e:
+            logging.error("Unable to read Slack user cache file '%s': %s" % (self.cache_file, str(e)))
+            return
+
+        for user_id, cached_user in cached_users.items():
+            self.set_user_data(user_id, cached_user.get("data", dict()), cached_user.get("data_last_updated", 0))
+
+        logging.info("Loaded %d Slack users from cache file '%s'" % (len(cached_users), self.cache_file))
+
+    def write_cache_file(self, cached_users: dict) -> None:
+        """
+        Write user data to cache file, blocks and should be called in an executor
+
+        Parameters
+        ----------
+        cached_users: dict
+            data and time stamp of each user by user id
+        """
+
+        # write to a temporary file first to never leave a broken cache file behind
+        try:
+            with open("%s.tmp" % self.cache_file, "w") as cache_file:
+                json.dump(cached_users, cache_file)
+            os.replace("%s.tmp" % self.cache_file, self.cache_file)
+        except Exception as e:
+            logging.error("Unable to write Slack user cache file '%s': %s" % (self.cache_file, str(e)))
+            return
+
+        logging.debug("Wrote %d Slack users to cache file '%s'" % (len(cached_users), self.cache_file))
+
+    def mark_cache_dirty(self) -> None:
+        """
+        Mark user data as changed, the cache file will be written after user_cache_write_delay seconds
+        """
+
+        if self.cache_file is None:
+            return
+
+        self.cache_dirty = True
+
+        if self.cache_write_task is None:
+            self.cache_write_task = asyncio.ensure_future(self.flush_cache_file_later())
+
+    async def flush_cache_file_later(self) -> None:
+        """
+        Write the cache file after user_cache_write_delay seconds
+        """
+
+        try:
+            await asyncio.sleep(self.user_cache_write_delay)
+        finally:
+            self.cache_write_task = None
+
+        await self.flush_cache_file()
+
+    async def flush_cache_file(self) -> None:
+        """
+        Write the cache file in an executor if user data changed
+        """
+
+        if self.cache_write_lock is None:
+            self.cache_write_lock = asyncio.Lock()
+
+        # only one write at a time, they use the same temporary file
+        async with self.cache_write_lock:
+
+            if self.cache_dirty is False or self.cache_file is None:
+                return
+
+            self.cache_dirty = False
+
+            # user data dicts are replaced and never changed, it's safe to dump them in another thread
+            cached_users = dict()
+            for user_id, user in self.users.items():
+                if user_id is not None and len(user.data) > 0:
+                    cached_users[user_id] = {"data": user.data, "data_last_updated": user.data_last_updated}
+
+            await asyncio.get_event_loop().run_in_executor(None, self.write_cache_file, cached_users)
+
+    async def load_all_users(self, web_handle: WebClient) -> None:
+        """
+        Fetch data of all users of this workspace page by page with users.list
+
+        Parameters
+        ----------
+        web_handle: WebClient
+            async slack web handle to use
+        """
+
+        num_users = 0
+        cursor = None
+
+        while True:
+            list_args = {"limit": self.user_list_page_size}
+            if cursor:
+                list_args["cursor"] = cursor
+
+            list_response = await slack_post_pipeline.call_api(web_handle, "users.list", **list_args)
+
+            if list_response.error:
+                logging.error("Unable to fetch Slack user list: %s" % list_response.error)
+                break
+
+            for member in list_response.text.get("members") or list():
+                if member.get("id") is not None:
+                    self.set_user_data(member.get("id"), member)
+                    num_users += 1
+
+            cursor = (list_response.text.get("response_metadata") or dict()).get("next_cursor")
+
+            if not cursor:
+                break
+
+        logging.info("Fetched data of %d Slack users" % num_users)
+
+        if num_users > 0:
+            self.cache_dirty = True
+            await self.flush_cache_file()
+
+    async def run_user_list_refresh(self, web_handle: WebClient) -> None:
+        """
+        Load all users now and then every time user_data_cache_timeout expired
+
+        Parameters
+        ----------
+        web_handle: WebClient
+            async slack web handle to use
+        """
+
+        while True:
+            try:
+                await self.load_all_users(web_handle)
+            except Exception as e:
+                logging.error("Unable to load Slack users: %s" % str(e))
+
+            await asyncio.sleep(self.user_data_cache_timeout)
+
     def is_user_data_expired(self, user_id: str) -> (bool, None):
         """
         Returns True or False depending if seconds passed between
@@ -260,46 +601,97 @@ class SlackUsers:
         this_user = self.get(user_id)
 
         if this_user is not None and \
-                this_user.data_last_updated + self.user_data_cache_timeout >= datetime.now().timestamp():
+                this_user.data_last_updated + self.user_data_cache_timeout + this_user.data_expire_jitter >= \
+                datetime.now().timestamp():
             return False
 
         logging.debug("User data cache for user '%s' expired." % user_id)
 
         return True
 
-    async def fetch_slack_user_info(self, user_id: str) -> None:
+    def schedule_user_info_refresh(self, user_id: str) -> (asyncio.Future, None):
         """
-        Fetch user data for user_id from Slack
+        Start fetching user data for user_id from Slack in the background
+        if the cached data expired. Only one request per user is in flight.
 
         Parameters
         ----------
         user_id: str
-            user id to return data for
+            user id to refresh data for
 
+        Returns
+        -------
+        asyncio.Future, None: the refresh in flight or None if data is still valid
         """
 
         if self.web_handle is None:
-            logging.error("%: function called before attribute web_handle set.", my_own_function_name())
+            logging.error("%s: function called before attribute web_handle set." % my_own_function_name())
             return
 
         if user_id is None:
-            logging.error("%: user_id not provided.", my_own_function_name())
+            logging.error("%s: user_id not provided." % my_own_function_name())
             return
 
+        refresh_task = self.refresh_tasks.get(user_id)
+
+        if refresh_task is not None:
+            logging.debug("User data for user '%s' already being fetched." % user_id)
+            return refresh_task
+
         if self.is_user_data_expired(user_id) is False:
             return
 
+        refresh_task = asyncio.ensure_future(self.request_slack_user_info(user_id))
+        self.refresh_tasks[user_id] = refresh_task
+
+        def refresh_done(future):
+            if self.refresh_tasks.get(user_id) is future:
+                del self.refresh_tasks[user_id]
+            if not future.cancelled() and future.exception() is not None:
+                logging.error("Unable to fetch user data for user '%s': %s" % (user_id, str(future.exception())))
+
+        refresh_task.add_done_callback(refresh_done)
+
+        return refresh_task
+
+    async def fetch_slack_user_info(self, user_id: str) -> None:
+        """
+        Fetch user data for user_id from Slack if cached data expired
+        and wait until it's done
+
+        Parameters
+        ----------
+        user_id: str
+            user id to return data for
+
+        """
+
+        refresh_task = self.schedule_user_info_refresh(user_id)
+
+        if refresh_task is not None:
+            await asyncio.shield(refresh_task)
+
+    async def request_slack_user_info(self, user_id: str) -> None:
+        """
+        Request user data for user_id from Slack
+
+        Parameters
+        ----------
+        user_id: str
+            user id to request data for
+
+        """
+
         logging.debug("No cached user data found. Fetching from Slack.")
 
-        slack_user_data = await self.web_handle.users_info(user=user_id)
+        info_response = await slack_post_pipeline.call_api(self.web_handle, "users.info", user=user_id)
 
-        if slack_user_data is not None and slack_user_data.get("user"):
+        if info_response.error is None and info_response.text is not None and info_response.text.get("user"):
             logging.debug("Successfully fetched user data.")
 
-            user = self.get(user_id)
-            user.data = slack_user_data.get("user")
-            user.data_last_updated = datetime.now().timestamp()
+            self.set_user_data(user_id, info_response.text.get("user"))
+            self.mark_cache_dirty()
         else:
-            logging.error("Unable to fetched user data.")
+            logging.error("Unable to fetched user data: %s" % info_response.error)
 
 # EOF
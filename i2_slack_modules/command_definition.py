@@ -14,7 +14,9 @@ from i2_slack_modules.bot_commands import (
     chat_with_user,
     get_icinga_daemon_status,
     enable_disable_action,
-    show_command
+    show_command,
+    show_more_results,
+    show_jobs
 )
 import logging
 from typing import Callable, Tuple, Optional
@@ -135,7 +137,8 @@ implemented_commands = [
         "long_description": "This command displays all implemented commands and details about each command\n"
                             "You can access the detailed help with `help <command>` and it will return a\n"
                             "detailed help about this particular command.",
-        "command_handler": "slack_command_help"
+        "command_handler": "slack_command_help",
+        "timeout": 10
     },
     {
         "name": "ping",
@@ -143,7 +146,8 @@ implemented_commands = [
         "short_description": "bot will answer with `pong`",
         "long_description": "This can simply be used to see if the bot is still alive."
                             " Bot will simply answer with `pong`.",
-        "command_handler": "slack_command_ping"
+        "command_handler": "slack_command_ping",
+        "timeout": 5
     },
     {
         "name": "service status",
@@ -219,6 +223,16 @@ implemented_commands = [
                             "objects are acknowledged or in a downtime and how many are unhandled.",
         "command_handler": "get_icinga_status_overview"
     },
+    {
+        "name": "more",
+        "shortcut": "next",
+        "short_description": "display the next page of the last status result",
+        "long_description": "Big status results are split into pages and only the first page will be displayed.\n"
+                            "Use this command to display the next page of your last host or service status "
+                            "command.",
+        "command_handler": "show_more_results",
+        "timeout": 10
+    },
     {
         "name": "acknowledge",
         "shortcut": "ack",
@@ -300,6 +314,24 @@ implemented_commands = [
                             "`com <service> with <comment>`\n",
         "command_handler": "chat_with_user"
     },
+    {
+        "name": "reschedule and wait",
+        "shortcut": "rsw",
+        "short_description": "reschedule a host/service check and wait for the results",
+        "long_description": "This command works like `reschedule` but the bot waits for "
+                            "the new check results and adds them to the result message as "
+                            "they come in. Waiting stops once all results have been received "
+                            "or after two minutes.\n"
+                            "*SORT CUT:*\n"
+                            "It's also possible to short cut and just issue the "
+                            "action in one command:\n"
+                            "`rsw my-server ntp`\n"
+                            "*STRUCTURE:*\n"
+                            "`rsw <host> <service>` or\n"
+                            "`rsw <host>` or\n"
+                            "`rsw <service>`\n",
+        "command_handler": "chat_with_user"
+    },
     {
         "name": "reschedule",
         "shortcut": "rs",
@@ -422,6 +454,15 @@ implemented_commands = [
                             "if all endpoints are connected.",
         "command_handler": "get_icinga_daemon_status"
     },
+    {
+        "name": "jobs",
+        "shortcut": None,
+        "short_description": "list running and recent actions",
+        "long_description": "Confirmed actions like acknowledgements or downtimes are performed in the background.\n"
+                            "This command lists all running and queued actions and the recently finished ones.",
+        "command_handler": "show_jobs",
+        "timeout": 10
+    },
     {
         "name": "enable",
         "shortcut": "ena",
@@ -450,6 +491,11 @@ class BotCommands:
 
     This will represent the list 'implemented_commands' as
     a class and each command as a attribute.
+
+    All command names and shortcuts are added to a prefix trie once,
+    so finding the called command only needs to look at each character
+    of a Slack message once. Once built, the commands can't be changed.
+    Use the module instance 'bot_commands' instead of creating new ones.
     """
 
     class _SingleCommand:
@@ -468,6 +514,25 @@ class BotCommands:
                 else:
                     setattr(self, key, dictionary[key])
 
+            self.command_starts = [self.name]
+
+            if getattr(self, "shortcut", None):
+                if isinstance(self.shortcut, list):
+                    self.command_starts.extend(self.shortcut)
+                elif isinstance(self.shortcut, str):
+                    self.command_starts.append(self.shortcut)
+                else:
+                    logging.error("Error parsing \"implemented_commands\". "
+                                  "Command (%s) shortcut must be a string or a list" % self.name)
+
+            # resolve command handler once
+            self.command_handler_function = None
+            if getattr(self, "command_handler", None) is not None:
+                self.command_handler_function = globals().get(self.command_handler)
+                if self.command_handler_function is None:
+                    logging.error("command_handler function '%s' for command '%s' not found in global scope" %
+                                  (self.command_handler, self.name))
+
         def __repr__(self) -> str:
             return str(self.__dict__)
 
@@ -493,19 +558,8 @@ class BotCommands:
             command_string_identified = None
             slack_message_without_command = None
 
-            command_starts_with = [self.name]
-
-            if self.shortcut:
-                if isinstance(self.shortcut, list):
-                    command_starts_with.extend(self.shortcut)
-                elif isinstance(self.shortcut, str):
-                    command_starts_with.append(self.shortcut)
-                else:
-                    logging.error("Error parsing \"implemented_commands\". "
-                                  "Command (%s) shortcut must be a string or a list" % self.name)
-
             # iterate over possible command starts and return if match was found
-            for command_start in command_starts_with:
+            for command_start in self.command_starts:
                 if slack_message.lower() == command_start.lower() or \
                         slack_message.lower().startswith(command_start.lower() + " "):
 
@@ -542,14 +596,11 @@ class BotCommands:
             -------
             Callable: command handler function
             """
-            try:
-                return globals()[self.command_handler]
-            except KeyError:
-                logging.error("command_handler function '%s' for command '%s' not found in global scope" %
-                              (self.command_handler, self.name))
-            except AttributeError:
+            if getattr(self, "command_handler", None) is None:
                 logging.error("command_handler for command '%s' not defined in command_definition.py" % self.name)
 
+            return self.command_handler_function
+
         def has_sub_commands(self) -> bool:
             """
             This method will return True or False depending
@@ -571,8 +622,34 @@ class BotCommands:
         """
         if command_list is None:
             command_list = implemented_commands
-        for command in command_list:
-            setattr(self, command.get("name").replace(" ", "_"), self._SingleCommand(command))
+
+        commands = list()
+        command_trie = dict()
+
+        for command_order, command in enumerate(command_list):
+            single_command = self._SingleCommand(command)
+            setattr(self, command.get("name").replace(" ", "_"), single_command)
+            commands.append(single_command)
+
+            # add each command start to trie, the end of a command start is marked with key ""
+            for command_start in single_command.command_starts:
+                trie_node = command_trie
+                for char in command_start.lower():
+                    trie_node = trie_node.setdefault(char, dict())
+
+                # first defined command wins, same as iterating over all commands
+                if "" not in trie_node or trie_node[""][0] > command_order:
+                    trie_node[""] = (command_order, single_command)
+
+        self._commands = tuple(commands)
+        self._command_trie = command_trie
+        self._frozen = True
+
+    def __setattr__(self, key, value):
+        if getattr(self, "_frozen", False) is True:
+            raise AttributeError("BotCommands can't be changed after they have been built")
+
+        super().__setattr__(key, value)
 
     def get_command_called(self, slack_message: str) -> _SingleCommand:
         """
@@ -587,14 +664,35 @@ class BotCommands:
         -------
         dict: response with command object if found
         """
-        for command in self:
-            command_part, _ = command.split_message(slack_message)
-            if command_part:
-                return command
+
+        found_command = None
+        trie_node = self._command_trie
+        message_length = len(slack_message)
+
+        for position, char in enumerate(slack_message):
+
+            for lower_char in char.lower():
+                trie_node = trie_node.get(lower_char)
+                if trie_node is None:
+                    break
+
+            if trie_node is None:
+                break
+
+            # a command start only matches a whole word
+            match = trie_node.get("")
+            if match is not None and (position + 1 == message_length or slack_message[position + 1] == " "):
+                if found_command is None or match[0] < found_command[0]:
+                    found_command = match
+
+        if found_command is not None:
+            return found_command[1]
 
     def __repr__(self) -> str:
-        return str(self.__dict__)
+        return str({command.name.replace(" ", "_"): command for command in self._commands})
 
     def __iter__(self) -> _SingleCommand:
-        for command in self.__dict__:
-            yield getattr(self, command)
+        yield from self._commands
+
+
+bot_commands = BotCommands()
@@ -3,10 +3,13 @@
 # Some commonly used functions
 #
 
+import asyncio
 import configparser
+import copy
 import logging
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 import inspect
 import re
 
@@ -16,6 +19,38 @@ from ctparse import ctparse
 # define valid log levels
 valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
 
+# max time in seconds ctparse is allowed to spend on parsing a date
+ctparse_timeout = 2
+
+relative_date_units = {
+    "m": "minutes", "min": "minutes", "mins": "minutes", "minute": "minutes", "minutes": "minutes",
+    "h": "hours", "hr": "hours", "hrs": "hours", "hour": "hours", "hours": "hours",
+    "d": "days", "day": "days", "days": "days",
+    "w": "weeks", "week": "weeks", "weeks": "weeks"
+}
+
+relative_date_weekdays = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+relative_date_time_regex = r"(?:at\s+)?(?P<hour>\d{1,2})(?:(?::(?P<minute>\d{2}))(?:\s*(?P<am_pm>am|pm))?|\s*(?P<am_pm_only>am|pm))"
+
+relative_date_regex_list = [
+    # durations like: 1h, 30m, in 2 days, 3 hours
+    re.compile(r"(?:in\s+)?(?P<amount>\d+)\s*(?P<unit>%s)(?=\s|$)" %
+               "|".join(sorted(relative_date_units.keys(), key=len, reverse=True)), re.IGNORECASE),
+    # ISO dates like: 2019-11-05, 2019-11-05 17:33, 2019-11-05T17:33:00
+    re.compile(r"(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})"
+               r"(?:[T\s](?P<hour>\d{1,2}):(?P<minute>\d{2})(?::\d{2})?)?(?=\s|$)", re.IGNORECASE),
+    # day names with optional time like: now, today, tomorrow 9am, monday 17:30
+    re.compile(r"(?P<day_name>now|today|tomorrow|%s)(?:\s+%s)?(?=\s|$)" %
+               ("|".join(relative_date_weekdays), relative_date_time_regex), re.IGNORECASE),
+    # just a time like: 9am, 17:30
+    re.compile(r"%s(?=\s|$)" % relative_date_time_regex, re.IGNORECASE)
+]
+
+# if the date continues with one of these, leave the parsing to ctparse
+relative_date_continuation_regex = \
+    re.compile(r"\s+(?:morning|afternoon|evening|night|noon|lunch|mittag|midnight|at|and|next|\d)", re.IGNORECASE)
+
 
 def parse_command_line(version=None,
                        self_description=None,
@@ -115,8 +150,24 @@ def parse_own_config(args, default_log_level):
     else:
         config_dict["slack.bot_token"] = config_handler.get(this_section, "bot_token", fallback="")
         logging.debug("Config: %s = %s***" % ("slack.bot_token", config_dict["slack.bot_token"][0:10]))
+        config_dict["slack.app_token"] = config_handler.get(this_section, "app_token", fallback="")
+        logging.debug("Config: %s = %s***" % ("slack.app_token", config_dict["slack.app_token"][0:10]))
+        config_dict["slack.proxy"] = config_handler.get(this_section, "proxy", fallback="")
+        logging.debug("Config: %s = %s" % ("slack.proxy", config_dict["slack.proxy"]))
+        config_dict["slack.api_url"] = config_handler.get(this_section, "api_url", fallback="")
+        logging.debug("Config: %s = %s" % ("slack.api_url", config_dict["slack.api_url"]))
         config_dict["slack.default_channel"] = config_handler.get(this_section, "default_channel", fallback="")
         logging.debug("Config: %s = %s" % ("slack.default_channel", config_dict["slack.default_channel"]))
+        config_dict["slack.file_upload_threshold"] = \
+            config_handler.get(this_section, "file_upload_threshold", fallback="")
+        logging.debug("Config: %s = %s" % ("slack.file_upload_threshold", config_dict["slack.file_upload_threshold"]))
+        config_dict["slack.user_cache_file"] = config_handler.get(this_section, "user_cache_file", fallback="")
+        logging.debug("Config: %s = %s" % ("slack.user_cache_file", config_dict["slack.user_cache_file"]))
+        config_dict["slack.max_message_workers"] = \
+            config_handler.get(this_section, "max_message_workers", fallback="")
+        logging.debug("Config: %s = %s" % ("slack.max_message_workers", config_dict["slack.max_message_workers"]))
+        config_dict["slack.command_timeout"] = config_handler.get(this_section, "command_timeout", fallback="")
+        logging.debug("Config: %s = %s" % ("slack.command_timeout", config_dict["slack.command_timeout"]))
 
     # read paths section
     this_section = "icinga"
@@ -141,20 +192,37 @@ def parse_own_config(args, default_log_level):
         logging.debug("Config: %s = %s" % ("icinga.ca_certificate", config_dict["icinga.ca_certificate"]))
         config_dict["icinga.timeout"] = config_handler.get(this_section, "timeout", fallback="")
         logging.debug("Config: %s = %s" % ("icinga.timeout", config_dict["icinga.timeout"]))
+        config_dict["icinga.max_connections"] = config_handler.get(this_section, "max_connections", fallback="")
+        logging.debug("Config: %s = %s" % ("icinga.max_connections", config_dict["icinga.max_connections"]))
         config_dict["icinga.filter"] = config_handler.get(this_section, "filter", fallback="")
         logging.debug("Config: %s = %s" % ("icinga.filter", config_dict["icinga.filter"]))
         config_dict["icinga.max_returned_results"] = \
             config_handler.get(this_section, "max_returned_results", fallback="")
         logging.debug("Config: %s = %s" % ("icinga.max_returned_results", config_dict["icinga.max_returned_results"]))
+        config_dict["icinga.state_mirror"] = config_handler.getboolean(this_section, "state_mirror", fallback=False)
+        logging.debug("Config: %s = %s" % ("icinga.state_mirror", config_dict["icinga.state_mirror"]))
+        config_dict["icinga.cache_ttl"] = config_handler.get(this_section, "cache_ttl", fallback="")
+        logging.debug("Config: %s = %s" % ("icinga.cache_ttl", config_dict["icinga.cache_ttl"]))
+        config_dict["icinga.cache_size"] = config_handler.get(this_section, "cache_size", fallback="")
+        logging.debug("Config: %s = %s" % ("icinga.cache_size", config_dict["icinga.cache_size"]))
+        config_dict["icinga.action_workers"] = config_handler.get(this_section, "action_workers", fallback="")
+        logging.debug("Config: %s = %s" % ("icinga.action_workers", config_dict["icinga.action_workers"]))
+        config_dict["icinga.verify_actions"] = \
+            config_handler.getboolean(this_section, "verify_actions", fallback=False)
+        logging.debug("Config: %s = %s" % ("icinga.verify_actions", config_dict["icinga.verify_actions"]))
 
     for key, value in config_dict.items():
-        if value is "":
+        if value == "":
             # if we use a certificate then don't care if user or password are defined
             if key in ["icinga.username", "icinga.password"] and config_dict["icinga.certificate"] != "":
                 continue
             # these vars can be empty
             if key in ["icinga.key", "icinga.certificate", "icinga.web2_url", "icinga.ca_certificate",
-                       "icinga.filter", "icinga.max_returned_results", "icinga.timeout"]:
+                       "icinga.filter", "icinga.max_returned_results", "icinga.timeout",
+                       "icinga.max_connections", "icinga.cache_ttl", "icinga.cache_size", "icinga.action_workers",
+                       "slack.file_upload_threshold", "slack.user_cache_file",
+                       "slack.max_message_workers", "slack.command_timeout", "slack.app_token",
+                       "slack.proxy", "slack.api_url"]:
                 continue
             logging.error("Config: option '%s' undefined or empty!" % key)
             config_error = True
@@ -255,10 +323,142 @@ def ts_to_date(ts, date_format="%Y-%m-%d %H:%M:%S"):
     return datetime.fromtimestamp(ts).strftime(date_format)
 
 
+def fast_parse_relative_date(string_to_parse, now=None):
+    """
+    Parse the most common forms of relative and absolute dates without ctparse.
+
+    Only dates at the beginning of the string are parsed (an "until" in front is skipped):
+    durations (1h, 30m, in 2 days), ISO dates (2019-11-05 17:33), day names with
+    an optional time (tomorrow 9am, monday 17:30) or just a time (9am, 17:30).
+
+    Parameters
+    ----------
+    string_to_parse : string
+        string with relative time information which should be parsed into absolute datetime object
+    now : datetime, optional
+        the reference time (default: current time)
+
+    Returns
+    -------
+    dict: date/time data + datetime object like parse_relative_date() or None if string didn't match
+    """
+
+    if now is None:
+        now = datetime.now()
+
+    now = now.replace(second=0, microsecond=0)
+
+    start_match = re.match(r"\s*(?:until\s+)?", string_to_parse, re.IGNORECASE)
+
+    for regex in relative_date_regex_list:
+        match = regex.match(string_to_parse, start_match.end())
+        if match:
+            break
+    else:
+        return None
+
+    if relative_date_continuation_regex.match(string_to_parse, match.end()):
+        return None
+
+    parts = {key: value for key, value in match.groupdict().items() if value is not None}
+
+    dt = None
+
+    if "amount" in parts:
+        dt = now + timedelta(**{relative_date_units[parts["unit"].lower()]: int(parts["amount"])})
+
+    else:
+        if "year" in parts:
+            try:
+                day = datetime(year=int(parts["year"]), month=int(parts["month"]), day=int(parts["day"]))
+            except ValueError:
+                return None
+        elif "day_name" in parts:
+            day_name = parts["day_name"].lower()
+            if day_name in ["now", "today"]:
+                day = now
+            elif day_name == "tomorrow":
+                day = now + timedelta(days=1)
+            else:
+                # same as ctparse, the same week day means next week
+                days_ahead = (relative_date_weekdays.index(day_name) - now.weekday() - 1) % 7 + 1
+                day = now + timedelta(days=days_ahead)
+        else:
+            day = now
+
+        # unable to determine time of the day, use current time
+        hour = now.hour
+        minute = now.minute
+
+        if "hour" in parts:
+            hour = int(parts["hour"])
+            minute = int(parts.get("minute", 0))
+
+            am_pm = parts.get("am_pm", parts.get("am_pm_only", "")).lower()
+            if am_pm == "pm" and hour < 12:
+                hour += 12
+            if am_pm == "am" and hour == 12:
+                hour = 0
+
+        try:
+            dt = datetime(year=day.year, month=day.month, day=day.day, hour=hour, minute=minute)
+        except ValueError:
+            return None
+
+        # a time without a day means the next time this time of the day is reached
+        if "year" not in parts and "day_name" not in parts and dt < now:
+            dt += timedelta(days=1)
+
+    logging.debug("Parsed date from string (%s) without ctparse: %s" % (match.group(0), dt))
+
+    return {
+        "mstart": match.start(),
+        "mend": match.end(),
+        "year": dt.year,
+        "month": dt.month,
+        "day": dt.day,
+        "hour": dt.hour,
+        "minute": dt.minute,
+        "DOW": None,
+        "POD": None,
+        "dt": dt
+    }
+
+
+@lru_cache(maxsize=256)
+def cached_ctparse(string_to_parse, reference_minute):
+    """
+    Return ctparse result for a string relative to a reference minute.
+
+    As dates are parsed relative to the reference minute, the same
+    string will be parsed only once per minute.
+
+    Parameters
+    ----------
+    string_to_parse : string
+        string to parse
+    reference_minute : datetime
+        datetime of current minute
+
+    Returns
+    -------
+    ctparse.CTParse: parsed result or None
+    """
+
+    logging.debug("%s START ctparse %s" % ("*" * 10, "*" * 50))
+    parsed_date = ctparse(string_to_parse, ts=reference_minute, timeout=ctparse_timeout)
+    logging.debug("%s END ctparse %s" % ("*" * 10, "*" * 52))
+
+    return parsed_date
+
+
 def parse_relative_date(data_to_parse=None):
     """
     Return a ctparse.Time dict and a datetime object for a string of relative date and/or time to parse.
 
+    Common date formats are parsed with fast_parse_relative_date(), only
+    if that fails the slower ctparse will be used.
+
     Parameters
     ----------
     data_to_parse : string
@@ -293,15 +493,20 @@ def parse_relative_date(data_to_parse=None):
         logging.warning("Trying to parse date but submitted data is not a string or a list.")
         return None
 
-    logging.debug("%s START ctparse %s" % ("*" * 10, "*" * 50))
-    parsed_date = ctparse(string_to_parse)
-    logging.debug("%s END ctparse %s" % ("*" * 10, "*" * 52))
+    return_data = fast_parse_relative_date(string_to_parse)
+
+    if return_data is not None:
+        return return_data
 
-    if parsed_date is None or parsed_date.resolution is None:
+    parsed_date = cached_ctparse(string_to_parse, datetime.now().replace(second=0, microsecond=0))
+
+    # ctparse can also return durations or intervals which can't be used here
+    if parsed_date is None or parsed_date.resolution is None or not hasattr(parsed_date.resolution, "hour"):
         logging.debug("Unable to parse a date from string: %s" % string_to_parse)
         return None
 
-    data_parts = parsed_date.resolution
+    # cached result must not be changed
+    data_parts = copy.copy(parsed_date.resolution)
 
     # just do some own additional parsing
     time_string = string_to_parse[data_parts.mstart:data_parts.mend]
@@ -351,6 +556,45 @@ def parse_relative_date(data_to_parse=None):
     return return_data
 
 
+async def async_parse_relative_date(data_to_parse=None, timeout=None):
+    """
+    Same as parse_relative_date() but ctparse will run in an executor
+    to avoid blocking the event loop.
+
+    Parameters
+    ----------
+    data_to_parse : string
+        string with relative time information which should be parsed into absolute datetime object
+    timeout : int, float, optional
+        max time to wait for ctparse to return a result (default: ctparse_timeout + 1)
+
+    Returns
+    -------
+    dict: date/time data + datetime object, see parse_relative_date()
+    """
+
+    if isinstance(data_to_parse, list):
+        data_to_parse = " ".join(data_to_parse)
+
+    # fast path, no need to run it in executor
+    if isinstance(data_to_parse, str):
+        return_data = fast_parse_relative_date(data_to_parse)
+
+        if return_data is not None:
+            return return_data
+
+    if timeout is None:
+        timeout = ctparse_timeout + 1
+
+    try:
+        return await asyncio.wait_for(
+            asyncio.get_event_loop().run_in_executor(None, parse_relative_date, data_to_parse), timeout=timeout)
+    except asyncio.TimeoutError:
+        logging.error("Parsing date from string (%s) timed out after %s seconds" % (data_to_parse, timeout))
+
+    return None
+
+
 def my_own_function_name():
     """returns the name of the function who called this function"""
     return inspect.currentframe().f_back.f_code.co_name
@@ -0,0 +1,180 @@
+####
+#
+#   Verify that Icinga2 actions took effect
+#
+
+import asyncio
+import json
+import logging
+
+# internal
+from .icinga_connection import setup_async_icinga_connection, get_i2_action_filters, chunk_i2_filters
+from .icinga_connection_manager import get_icinga_max_connections
+from .icinga_state_mirror import state_mirror
+
+# seconds to wait until all objects are verified
+action_verification_timeout = 30
+
+# seconds between two checks
+action_verification_interval = 2
+
+
+async def request_objects(config, object_type, filter_list, attrs):
+    """
+    request objects from Icinga2 in size bounded chunks
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    object_type : str
+        the object type to request
+    filter_list : list
+        list of filters, joined with "||"
+    attrs : list
+        attributes to request
+
+    Returns
+    -------
+    list: attributes of all returned objects
+    """
+
+    i2_handle, i2_error = setup_async_icinga_connection(config)
+
+    if not i2_handle:
+        raise ConnectionError(i2_error or "Unknown error while setting up Icinga2 connection")
+
+    request_slots = asyncio.Semaphore(get_icinga_max_connections(config))
+
+    async def request_chunk(chunk):
+        async with request_slots:
+            return await i2_handle.objects_list(object_type, attrs=attrs, filters="(" + " || ".join(chunk) + ")")
+
+    results = await asyncio.gather(*[request_chunk(chunk) for chunk in chunk_i2_filters(filter_list)])
+
+    return [x.get("attrs") or dict() for result in results for x in result or list()]
+
+
+async def get_acknowledged_objects(config, object_type, i2_objects):
+    """
+    return all objects which are acknowledged
+
+    Answered from the state mirror if it's in sync, otherwise from Icinga2.
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    object_type : str
+        Host or Service
+    i2_objects : list
+        objects to check
+
+    Returns
+    -------
+    set: keys of acknowledged objects
+    """
+
+    if state_mirror.ready:
+        with state_mirror.lock:
+            return {key for key in [state_mirror.get_object_key(object_type, x) for x in i2_objects]
+                    if (state_mirror.objects[object_type].get(key) or dict()).get("acknowledgement")}
+
+    results = await request_objects(config, object_type, get_i2_action_filters(object_type, i2_objects),
+                                    ["name", "host_name", "acknowledgement"])
+
+    return {state_mirror.get_object_key(object_type, x) for x in results if x.get("acknowledgement")}
+
+
+async def get_objects_with_downtime(config, object_type, i2_objects, author, comment):
+    """
+    return all objects which have a downtime with this author and comment
+
+    Answered from the state mirror if it's in sync, otherwise from Icinga2.
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    object_type : str
+        Host or Service
+    i2_objects : list
+        objects to check
+    author : str
+        author of the downtime
+    comment : str
+        comment of the downtime
+
+    Returns
+    -------
+    set: keys of objects with downtime
+    """
+
+    if state_mirror.ready:
+        with state_mirror.lock:
+            downtimes = [x for x in state_mirror.objects["Downtime"].values()
+                         if x.get("author") == author and x.get("comment") == comment]
+    else:
+        downtimes = await request_objects(config, "Downtime",
+                                          ['( downtime.author==%s && downtime.comment==%s )' %
+                                           (json.dumps(author), json.dumps(comment))],
+                                          ["host_name", "service_name", "author", "comment"])
+
+    downtime_keys = set()
+    for downtime in downtimes:
+        if downtime.get("service_name"):
+            downtime_keys.add((downtime.get("host_name"), downtime.get("service_name")))
+        else:
+            downtime_keys.add((downtime.get("host_name"),))
+
+    return {state_mirror.get_object_key(object_type, x) for x in i2_objects} & downtime_keys
+
+
+async def verify_action(config, object_type, i2_objects, get_verified_objects, timeout=None, **kwargs):
+    """
+    wait until an action took effect on all objects or the timeout is reached
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    object_type : str
+        Host or Service
+    i2_objects : list
+        objects the action was performed on
+    get_verified_objects : function
+        coroutine function which returns the keys of all objects the action took effect on
+    timeout : int, optional
+        seconds to wait (default: action_verification_timeout)
+    kwargs:
+        passed on to get_verified_objects
+
+    Returns
+    -------
+    int: number of objects the action took effect on
+    """
+
+    if timeout is None:
+        timeout = action_verification_timeout
+
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+
+    verified_objects = set()
+
+    while True:
+        try:
+            verified_objects = await get_verified_objects(config, object_type, i2_objects, **kwargs)
+        except Exception as e:
+            logging.error("Unable to verify Icinga2 action: %s" % str(e))
+
+        if len(verified_objects) >= len(i2_objects) or loop.time() + action_verification_interval > deadline:
+            break
+
+        await asyncio.sleep(action_verification_interval)
+
+    logging.debug("Verified Icinga2 action for %d of %d objects" % (len(verified_objects), len(i2_objects)))
+
+    return len(verified_objects)
+
+# EOF
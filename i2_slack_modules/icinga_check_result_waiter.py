@@ -0,0 +1,285 @@
+####
+#
+#   Wait for the check results of rescheduled checks
+#
+
+import asyncio
+import itertools
+import logging
+import os
+import socket
+
+# internal
+from . import plural
+from .icinga_connection import setup_async_icinga_connection, get_i2_action_filters, chunk_i2_filters
+from .icinga_connection_manager import get_icinga_timeout
+from .icinga_state_mirror import state_mirror
+from .icinga_states import IcingaStates
+from .slack_helper import get_web2_slack_url
+
+# seconds to wait for all check results
+check_result_wait_timeout = 120
+
+# seconds to collect further check results before the result message is updated
+check_result_update_interval = 2
+
+# maximum number of objects to wait for, a result message can't list all objects of a huge reschedule
+check_result_wait_max_objects = 50
+
+# maximum length of the check output shown per object
+check_result_max_output_length = 200
+
+# each subscription needs a unique queue name
+check_result_queue_ids = itertools.count(1)
+
+
+class CheckResultWaiter:
+    """
+    Collect the check results of objects from the Icinga2 event stream
+
+    The event stream has to be subscribed with subscribe() before the checks
+    are rescheduled, otherwise fast check results could be missed.
+    stream_results() then updates the result message each time new check
+    results arrive until all results have been received or the timeout is reached.
+    """
+
+    def __init__(self, config, object_type, i2_objects, timeout=None):
+        """
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+        object_type : str
+            Host or Service
+        i2_objects : list
+            objects which are going to be rescheduled
+        timeout : int, optional
+            seconds to wait for all check results (default: check_result_wait_timeout)
+        """
+
+        self.config = config
+        self.object_type = object_type
+        self.num_objects = len(i2_objects)
+        self.i2_objects = i2_objects[0:check_result_wait_max_objects]
+        self.timeout = timeout or check_result_wait_timeout
+        self.keys = [state_mirror.get_object_key(object_type, x) for x in self.i2_objects]
+        self.check_results = dict()
+        self.result_received = asyncio.Event()
+        self.consumers = list()
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+    async def subscribe(self):
+        """
+        subscribe to the CheckResult events of all objects and wait until all subscriptions are established
+        """
+
+        i2_handle, i2_error = setup_async_icinga_connection(self.config)
+
+        if not i2_handle:
+            raise ConnectionError(i2_error or "Unknown error while setting up Icinga2 connection")
+
+        filter_list = get_i2_action_filters(self.object_type, self.i2_objects,
+                                            host_attr="event.host", service_attr="event.service")
+
+        connected_list = list()
+        for chunk in chunk_i2_filters(filter_list):
+            connected = asyncio.Event()
+            queue_name = "icinga-slack-bot-%s-%d-check-results-%d" % \
+                         (socket.gethostname(), os.getpid(), next(check_result_queue_ids))
+
+            events = i2_handle.events_subscribe(["CheckResult"], queue_name, "(" + " || ".join(chunk) + ")",
+                                                connected=connected)
+
+            self.consumers.append(asyncio.ensure_future(self.consume_events(events)))
+            connected_list.append(connected)
+
+        async def wait_connected():
+            for this_connected in connected_list:
+                await this_connected.wait()
+
+        all_connected = asyncio.ensure_future(wait_connected())
+
+        # a failed subscription ends its consumer before it's connected
+        await asyncio.wait([all_connected] + self.consumers, timeout=get_icinga_timeout(self.config),
+                           return_when=asyncio.FIRST_COMPLETED)
+
+        if all_connected.done():
+            logging.debug("Subscribed to check results of %d object%s" % (len(self.keys), plural(len(self.keys))))
+            return
+
+        all_connected.cancel()
+        self.close()
+
+        for consumer in self.consumers:
+            if consumer.done() and not consumer.cancelled() and consumer.exception() is not None:
+                raise consumer.exception()
+
+        raise TimeoutError("Subscribing to Icinga2 check results timed out")
+
+    async def consume_events(self, events):
+        """
+        store the check results received from the event stream
+
+        Parameters
+        ----------
+        events : AsyncGenerator
+            the event stream
+        """
+
+        keys = set(self.keys)
+
+        async for event in events:
+            if event.get("type") != "CheckResult":
+                continue
+
+            event_object_type, key = state_mirror.get_event_object(event)
+
+            # host filters also match all service check results of this host
+            if event_object_type != self.object_type or key not in keys:
+                continue
+
+            self.check_results[key] = event.get("check_result") or dict()
+            self.result_received.set()
+
+    def close(self):
+        """
+        close all event streams
+        """
+
+        for consumer in self.consumers:
+            consumer.cancel()
+
+    def get_status_text(self, done=False):
+        """
+        Parameters
+        ----------
+        done : bool
+            waiting for check results has finished
+
+        Returns
+        -------
+        str: number of received check results
+        """
+
+        if done is True:
+            return "_received %d of %d check result%s_" % \
+                   (len(self.check_results), len(self.keys), plural(len(self.keys)))
+
+        return "_waiting for check results, received %d of %d ..._" % (len(self.check_results), len(self.keys))
+
+    def get_result_text(self, header_text, done=False):
+        """
+        Parameters
+        ----------
+        header_text : str
+            text of the result message to add the check results to
+        done : bool
+            waiting for check results has finished
+
+        Returns
+        -------
+        str: the result message with one line per object
+        """
+
+        icinga_states = IcingaStates()
+        web2_url = self.config["icinga.web2_url"]
+
+        result_lines = [header_text]
+
+        if self.num_objects > len(self.keys):
+            result_lines.append("_showing check results of the first %d of %d objects_" %
+                                (len(self.keys), self.num_objects))
+
+        for key in self.keys:
+
+            if self.object_type == "Host":
+                object_url = get_web2_slack_url(key[0], web2_url=web2_url)
+            else:
+                object_url = "%s | %s" % (get_web2_slack_url(key[0], web2_url=web2_url),
+                                          get_web2_slack_url(key[0], key[1], web2_url=web2_url))
+
+            check_result = self.check_results.get(key)
+
+            if check_result is None:
+                if done is True:
+                    result_lines.append(":grey_question: %s: _no check result within %d seconds_" %
+                                        (object_url, self.timeout))
+                else:
+                    result_lines.append(":hourglass_flowing_sand: %s: _waiting for check result ..._" % object_url)
+                continue
+
+            state = int(check_result.get("state") or 0)
+
+            # host check results are returned with service states, same as Icinga2 we treat WARNING as UP
+            if self.object_type == "Host":
+                state = 0 if state <= 1 else 1
+
+            output = str(check_result.get("output") or "").strip().split("\n")[0]
+            if len(output) > check_result_max_output_length:
+                output = output[0:check_result_max_output_length] + " ..."
+
+            result_lines.append("%s %s: %s" % (icinga_states.value(state, self.object_type).icon, object_url, output))
+
+        return "\n".join(result_lines)
+
+    async def stream_results(self, header_text, update_result):
+        """
+        update the result message whenever new check results arrive until
+        all check results are received or the timeout is reached
+
+        Parameters
+        ----------
+        header_text : str
+            text of the result message to add the check results to
+        update_result : function
+            coroutine function called with the keyword arguments text and status to update the result
+        """
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+
+        await update_result(text=self.get_result_text(header_text), status=self.get_status_text())
+
+        try:
+            while len(self.check_results) < len(self.keys):
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+
+                result_wait = asyncio.ensure_future(self.result_received.wait())
+
+                await asyncio.wait([result_wait] + self.consumers, timeout=remaining,
+                                   return_when=asyncio.FIRST_COMPLETED)
+
+                result_wait.cancel()
+
+                if self.result_received.is_set():
+                    self.result_received.clear()
+
+                    # collect check results which arrive shortly after each other with a single update
+                    if len(self.check_results) < len(self.keys):
+                        await asyncio.sleep(max(0, min(check_result_update_interval, deadline - loop.time())))
+
+                    await update_result(text=self.get_result_text(header_text), status=self.get_status_text())
+
+                for consumer in [x for x in self.consumers if x.done()]:
+                    if not consumer.cancelled() and consumer.exception() is not None:
+                        logging.error("Icinga2 check result stream failed: %s" % str(consumer.exception()))
+                    else:
+                        logging.warning("Icinga2 check result stream closed")
+
+                self.consumers = [x for x in self.consumers if not x.done()]
+
+                if len(self.consumers) == 0:
+                    break
+        finally:
+            self.close()
+
+        logging.debug("Received %d of %d check results" % (len(self.check_results), len(self.keys)))
+
+        await update_result(text=self.get_result_text(header_text, done=True), status=self.get_status_text(done=True))
+
+# EOF
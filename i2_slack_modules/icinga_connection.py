@@ -3,15 +3,27 @@
 #   Functions and classes to handle Icinga2 connections
 #
 
+import asyncio
 import json
 import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
 
 # internal
+from . import plural
 from .icinga_states import IcingaStates
 from .common import quoted_split
+from .icinga_connection_manager import connection_manager, get_icinga_timeout, get_icinga_max_connections
+from .icinga_state_mirror import state_mirror
 
 # external
-from icinga2apic.client import Client, Icinga2ApiException
+from icinga2apic.client import Icinga2ApiException
+
+default_icinga_cache_size = 100
+
+# maximum length of a filter expression sent with a single Icinga2 action request
+icinga_max_action_filter_length = 8192
 
 
 class RequestResponse:
@@ -39,8 +51,176 @@ class RequestResponse:
         return str(self.__dict__)
 
 
-def setup_icinga_connection(config):
-    """Setup an Icinga connection and pass all parameters
+class ResponseCache:
+    """
+    A class used to cache responses of Icinga2 object requests.
+
+    Entries expire after 'icinga.cache_ttl' seconds. If more than 'icinga.cache_size'
+    entries are cached, the least recently used entry is evicted.
+
+    Each invalidation starts a new generation. Responses of requests which
+    were started in an older generation are not added anymore.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_ttl(config):
+        if config.get("icinga.cache_ttl") is not None and str(config.get("icinga.cache_ttl")) != "":
+            return int(config.get("icinga.cache_ttl"))
+
+        return 0
+
+    @staticmethod
+    def get_size(config):
+        if config.get("icinga.cache_size") is not None and str(config.get("icinga.cache_size")) != "":
+            return int(config.get("icinga.cache_size"))
+
+        return default_icinga_cache_size
+
+    def get(self, config, key):
+        """
+        return cached data for key
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+        key : tuple
+            the cache key (object_type, attrs, filter)
+
+        Returns
+        -------
+        list, None: cached data or None if not cached, expired or cache disabled
+        """
+
+        ttl = self.get_ttl(config)
+
+        if ttl <= 0:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            timestamp, data = entry
+
+            if timestamp + ttl < datetime.now().timestamp():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+
+        logging.debug("Answered Icinga2 request from response cache")
+
+        return data
+
+    def add(self, config, key, data, generation=None):
+        """
+        add data to cache
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+        key : tuple
+            the cache key (object_type, attrs, filter)
+        data : list
+            the data returned by Icinga2
+        generation : int, optional
+            cache generation at the time the request was started
+        """
+
+        if self.get_ttl(config) <= 0:
+            return
+
+        with self.lock:
+            # objects changed while this request was in flight
+            if generation is not None and generation != self.generation:
+                logging.debug("Not caching Icinga2 response requested before the cache got invalidated")
+                return
+
+            self.entries[key] = (datetime.now().timestamp(), data)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.get_size(config):
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        remove all entries from cache, needs to be called after changing any Icinga2 objects
+        """
+
+        with self.lock:
+            if len(self.entries) > 0:
+                logging.debug("Invalidating Icinga2 response cache")
+            self.entries.clear()
+            self.generation += 1
+
+
+response_cache = ResponseCache()
+
+
+class InFlightRequests:
+    """
+    A class used to coalesce identical concurrent Icinga2 requests.
+
+    The first caller performs the request, all callers which ask for the same
+    key while this request is still outstanding receive the same result.
+    """
+
+    def __init__(self):
+        self.async_requests = dict()
+
+    async def async_run(self, key, request_coroutine_function):
+        """
+        await request_coroutine_function() or an identical request which is in flight
+
+        The request is shielded, a caller which gets canceled (i.e. timeout)
+        does not cancel the request for all other callers.
+
+        Parameters
+        ----------
+        key : tuple
+            identifies identical requests
+        request_coroutine_function : function
+            returns the coroutine which performs the request
+
+        Returns
+        -------
+        the result of the request, exceptions are raised for every caller
+        """
+
+        in_flight = self.async_requests.get(key)
+
+        if in_flight is not None:
+            logging.debug("Waiting for identical Icinga2 request in flight")
+        else:
+            in_flight = asyncio.ensure_future(request_coroutine_function())
+            self.async_requests[key] = in_flight
+
+            def request_done(future):
+                if self.async_requests.get(key) is future:
+                    del self.async_requests[key]
+                # avoid "exception was never retrieved" if all callers got canceled
+                if not future.cancelled():
+                    future.exception()
+
+            in_flight.add_done_callback(request_done)
+
+        return await asyncio.shield(in_flight)
+
+
+in_flight_requests = InFlightRequests()
+
+
+def setup_async_icinga_connection(config):
+    """Return the shared asyncio Icinga connection
 
     Parameters
     ----------
@@ -51,39 +231,26 @@ def setup_icinga_connection(config):
     -------
     tuple
         returns a tuple with two elements
-            i2_handle: icinga2 client object
+            i2_handle: AsyncIcingaClient object
             i2_error: an error string in case a client connection failed
     """
 
     i2_handle = None
     i2_error = None
 
-    default_icinga_connection_timeout = 5
-
-    icinga_timeout = default_icinga_connection_timeout
-
-    if config["icinga.timeout"] is not None and str(config["icinga.timeout"]) != "":
-        icinga_timeout = int(config["icinga.timeout"])
-
     try:
-        i2_handle = Client(url="https://" + config["icinga.hostname"] + ":" + config["icinga.port"],
-                           username=config["icinga.username"], password=config["icinga.password"],
-                           certificate=config["icinga.certificate"], key=config["icinga.key"],
-                           ca_certificate=config["icinga.ca_certificate"], timeout=icinga_timeout)
+        i2_handle = connection_manager.get_async_client(config)
 
     except Icinga2ApiException as e:
         i2_error = str(e)
         logging.error("Unable to set up Icinga2 connection: %s" % i2_error)
         pass
 
-    if not i2_error:
-        logging.debug("Successfully connected to Icinga2")
-
     return i2_handle, i2_error
 
 
-def get_i2_status(config=None, application=None):
-    """Request Icinga2 API Endpoint /v1/status
+async def async_get_i2_status(config=None, application=None):
+    """Request Icinga2 API Endpoint /v1/status without blocking the event loop
 
     Parameters
     ----------
@@ -100,7 +267,7 @@ def get_i2_status(config=None, application=None):
 
     response = RequestResponse()
 
-    i2_handle, i2_error = setup_icinga_connection(config)
+    i2_handle, i2_error = setup_async_icinga_connection(config)
 
     if not i2_handle:
         if i2_error is not None:
@@ -111,7 +278,8 @@ def get_i2_status(config=None, application=None):
     try:
         logging.debug("Requesting Icinga2 status for application: %s " % application)
 
-        response.data = i2_handle.status.list(application)
+        response.data = await in_flight_requests.async_run(("status", application),
+                                                           lambda: i2_handle.status_list(application))
 
     except Exception as e:
         response.error = str(e)
@@ -121,46 +289,25 @@ def get_i2_status(config=None, application=None):
     return response
 
 
-def get_i2_object(config, object_type="Host", filter_states=None, filter_names=None, acknowledged=None, downtime=None):
-    """Request Icinga2 API Endpoint /v1/objects
+def compile_i2_object_query(config, object_type="Host", filter_states=None, filter_names=None,
+                            acknowledged=None, downtime=None):
+    """Compile the object type, attributes and filter for a request to /v1/objects
 
     Parameters
     ----------
-    config : dict
-        dictionary with items parsed from config file
-    object_type : str
-        the object type to request (Host, Service, HostComment, ServiceComment, HostDowntime or ServiceDowntime)
-    filter_states : list, optional
-        a list of object states to filter for, use function "get_i2_filter"
-        to generate this list (default is None)
-    filter_names : list, optional
-        a list of object names to filter for, use function "get_i2_filter"
-        to generate this list (default is None)
-    acknowledged: bool, optional
-        if None, acknowledge filter will NOT be added
-        if True, only acknowledged objects are requested
-        if False, only unacknowledged objects are requested
-    downtime: bool, optional
-        if None, downtime filter will NOT be added
-        if True, only objects in downtime are requested
-        if False, only objects not in downtime are requested
+    see async_get_i2_object()
 
     Returns
     -------
-    RequestResponse: with Icinga host/service objects
+    tuple
+        returns a tuple with three elements
+            requested_object_type: object type to request from Icinga2
+            list_attrs: list of attributes to request
+            i2_filters: the compiled Icinga2 filter string
     """
 
-    response = RequestResponse()
     i2_filters = None
 
-    i2_handle, i2_error = setup_icinga_connection(config)
-
-    if not i2_handle:
-        if i2_error is not None:
-            return RequestResponse(error=i2_error)
-        else:
-            return RequestResponse(error="Unknown error while setting up Icinga2 connection")
-
     # default attributes to query
     if "Comment" in object_type:
         list_attrs = ['author', 'text', 'host_name', 'service_name', 'entry_time', 'expire_time', 'type',
@@ -174,13 +321,13 @@ def get_i2_object(config, object_type="Host", filter_states=None, filter_names=N
                       'enable_passive_checks']
 
     # add host_name to attribute list if services are requested
-    if object_type is "Service":
+    if object_type == "Service":
         list_attrs.append("host_name")
 
     if filter_states:
         i2_filters = '(' + ' || '.join(filter_states) + ')'
 
-    if filter_names and len(filter_names) >= 1 and filter_names[0] is not "":
+    if filter_names and len(filter_names) >= 1 and filter_names[0] != "":
 
         filter_names = quoted_split(string_to_split=" ".join(filter_names))
 
@@ -244,29 +391,59 @@ def get_i2_object(config, object_type="Host", filter_states=None, filter_names=N
     else:
         requested_object_type = object_type
 
-    try:
-        response.data = i2_handle.objects.list(object_type=requested_object_type, attrs=list_attrs, filters=i2_filters)
+    return requested_object_type, list_attrs, i2_filters
 
-    except Icinga2ApiException as e:
-        response.error = str(e)
-        if "failed with status" in response.error:
-            error = response.error.split(" failed with status ")[1]
-            return_code, icinga_return = error.split(":", 1)
-            icinga_return = json.loads(icinga_return)
-            response.error = "Error %s: %s" % (return_code, icinga_return.get("status"))
 
-            if int(return_code) == 404:
-                response.text = "No match for %s" % filter_states
-                if filter_names:
-                    response.text += " and %s" % filter_names
-                response.text += " found."
+def parse_i2_object_request_error(response, error, filter_states=None, filter_names=None):
+    """Add a meaningful error to a RequestResponse for a failed request to /v1/objects
 
-                response.error = None
-            pass
+    A 404 is not treated as error but as empty result.
+
+    Parameters
+    ----------
+    response : RequestResponse
+        the response to add the error to
+    error : Exception
+        the exception which was raised during the request
+    filter_states : list, optional
+        the filter states used in the request
+    filter_names : list, optional
+        the filter names used in the request
+    """
+
+    response.error = str(error)
+
+    if isinstance(error, Icinga2ApiException) and "failed with status" in response.error:
+        error = response.error.split(" failed with status ")[1]
+        return_code, icinga_return = error.split(":", 1)
+        icinga_return = json.loads(icinga_return)
+        response.error = "Error %s: %s" % (return_code, icinga_return.get("status"))
+
+        if int(return_code) == 404:
+            response.text = "No match for %s" % filter_states
+            if filter_names:
+                response.text += " and %s" % filter_names
+            response.text += " found."
+
+            response.error = None
 
-    except Exception as e:
-        response.error = str(e)
-        pass
+
+def finish_i2_object_response(response, object_type="Host", i2_filters=None):
+    """Extract and sort the object attributes returned from /v1/objects
+
+    Parameters
+    ----------
+    response : RequestResponse
+        the response with the raw Icinga2 result
+    object_type : str
+        the object type which was requested
+    i2_filters : str
+        the filter used for this request
+
+    Returns
+    -------
+    RequestResponse: with Icinga host/service objects
+    """
 
     if response.error is None and response.data is not None and isinstance(response.data, list):
         response_objects = list()
@@ -275,9 +452,9 @@ def get_i2_object(config, object_type="Host", filter_states=None, filter_names=N
         response.data = response_objects
 
         # sort objects
-        if object_type is "Host":
+        if object_type == "Host":
             response.data = sorted(response.data, key=lambda k: k['name'])
-        elif object_type is "Service":
+        elif object_type == "Service":
             response.data = sorted(response.data, key=lambda k: (k['host_name'], k['name']))
         elif "Comment" in object_type or "Downtime" in object_type:
             response.data = sorted(response.data, key=lambda k: k['entry_time'], reverse=True)
@@ -294,6 +471,301 @@ def get_i2_object(config, object_type="Host", filter_states=None, filter_names=N
     return response
 
 
+async def async_get_i2_object(config, object_type="Host", filter_states=None, filter_names=None,
+                              acknowledged=None, downtime=None):
+    """Request Icinga2 API Endpoint /v1/objects without blocking the event loop
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    object_type : str
+        the object type to request (Host, Service, HostComment, ServiceComment, HostDowntime or ServiceDowntime)
+    filter_states : list, optional
+        a list of object states to filter for, use function "get_i2_filter"
+        to generate this list (default is None)
+    filter_names : list, optional
+        a list of object names to filter for, use function "get_i2_filter"
+        to generate this list (default is None)
+    acknowledged: bool, optional
+        if None, acknowledge filter will NOT be added
+        if True, only acknowledged objects are requested
+        if False, only unacknowledged objects are requested
+    downtime: bool, optional
+        if None, downtime filter will NOT be added
+        if True, only objects in downtime are requested
+        if False, only objects not in downtime are requested
+
+    Returns
+    -------
+    RequestResponse: with Icinga host/service objects
+    """
+
+    response = RequestResponse()
+
+    requested_object_type, list_attrs, i2_filters = \
+        compile_i2_object_query(config, object_type, filter_states, filter_names, acknowledged, downtime)
+
+    # try to answer request from local state mirror
+    response.data = state_mirror.query(object_type, filter_states, filter_names, acknowledged, downtime,
+                                       list_attrs)
+    if response.data is not None:
+        return finish_i2_object_response(response, object_type, i2_filters)
+
+    # try to answer request from response cache
+    cache_key = (requested_object_type, tuple(list_attrs), i2_filters)
+    response.data = response_cache.get(config, cache_key)
+    if response.data is not None:
+        return finish_i2_object_response(response, object_type, i2_filters)
+
+    i2_handle, i2_error = setup_async_icinga_connection(config)
+
+    if not i2_handle:
+        if i2_error is not None:
+            return RequestResponse(error=i2_error)
+        else:
+            return RequestResponse(error="Unknown error while setting up Icinga2 connection")
+
+    # requests started before the cache got invalidated return outdated objects, don't join or cache them
+    cache_generation = response_cache.generation
+
+    try:
+        response.data = await in_flight_requests.async_run(
+            ("objects", cache_generation) + cache_key,
+            lambda: i2_handle.objects_list(object_type=requested_object_type, attrs=list_attrs, filters=i2_filters)
+        )
+
+        response_cache.add(config, cache_key, response.data, cache_generation)
+
+    except Exception as e:
+        parse_i2_object_request_error(response, e, filter_states, filter_names)
+        pass
+
+    return finish_i2_object_response(response, object_type, i2_filters)
+
+
+async def async_get_i2_objects(config, queries, timeout=None):
+    """Request multiple object queries from Icinga2 API Endpoint /v1/objects concurrently
+
+    All queries share one timeout budget. Queries which did not finish within
+    this budget get canceled and return a RequestResponse with an error, all
+    other results are returned as usual.
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    queries : list
+        a list of dicts with arguments passed on to async_get_i2_object()
+    timeout : int, float, optional
+        time budget in seconds for all queries (default: icinga.timeout)
+
+    Returns
+    -------
+    list: of RequestResponse in the same order as queries
+    """
+
+    if timeout is None:
+        timeout = get_icinga_timeout(config)
+
+    tasks = [asyncio.ensure_future(async_get_i2_object(config, **query)) for query in queries]
+
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+
+    for task in pending:
+        task.cancel()
+
+    responses = list()
+    for query, task in zip(queries, tasks):
+        if task in pending:
+            logging.error("Icinga2 request for %s timed out after %s seconds" % (query.get("object_type"), timeout))
+            responses.append(RequestResponse(error="Request timed out after %s seconds" % timeout))
+        elif task.exception() is not None:
+            responses.append(RequestResponse(error=str(task.exception())))
+        else:
+            responses.append(task.result())
+
+    return responses
+
+
+def get_i2_action_filters(object_type, i2_objects, max_length=None, host_attr="host.name",
+                          service_attr="service.name"):
+    """Return a list of filters selecting all i2_objects
+
+    Services are grouped by host like:
+    ( host.name=="x" && service.name in ["a", "b"] )
+
+    Parameters
+    ----------
+    object_type : str
+        the object type of i2_objects (Host or Service)
+    i2_objects : list
+        the objects as returned by the Icinga2 API
+    max_length : int, optional
+        maximum length of a single filter (default: icinga_max_action_filter_length)
+    host_attr : str, optional
+        attribute holding the host name (i.e. event.host for event stream filters)
+    service_attr : str, optional
+        attribute holding the service name (i.e. event.service for event stream filters)
+
+    Returns
+    -------
+    list: of filters to be joined with "||"
+    """
+
+    if max_length is None:
+        max_length = icinga_max_action_filter_length
+
+    if object_type == "Host":
+        return ['%s==%s' % (host_attr, json.dumps(x.get("name"))) for x in i2_objects]
+
+    host_services = OrderedDict()
+    for i2_object in i2_objects:
+        host_services.setdefault(i2_object.get("host_name"), list()).append(json.dumps(i2_object.get("name")))
+
+    filter_list = list()
+    for host_name, service_names in host_services.items():
+
+        # the host name may contain a '%', so the service part is appended instead of formatted into it
+        host_filter = '( %s==%s && %s' % (host_attr, json.dumps(host_name), service_attr)
+
+        # split hosts with a lot of services into multiple filters
+        service_group = list()
+        for service_name in service_names + [None]:
+            if service_name is not None and \
+                    (len(service_group) == 0 or
+                     len(host_filter) + len(", ".join(service_group + [service_name])) + 8 <= max_length):
+                service_group.append(service_name)
+                continue
+
+            if len(service_group) == 1:
+                filter_list.append(host_filter + "==%s )" % service_group[0])
+            else:
+                filter_list.append(host_filter + " in [%s] )" % ", ".join(service_group))
+
+            service_group = [service_name]
+
+    return filter_list
+
+
+def chunk_i2_filters(filter_list, max_length=None):
+    """Join a list of filters with "||" into as few filter expressions
+    as possible which don't exceed a maximum length
+
+    A single filter which exceeds the maximum length on its own
+    will be returned as its own chunk.
+
+    Parameters
+    ----------
+    filter_list : list
+        list of single filter expressions
+    max_length : int, optional
+        maximum length of a joined filter expression (default: icinga_max_action_filter_length)
+
+    Returns
+    -------
+    Generator: yields a list of filters for each chunk
+    """
+
+    if max_length is None:
+        max_length = icinga_max_action_filter_length
+
+    chunk = list()
+    chunk_length = 2
+
+    for this_filter in filter_list:
+        # joined as "(filter1 || filter2)"
+        this_length = len(this_filter) + (4 if len(chunk) > 0 else 0)
+
+        if len(chunk) > 0 and chunk_length + this_length > max_length:
+            yield chunk
+            chunk = list()
+            chunk_length = 2
+            this_length = len(this_filter)
+
+        chunk.append(this_filter)
+        chunk_length += this_length
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+async def async_perform_i2_action(config, action, object_type, filter_list, action_job=None, **params):
+    """Perform an Icinga2 action for a list of objects using as few requests as possible
+
+    The filters are joined into size bounded chunks which are
+    sent concurrently. A failed chunk doesn't stop the other chunks.
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+    action : str
+        the action to perform (i.e. remove-downtime)
+    object_type : str
+        the object type the action is performed on
+    filter_list : list
+        list of filters, each selecting the objects the action should be performed on
+    action_job : ActionJob, optional
+        job this action is performed in, the progress of each chunk is reported to it
+    params:
+        additional action parameters passed on to the Icinga2 API
+
+    Returns
+    -------
+    RequestResponse: data holds the Icinga2 results of all successful chunks,
+        error describes all failed chunks
+    """
+
+    response = RequestResponse()
+
+    i2_handle, i2_error = setup_async_icinga_connection(config)
+
+    if not i2_handle:
+        if i2_error is not None:
+            return RequestResponse(error=i2_error)
+        else:
+            return RequestResponse(error="Unknown error while setting up Icinga2 connection")
+
+    chunks = list(chunk_i2_filters(filter_list))
+
+    # don't queue more requests than connections are available
+    request_slots = asyncio.Semaphore(get_icinga_max_connections(config))
+
+    async def send_chunk(chunk):
+        async with request_slots:
+            try:
+                return await i2_handle.action(action, object_type=object_type,
+                                              filters="(" + " || ".join(chunk) + ")", **params)
+            finally:
+                if action_job is not None:
+                    action_job.chunk_done()
+
+    if action_job is not None:
+        action_job.add_chunks(len(chunks))
+
+    logging.debug("Sending %s for %d object%s in %d request%s to Icinga2" %
+                  (action, len(filter_list), plural(len(filter_list)), len(chunks), plural(len(chunks))))
+
+    chunk_responses = await asyncio.gather(*[send_chunk(chunk) for chunk in chunks], return_exceptions=True)
+
+    response.data = list()
+    chunk_errors = list()
+    for chunk_number, (chunk, chunk_response) in enumerate(zip(chunks, chunk_responses), 1):
+        if isinstance(chunk_response, Exception):
+            logging.error("Icinga2 %s request %d of %d failed: %s" %
+                          (action, chunk_number, len(chunks), str(chunk_response)))
+            chunk_errors.append("Request %d of %d (%d object%s) failed: %s" %
+                                (chunk_number, len(chunks), len(chunk), plural(len(chunk)), str(chunk_response)))
+        else:
+            response.data.extend((chunk_response or dict()).get("results") or list())
+
+    if len(chunk_errors) > 0:
+        response.error = "\n".join(chunk_errors)
+
+    return response
+
+
 def get_i2_filter(object_type="Host", slack_message=""):
     """Parse a Slack message and create lists of filters depending on the
     object type
@@ -320,7 +792,7 @@ def get_i2_filter(object_type="Host", slack_message=""):
 
     logging.debug("Start compiling Icinga2 filters for received message: %s" % slack_message)
 
-    if slack_message.strip() is not "":
+    if slack_message.strip() != "":
         filter_options = quoted_split(string_to_split=slack_message, preserve_quotations=True)
 
     valid_filter_states = IcingaStates()
@@ -0,0 +1,565 @@
+####
+#
+#   Long lived and pooled connections to the Icinga2 API
+#
+
+import asyncio
+import json
+import logging
+import ssl as ssl_lib
+import threading
+from datetime import datetime
+from urllib.parse import urljoin
+
+# external
+import aiohttp
+from icinga2apic.exceptions import Icinga2ApiException, Icinga2ApiRequestException
+from icinga2apic.objects import Objects
+
+
+default_icinga_connection_timeout = 5
+default_icinga_max_connections = 10
+
+# number of failed requests in a row before an endpoint is considered unhealthy
+# and all pooled connections to this endpoint get dropped
+max_consecutive_failures = 3
+
+
+def get_icinga_timeout(config):
+    """
+    return the Icinga request timeout defined in config or the default
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+
+    Returns
+    -------
+    int: timeout in seconds
+    """
+
+    if config.get("icinga.timeout") is not None and str(config.get("icinga.timeout")) != "":
+        return int(config.get("icinga.timeout"))
+
+    return default_icinga_connection_timeout
+
+
+def get_icinga_max_connections(config):
+    """
+    return the maximum number of pooled connections per Icinga endpoint
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+
+    Returns
+    -------
+    int: maximum number of connections
+    """
+
+    if config.get("icinga.max_connections") is not None and str(config.get("icinga.max_connections")) != "":
+        return int(config.get("icinga.max_connections"))
+
+    return default_icinga_max_connections
+
+
+class IcingaEndpoint:
+    """
+    A class used to represent a single Icinga2 API endpoint.
+
+    It owns one keep-alive aiohttp session with a bounded connection pool. Connections
+    (and therefore their TLS sessions) are reused for all requests to this endpoint.
+    Successes and failures of each request are tracked to determine the endpoint health.
+
+    The session is created lazily inside the running event loop.
+    """
+
+    def __init__(self, url=None, username=None, password=None, certificate=None, key=None,
+                 ca_certificate=None, timeout=default_icinga_connection_timeout,
+                 max_connections=default_icinga_max_connections):
+
+        self.url = url
+        self.username = username
+        self.password = password
+        self.certificate = certificate
+        self.key = key
+        self.ca_certificate = ca_certificate
+        self.timeout = timeout
+        self.max_connections = max_connections
+
+        self.async_session = None
+
+        self.num_requests = 0
+        self.consecutive_failures = 0
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+
+    def __repr__(self):
+        return "<IcingaEndpoint %s healthy=%s requests=%d>" % (self.url, self.healthy, self.num_requests)
+
+    def get_ssl_context(self):
+        """
+        return a SSL context for the aiohttp session which verifies the Icinga2
+        certificate only if a CA certificate is configured
+        """
+
+        if self.ca_certificate:
+            ssl_context = ssl_lib.create_default_context(cafile=self.ca_certificate)
+        else:
+            ssl_context = ssl_lib.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl_lib.CERT_NONE
+
+        if self.certificate:
+            ssl_context.load_cert_chain(self.certificate, self.key if self.key else None)
+
+        return ssl_context
+
+    def get_async_session(self) -> aiohttp.ClientSession:
+        """
+        return the aiohttp session of this endpoint, needs to be called
+        from within a running event loop
+
+        Returns
+        -------
+        aiohttp.ClientSession: session with a bounded connection pool
+        """
+
+        if self.async_session is None or self.async_session.closed:
+
+            auth = None
+            if not self.certificate and self.username and self.password:
+                auth = aiohttp.BasicAuth(self.username, self.password)
+
+            self.async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ssl=self.get_ssl_context()),
+                auth=auth,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    "User-Agent": "icinga-slack-bot",
+                    "Accept": "application/json"
+                }
+            )
+
+        return self.async_session
+
+    def reset_async_session(self):
+        """
+        drop the aiohttp session, a new one will be created with the next request
+        """
+
+        old_session = self.async_session
+        self.async_session = None
+
+        if old_session is not None and not old_session.closed:
+            # asyncio.get_running_loop() needs Python 3.7
+            try:
+                loop = asyncio.get_event_loop()
+            except RuntimeError:
+                loop = None
+
+            if loop is not None and loop.is_running():
+                loop.create_task(old_session.close())
+
+    def close(self):
+        """
+        close all pooled connections of this endpoint
+        """
+        self.reset_async_session()
+
+    @property
+    def healthy(self):
+        """
+        bool: False if the last 'max_consecutive_failures' requests failed
+        """
+        return self.consecutive_failures < max_consecutive_failures
+
+    async def async_request(self, method, url_path, payload=None):
+        """
+        perform a request using the aiohttp session of this endpoint
+
+        Parameters
+        ----------
+        method : str
+            HTTP method to override the POST request with
+        url_path : str
+            the requested url path
+        payload : dict, optional
+            the payload to send
+
+        Returns
+        -------
+        dict: the json decoded response
+
+        Raises
+        ------
+        Icinga2ApiRequestException: if the response status is not 2xx, the error
+            string is formatted the same way as the icinga2apic one
+        """
+
+        request_url = urljoin(self.url, url_path)
+
+        self.num_requests += 1
+
+        try:
+            async with self.get_async_session().post(request_url, json=payload,
+                                                     headers={"X-HTTP-Method-Override": method.upper()}) as response:
+                response_text = await response.text()
+
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            self.mark_failure(str(e) or e.__class__.__name__)
+            raise Icinga2ApiException("Request \"%s\" failed: %s" % (request_url, str(e) or e.__class__.__name__))
+
+        self.mark_success()
+
+        try:
+            response_data = json.loads(response_text)
+        except ValueError:
+            response_data = None
+
+        if not 200 <= response.status <= 299:
+            raise Icinga2ApiRequestException(
+                'Request "{}" failed with status {}: {}'.format(request_url, response.status, response_text),
+                response_data)
+
+        return response_data
+
+    async def async_stream(self, method, url_path, payload=None, connected=None):
+        """
+        perform a streaming request (i.e. /v1/events) using the aiohttp session of this endpoint
+
+        The total request timeout does not apply to streams, only
+        establishing the connection is bound to the endpoint timeout.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method to override the POST request with
+        url_path : str
+            the requested url path
+        payload : dict, optional
+            the payload to send
+        connected : asyncio.Event, optional
+            will be set once the stream has been established
+
+        Returns
+        -------
+        AsyncGenerator: yields each json decoded message of the stream
+        """
+
+        request_url = urljoin(self.url, url_path)
+
+        self.num_requests += 1
+
+        try:
+            async with self.get_async_session().post(request_url, json=payload,
+                                                     headers={"X-HTTP-Method-Override": method.upper()},
+                                                     timeout=aiohttp.ClientTimeout(total=None,
+                                                                                   sock_connect=self.timeout)
+                                                     ) as response:
+
+                if not 200 <= response.status <= 299:
+                    response_text = await response.text()
+                    self.mark_success()
+                    raise Icinga2ApiRequestException(
+                        'Request "{}" failed with status {}: {}'.format(request_url, response.status, response_text),
+                        None)
+
+                self.mark_success()
+
+                if connected is not None:
+                    connected.set()
+
+                # messages are separated by new lines, read chunks as lines can be very long
+                buffer = b""
+                async for chunk in response.content.iter_any():
+                    buffer += chunk
+                    while b"\n" in buffer:
+                        line, buffer = buffer.split(b"\n", 1)
+                        if len(line.strip()) > 0:
+                            yield json.loads(line)
+
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            self.mark_failure(str(e) or e.__class__.__name__)
+            raise Icinga2ApiException("Request \"%s\" failed: %s" % (request_url, str(e) or e.__class__.__name__))
+
+    def mark_success(self):
+        self.consecutive_failures = 0
+        self.last_success = datetime.now().timestamp()
+
+    def mark_failure(self, error=None):
+        self.consecutive_failures += 1
+        self.last_failure = datetime.now().timestamp()
+        self.last_error = error
+
+        logging.debug("Icinga2 endpoint '%s' request failed (%d in a row): %s" %
+                      (self.url, self.consecutive_failures, error))
+
+        # drop all pooled connections, they might be stale
+        if self.consecutive_failures == max_consecutive_failures:
+            logging.warning("Icinga2 endpoint '%s' marked as unhealthy, resetting connection pool" % self.url)
+            self.reset_async_session()
+
+
+class AsyncIcingaClient:
+    """
+    A native asyncio client for the Icinga2 API.
+
+    It covers the parts of the API the bot uses (objects, status and actions)
+    and sends all requests through the aiohttp session of an IcingaEndpoint.
+    """
+
+    def __init__(self, endpoint: IcingaEndpoint):
+
+        if not endpoint.url:
+            raise Icinga2ApiException('No "url" defined.')
+        if not endpoint.username and not endpoint.password and not endpoint.certificate:
+            raise Icinga2ApiException("Neither username/password nor certificate defined.")
+
+        self.endpoint = endpoint
+        self.url = endpoint.url
+
+    async def objects_list(self, object_type, attrs=None, filters=None):
+        """
+        request objects from /v1/objects
+
+        Parameters
+        ----------
+        object_type : str
+            the Icinga2 object type (Host, Service, Comment, Downtime)
+        attrs : list, optional
+            only return these attributes
+        filters : str, optional
+            Icinga2 filter expression
+
+        Returns
+        -------
+        list: list of returned objects
+        """
+
+        payload = dict()
+        if attrs:
+            payload["attrs"] = attrs
+        if filters:
+            payload["filter"] = filters
+
+        # noinspection PyProtectedMember
+        url_path = "v1/objects/%s" % Objects._convert_object_type(object_type)
+
+        response = await self.endpoint.async_request("GET", url_path, payload)
+
+        return response.get("results")
+
+    async def objects_update(self, object_type, attrs, name=None, filters=None):
+        """
+        update attributes of one named object or all objects matching filters
+
+        Parameters
+        ----------
+        object_type : str
+            the Icinga2 object type (Host, Service, IcingaApplication)
+        attrs : dict
+            the attributes to change
+        name : str, optional
+            the name of the object to update
+        filters : str, optional
+            Icinga2 filter expression
+
+        Returns
+        -------
+        dict: the Icinga2 response
+        """
+
+        # noinspection PyProtectedMember
+        url_path = "v1/objects/%s" % Objects._convert_object_type(object_type)
+
+        if name is not None:
+            url_path += "/%s" % name
+
+        payload = {"attrs": attrs}
+        if filters:
+            payload["filter"] = filters
+
+        return await self.endpoint.async_request("POST", url_path, payload)
+
+    async def status_list(self, component=None):
+        """
+        request Icinga2 status from /v1/status
+
+        Parameters
+        ----------
+        component : str, optional
+            only request the status of this component
+
+        Returns
+        -------
+        dict: the Icinga2 response
+        """
+
+        url_path = "v1/status"
+        if component:
+            url_path += "/%s" % component
+
+        return await self.endpoint.async_request("GET", url_path)
+
+    async def action(self, action, object_type, filters=None, name=None, **params):
+        """
+        perform an Icinga2 action using /v1/actions
+
+        Parameters
+        ----------
+        action : str
+            the action to perform (i.e. acknowledge-problem)
+        object_type : str
+            the object type the action is performed on
+        filters : str, optional
+            Icinga2 filter expression
+        name : str, optional
+            the name of the object to perform the action on
+        params:
+            additional action parameters, parameters with value None are omitted
+
+        Returns
+        -------
+        dict: the Icinga2 response
+        """
+
+        payload = {"type": object_type}
+
+        if name is not None:
+            payload[object_type.lower()] = name
+        if filters:
+            payload["filter"] = filters
+
+        for key, value in params.items():
+            if value is not None:
+                payload[key] = value
+
+        return await self.endpoint.async_request("POST", "v1/actions/%s" % action, payload)
+
+    def events_subscribe(self, types, queue, filters=None, connected=None):
+        """
+        subscribe to the Icinga2 event stream /v1/events
+
+        Parameters
+        ----------
+        types : list
+            the event types to subscribe to
+        queue : str
+            the unique queue name of this subscription
+        filters : str, optional
+            Icinga2 filter expression applied to the events
+        connected : asyncio.Event, optional
+            will be set once the subscription has been established
+
+        Returns
+        -------
+        AsyncGenerator: yields each received event as dict
+        """
+
+        payload = {
+            "types": types,
+            "queue": queue
+        }
+        if filters:
+            payload["filter"] = filters
+
+        return self.endpoint.async_stream("POST", "v1/events", payload, connected)
+
+
+class IcingaConnectionManager:
+    """
+    A class used to hand out long lived Icinga2 clients.
+
+    One IcingaEndpoint and one AsyncIcingaClient are created per Icinga endpoint
+    and reused for the lifetime of the bot.
+    """
+
+    def __init__(self):
+        self.endpoints = dict()
+        self.async_clients = dict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint_key(config):
+        return (
+            "https://%s:%s" % (config.get("icinga.hostname"), config.get("icinga.port")),
+            config.get("icinga.username"),
+            config.get("icinga.password"),
+            config.get("icinga.certificate"),
+            config.get("icinga.key"),
+            config.get("icinga.ca_certificate"),
+            get_icinga_timeout(config),
+            get_icinga_max_connections(config)
+        )
+
+    def get_endpoint(self, config) -> IcingaEndpoint:
+        """
+        return the IcingaEndpoint for the Icinga instance defined in config
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+
+        Returns
+        -------
+        IcingaEndpoint: the endpoint for this config
+        """
+
+        endpoint_key = self.get_endpoint_key(config)
+
+        with self.lock:
+            if self.endpoints.get(endpoint_key) is None:
+                url, username, password, certificate, key, ca_certificate, timeout, max_connections = endpoint_key
+
+                logging.debug("Setting up new Icinga2 endpoint: %s" % url)
+
+                self.endpoints[endpoint_key] = IcingaEndpoint(
+                    url=url, username=username, password=password, certificate=certificate, key=key,
+                    ca_certificate=ca_certificate, timeout=timeout, max_connections=max_connections
+                )
+
+            return self.endpoints.get(endpoint_key)
+
+    def get_async_client(self, config) -> AsyncIcingaClient:
+        """
+        return the shared asyncio Icinga2 client for the Icinga instance defined in config
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+
+        Returns
+        -------
+        AsyncIcingaClient: native asyncio client using pooled connections
+        """
+
+        endpoint = self.get_endpoint(config)
+
+        with self.lock:
+            if self.async_clients.get(endpoint.url) is None or \
+                    self.async_clients.get(endpoint.url).endpoint is not endpoint:
+                self.async_clients[endpoint.url] = AsyncIcingaClient(endpoint)
+
+            return self.async_clients.get(endpoint.url)
+
+    def close(self):
+        """
+        close all connections of all endpoints
+        """
+        with self.lock:
+            for endpoint in self.endpoints.values():
+                endpoint.close()
+
+            self.endpoints = dict()
+            self.async_clients = dict()
+
+
+connection_manager = IcingaConnectionManager()
+
+# EOF
@@ -0,0 +1,547 @@
+####
+#
+#   Keep an in memory mirror of Icinga2 host/service states
+#
+
+import asyncio
+import fnmatch
+import logging
+import os
+import re
+import socket
+import threading
+from datetime import datetime
+
+# internal
+from .common import quoted_split
+from .icinga_connection_manager import connection_manager
+
+
+# attributes requested for the initial sync, a superset of the attributes requested by async_get_i2_object()
+mirror_object_attrs = {
+    "Host": ['name', 'state', 'last_check_result', 'acknowledgement', 'downtime_depth', 'last_state_change',
+             'enable_active_checks', 'enable_event_handler', 'enable_flapping', 'enable_notifications',
+             'enable_passive_checks'],
+    "Service": ['name', 'state', 'last_check_result', 'acknowledgement', 'downtime_depth', 'last_state_change',
+                'enable_active_checks', 'enable_event_handler', 'enable_flapping', 'enable_notifications',
+                'enable_passive_checks', 'host_name'],
+    "Comment": ['author', 'text', 'host_name', 'service_name', 'entry_time', 'expire_time', 'type',
+                'entry_type', 'name'],
+    "Downtime": ['author', 'comment', 'host_name', 'service_name', 'entry_time', 'start_time', 'end_time',
+                 'fixed', 'duration', 'type', 'name', 'trigger_time']
+}
+
+mirror_event_types = [
+    "CheckResult",
+    "StateChange",
+    "AcknowledgementSet",
+    "AcknowledgementCleared",
+    "CommentAdded",
+    "CommentRemoved",
+    "DowntimeAdded",
+    "DowntimeRemoved",
+    "DowntimeStarted",
+    "DowntimeTriggered"
+]
+
+# do a full sync every 15 minutes to correct any drift
+mirror_resync_interval = 900
+
+# maximum seconds to wait before reconnecting to the event stream
+mirror_max_reconnect_delay = 60
+
+# requests failing with these status codes won't succeed on retry, i.e. missing API permissions
+request_status_regex = re.compile(r" failed with status (4\d\d)")
+
+# a state filter as compiled by get_i2_filter() i.e.: "service.state != 0"
+state_filter_regex = re.compile(r"^\s*(host|service|comment|downtime)\.(\w+)\s*(==|!=|>|<)\s*(\d+)\s*$")
+
+
+class IcingaStateMirror:
+    """
+    A class used to hold a local copy of all Icinga2 hosts, services, comments and downtimes.
+
+    After a full sync of all objects, the Icinga2 event stream is used to keep
+    the local copy up to date. Requests to /v1/objects can be answered from
+    this mirror as long as the requested filter can be evaluated locally.
+    """
+
+    def __init__(self):
+        self.objects = {
+            "Host": dict(),
+            "Service": dict(),
+            "Comment": dict(),
+            "Downtime": dict()
+        }
+        # keys of all hosts/services not in UP/OK state
+        self.problems = {
+            "Host": set(),
+            "Service": set()
+        }
+        # keys of downtimes per (host_name, service_name)
+        self.object_downtimes = dict()
+
+        self.ready = False
+        self.disabled = False
+        self.syncing = False
+        self.pending_events = list()
+        self.last_sync = None
+        self.num_events = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<IcingaStateMirror ready=%s hosts=%d services=%d events=%d>" % \
+               (self.ready, len(self.objects["Host"]), len(self.objects["Service"]), self.num_events)
+
+    @staticmethod
+    def get_object_key(object_type, data):
+        """
+        return the key an object is stored with
+
+        Parameters
+        ----------
+        object_type : str
+            Host, Service, Comment or Downtime
+        data : dict
+            the object attributes
+
+        Returns
+        -------
+        tuple: the object key
+        """
+
+        if object_type == "Host":
+            return data.get("name"),
+        if object_type == "Service":
+            return data.get("host_name"), data.get("name")
+
+        return data.get("host_name"), data.get("service_name") or "", data.get("name")
+
+    @staticmethod
+    def get_event_object(event):
+        """
+        return object type and key of the host/service an event belongs to
+        """
+
+        if event.get("service"):
+            return "Service", (event.get("host"), event.get("service"))
+
+        return "Host", (event.get("host"),)
+
+    async def run(self, config):
+        """
+        keep the mirror in sync forever, needs to be started as task in the running event loop
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+        """
+
+        reconnect_delay = 1
+
+        while True:
+
+            consumer = None
+
+            try:
+                i2_handle = connection_manager.get_async_client(config)
+
+                queue_name = "icinga-slack-bot-%s-%d" % (socket.gethostname(), os.getpid())
+
+                # keep all events which arrive until the first sync is done
+                with self.lock:
+                    self.syncing = True
+                    self.pending_events = list()
+
+                # subscribe to event stream first to not lose any changes while syncing
+                connected = asyncio.Event()
+                consumer = asyncio.ensure_future(
+                    self.consume_events(i2_handle.events_subscribe(mirror_event_types, queue_name,
+                                                                   connected=connected)))
+
+                # don't sync all objects before the event stream has been established
+                connected_wait = asyncio.ensure_future(connected.wait())
+                await asyncio.wait([connected_wait, consumer], return_when=asyncio.FIRST_COMPLETED)
+                connected_wait.cancel()
+
+                if consumer.done():
+                    consumer.result()
+                    raise ConnectionError("Icinga2 event stream closed before it has been established")
+
+                while True:
+                    await self.full_sync(i2_handle, config)
+
+                    reconnect_delay = 1
+
+                    done, _ = await asyncio.wait([consumer], timeout=mirror_resync_interval)
+
+                    if consumer in done:
+                        # raises the exception of the consumer or continues with reconnecting
+                        consumer.result()
+                        logging.warning("Icinga2 event stream closed")
+                        break
+
+            except asyncio.CancelledError:
+                if consumer is not None:
+                    consumer.cancel()
+                raise
+
+            except Exception as e:
+                logging.error("Icinga2 state mirror error: %s" % str(e))
+
+                # retrying would only put load on Icinga2 without ever getting in sync
+                if request_status_regex.search(str(e)) is not None:
+                    self.disable()
+
+            if consumer is not None:
+                consumer.cancel()
+
+            with self.lock:
+                self.ready = False
+                self.syncing = False
+                self.pending_events = list()
+
+            if self.disabled is True:
+                return
+
+            logging.info("Reconnecting Icinga2 state mirror in %d seconds" % reconnect_delay)
+            await asyncio.sleep(reconnect_delay)
+
+            reconnect_delay = min(reconnect_delay * 2, mirror_max_reconnect_delay)
+
+    def disable(self):
+        """
+        stop using the mirror, all requests are answered by Icinga2 again
+        """
+
+        logging.error("Icinga2 rejected a state mirror request, disabling the state mirror. "
+                      "Check the API permissions (objects/query/* and events/*) of the API user.")
+
+        self.disabled = True
+
+    async def consume_events(self, events):
+        """
+        apply all events received from the event stream
+
+        Parameters
+        ----------
+        events : AsyncGenerator
+            the event stream
+        """
+
+        async for event in events:
+            self.num_events += 1
+
+            with self.lock:
+                if self.syncing:
+                    self.pending_events.append(event)
+                elif self.ready:
+                    self.handle_event(event)
+
+    async def full_sync(self, i2_handle, config):
+        """
+        request all hosts, services, comments and downtimes and replace the current mirror
+
+        Parameters
+        ----------
+        i2_handle : AsyncIcingaClient
+            Icinga2 client to use
+        config : dict
+            dictionary with items parsed from config file
+        """
+
+        logging.debug("Starting full sync of Icinga2 state mirror")
+
+        # events which arrive during sync are applied afterwards
+        with self.lock:
+            self.syncing = True
+
+        try:
+            object_types = list(mirror_object_attrs.keys())
+
+            results = await asyncio.gather(*[
+                i2_handle.objects_list(object_type, attrs=mirror_object_attrs.get(object_type),
+                                       filters=config.get("icinga.filter") or None)
+                for object_type in object_types
+            ])
+
+            objects = dict()
+            for object_type, result in zip(object_types, results):
+                objects[object_type] = dict()
+                for result_object in result:
+                    data = result_object.get("attrs")
+                    if object_type in ["Comment", "Downtime"]:
+                        data["type"] = object_type
+                    objects[object_type][self.get_object_key(object_type, data)] = data
+
+            with self.lock:
+                self.objects = objects
+
+                for object_type in self.problems.keys():
+                    self.problems[object_type] = \
+                        {key for key, data in objects[object_type].items() if data.get("state")}
+
+                self.object_downtimes = dict()
+                for key in objects["Downtime"].keys():
+                    self.object_downtimes.setdefault(key[0:2], set()).add(key)
+
+                # apply all events which arrived during sync
+                for event in self.pending_events:
+                    self.handle_event(event)
+
+                self.pending_events = list()
+                self.last_sync = datetime.now().timestamp()
+                self.ready = True
+
+        finally:
+            with self.lock:
+                self.syncing = False
+
+        logging.info("Icinga2 state mirror synced %d hosts, %d services, %d comments and %d downtimes" %
+                     tuple(len(self.objects.get(x)) for x in ["Host", "Service", "Comment", "Downtime"]))
+
+    def update_problem(self, object_type, key, data):
+        if data.get("state"):
+            self.problems[object_type].add(key)
+        else:
+            self.problems[object_type].discard(key)
+
+    def update_downtime_depth(self, host_name, service_name):
+        """
+        recalculate 'downtime_depth' of a host/service based on the triggered downtimes
+        """
+
+        if service_name:
+            data = self.objects["Service"].get((host_name, service_name))
+        else:
+            data = self.objects["Host"].get((host_name,))
+
+        if data is None:
+            return
+
+        data["downtime_depth"] = len([
+            key for key in self.object_downtimes.get((host_name, service_name or ""), set())
+            if (self.objects["Downtime"].get(key) or {}).get("trigger_time")
+        ])
+
+    def handle_event(self, event):
+        """
+        apply a single event to the mirror, needs to be called while holding the lock
+
+        Parameters
+        ----------
+        event : dict
+            the event received from the Icinga2 event stream
+        """
+
+        event_type = event.get("type")
+
+        if event_type in ["CheckResult", "StateChange", "AcknowledgementSet", "AcknowledgementCleared"]:
+
+            object_type, key = self.get_event_object(event)
+            data = self.objects[object_type].get(key)
+
+            # object is unknown or filtered
+            if data is None:
+                return
+
+            if event.get("check_result") is not None:
+                data["last_check_result"] = event.get("check_result")
+
+            if event_type == "StateChange":
+                data["state"] = event.get("state")
+                data["last_state_change"] = event.get("timestamp")
+                self.update_problem(object_type, key, data)
+
+            elif event_type == "AcknowledgementSet":
+                data["acknowledgement"] = event.get("acknowledgement_type") or 1
+
+            elif event_type == "AcknowledgementCleared":
+                data["acknowledgement"] = 0
+
+        elif event_type in ["CommentAdded", "CommentRemoved"]:
+
+            comment = event.get("comment") or dict()
+
+            # only keep comments of known objects
+            if self.get_parent(comment, "service" if comment.get("service_name") else "host") is None:
+                return
+
+            data = {attr: comment.get(attr) for attr in mirror_object_attrs["Comment"]}
+            data["type"] = "Comment"
+            key = self.get_object_key("Comment", data)
+
+            if event_type == "CommentAdded":
+                self.objects["Comment"][key] = data
+            else:
+                self.objects["Comment"].pop(key, None)
+
+        elif event_type in ["DowntimeAdded", "DowntimeRemoved", "DowntimeStarted", "DowntimeTriggered"]:
+
+            downtime = event.get("downtime") or dict()
+
+            # only keep downtimes of known objects
+            if self.get_parent(downtime, "service" if downtime.get("service_name") else "host") is None:
+                return
+
+            key = self.get_object_key("Downtime", downtime)
+
+            data = dict(self.objects["Downtime"].get(key) or {})
+            data.update({attr: downtime.get(attr) for attr in mirror_object_attrs["Downtime"] if attr in downtime})
+            data["type"] = "Downtime"
+
+            if event_type == "DowntimeRemoved":
+                self.objects["Downtime"].pop(key, None)
+                self.object_downtimes.get(key[0:2], set()).discard(key)
+            else:
+                if event_type == "DowntimeTriggered" and not data.get("trigger_time"):
+                    data["trigger_time"] = event.get("timestamp")
+
+                self.objects["Downtime"][key] = data
+                self.object_downtimes.setdefault(key[0:2], set()).add(key)
+
+            self.update_downtime_depth(data.get("host_name"), data.get("service_name"))
+
+    def get_parent(self, data, prefix):
+        """
+        return the host or service a comment/downtime belongs to
+        """
+
+        if prefix == "host":
+            return self.objects["Host"].get((data.get("host_name"),))
+
+        return self.objects["Service"].get((data.get("host_name"), data.get("service_name")))
+
+    def query(self, object_type="Host", filter_states=None, filter_names=None, acknowledged=None, downtime=None,
+              list_attrs=None):
+        """
+        answer an object request from the local mirror
+
+        Same parameters and filter semantics as async_get_i2_object(). Only the
+        attributes in list_attrs are returned (default: all mirrored attributes).
+
+        Returns
+        -------
+        list, None: list of objects in the same format as returned by /v1/objects,
+            None if the mirror is not ready or the filter can't be evaluated locally
+        """
+
+        if self.ready is False:
+            return None
+
+        if "Comment" in object_type:
+            requested_object_type = "Comment"
+        elif "Downtime" in object_type:
+            requested_object_type = "Downtime"
+        else:
+            requested_object_type = object_type
+
+        if requested_object_type not in self.objects.keys():
+            return None
+
+        # parse state filters
+        state_conditions = list()
+        for filter_state in filter_states or list():
+            match = state_filter_regex.match(filter_state)
+            if match is None:
+                return None
+
+            prefix, attr, operator, value = match.groups()
+            if requested_object_type in ["Host", "Service"] and prefix != requested_object_type.lower():
+                return None
+
+            state_conditions.append((prefix, attr, operator, int(value)))
+
+        # parse name filters
+        names = list()
+        if filter_names and len(filter_names) >= 1 and filter_names[0] != "":
+            names = ["*%s*" % x for x in quoted_split(string_to_split=" ".join(filter_names))]
+
+        # same as in compile_i2_object_query(), acknowledgement and downtime
+        # filters are only applied if a state or name filter is present
+        if len(state_conditions) == 0 and len(names) == 0:
+            acknowledged = downtime = None
+
+        def compare(current_value, operator, value):
+            if current_value is None:
+                return False
+            if operator == "==":
+                return current_value == value
+            if operator == "!=":
+                return current_value != value
+            if operator == ">":
+                return current_value > value
+            return current_value < value
+
+        def matches(data):
+
+            if requested_object_type == "Host":
+                host_name, service_name = data.get("name"), None
+            elif requested_object_type == "Service":
+                host_name, service_name = data.get("host_name"), data.get("name")
+            else:
+                host_name, service_name = data.get("host_name"), data.get("service_name") or None
+
+            if len(state_conditions) > 0:
+                state_match = False
+                for prefix, attr, operator, value in state_conditions:
+                    if prefix in [requested_object_type.lower(), "comment", "downtime"]:
+                        this_object = data
+                    else:
+                        this_object = self.get_parent(data, prefix)
+
+                    if this_object is not None and compare(this_object.get(attr), operator, value):
+                        state_match = True
+                        break
+
+                if state_match is False:
+                    return False
+
+            if len(names) > 0:
+                if "Host" in object_type:
+                    if not any(fnmatch.fnmatchcase(host_name, x) for x in names):
+                        return False
+
+                elif service_name is None:
+                    return False
+
+                elif len(names) == 1:
+                    if not (fnmatch.fnmatchcase(host_name, names[0]) or fnmatch.fnmatchcase(service_name, names[0])):
+                        return False
+
+                elif not ((fnmatch.fnmatchcase(host_name, names[0]) and fnmatch.fnmatchcase(service_name, names[1]))
+                          or (fnmatch.fnmatchcase(host_name, names[1]) and
+                              fnmatch.fnmatchcase(service_name, names[0]))):
+                    return False
+
+            if acknowledged is not None and (data.get("acknowledgement", 0) > 0) != acknowledged:
+                return False
+
+            if downtime is not None and (data.get("downtime_depth", 0) > 0) != downtime:
+                return False
+
+            return True
+
+        with self.lock:
+
+            this_objects = self.objects[requested_object_type]
+
+            # only problems are requested, no need to look at all objects
+            if requested_object_type in self.problems.keys() and len(state_conditions) > 0 and \
+                    all(x[2] == "!=" and x[3] == 0 or x[2] == "==" and x[3] > 0 for x in state_conditions):
+                candidates = [this_objects.get(key) for key in self.problems[requested_object_type]]
+            else:
+                candidates = this_objects.values()
+
+            result = [{"attrs": {key: value for key, value in data.items() if list_attrs is None or key in list_attrs}}
+                      for data in candidates if data is not None and matches(data)]
+
+        logging.debug("Answered %s request from Icinga2 state mirror" % object_type)
+
+        return result
+
+
+state_mirror = IcingaStateMirror()
+
+# EOF
@@ -0,0 +1,137 @@
+####
+#
+#   Process Slack messages of different users in parallel
+#
+
+import asyncio
+import logging
+
+default_max_message_workers = 10
+
+
+class MessageDispatcher:
+    """
+    Processes the messages of each user strictly in order
+    while messages of different users are processed in parallel.
+
+    Every user gets a queue of pending messages and a worker
+    which exists as long as the queue isn't empty. The number of
+    messages processed at the same time is limited by the worker slots.
+    """
+
+    def __init__(self):
+
+        self.user_queues = dict()
+        self.user_workers = dict()
+        self.max_workers = default_max_message_workers
+        self.worker_slots = None
+
+    @staticmethod
+    def get_max_workers(config):
+        """
+        Return the number of messages which can be processed at the same time
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+
+        Returns
+        -------
+        int: maximum number of workers
+        """
+
+        if config.get("slack.max_message_workers") is not None and \
+                str(config.get("slack.max_message_workers")) != "":
+            return max(1, int(config.get("slack.max_message_workers")))
+
+        return default_max_message_workers
+
+    def setup(self, config):
+        """
+        Set number of worker slots from config
+
+        Parameters
+        ----------
+        config : dict
+            dictionary with items parsed from config file
+        """
+
+        self.max_workers = self.get_max_workers(config)
+        self.worker_slots = None
+
+    def get_worker_slots(self):
+
+        # create semaphore lazily to use the running loop
+        if self.worker_slots is None:
+            self.worker_slots = asyncio.Semaphore(self.max_workers)
+
+        return self.worker_slots
+
+    def dispatch(self, user_id, message_handler, *args, **kwargs):
+        """
+        add a message to the queue of this user
+
+        Parameters
+        ----------
+        user_id: str
+            id of the user who sent the message
+        message_handler: function
+            coroutine function which processes the message
+        args:
+            positional arguments passed to message_handler
+        kwargs:
+            keyword arguments passed to message_handler
+
+        Returns
+        -------
+        asyncio.Future: resolves to the return value of message_handler
+        """
+
+        processed = asyncio.get_event_loop().create_future()
+
+        queue = self.user_queues.setdefault(user_id, asyncio.Queue())
+        queue.put_nowait((message_handler, args, kwargs, processed))
+
+        logging.debug("Queued message of user '%s', %d message(s) pending" % (user_id, queue.qsize()))
+
+        if self.user_workers.get(user_id) is None:
+            self.user_workers[user_id] = asyncio.ensure_future(self.user_worker(user_id))
+
+        return processed
+
+    async def user_worker(self, user_id):
+        """
+        process all queued messages of a user in order
+
+        Parameters
+        ----------
+        user_id: str
+            id of the user to work on
+        """
+
+        queue = self.user_queues.get(user_id)
+
+        try:
+            while not queue.empty():
+                message_handler, args, kwargs, processed = queue.get_nowait()
+
+                result = None
+                async with self.get_worker_slots():
+                    try:
+                        result = await message_handler(*args, **kwargs)
+                    except Exception as e:
+                        logging.error("Unable to process message of user '%s': %s" % (user_id, str(e)))
+
+                if not processed.done():
+                    processed.set_result(result)
+
+        finally:
+            # no awaits after the queue is empty, no message can be added without starting a new worker
+            del self.user_workers[user_id]
+            del self.user_queues[user_id]
+
+
+message_dispatcher = MessageDispatcher()
+
+# EOF
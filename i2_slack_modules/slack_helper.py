@@ -3,10 +3,16 @@
 # Some Slack helper function to format messages properly
 #
 
-from . import plural, slack_max_block_text_length
-from .classes import BotResponse
+import csv
+import io
+
+from . import plural, yes_no, slack_max_block_text_length
+from .classes import BotResponse, CommentDowntimeIndex
 from .icinga_states import IcingaStates
 
+# results with more objects will be uploaded as file
+default_file_upload_threshold = 1000
+
 
 def get_web2_slack_url(host, service=None, web2_url=""):
     """
@@ -40,156 +46,259 @@ def get_web2_slack_url(host, service=None, web2_url=""):
     return url
 
 
-def format_slack_response(config, object_type="Host", result_objects=None, comment_downtime_list=None):
-    """Format a slack response
+def iterate_formatted_objects(config, object_type="Host", result_objects=None, comment_downtime_index=None):
+    """Format Icinga objects lazily into Slack formatted text lines
 
-    The objects will compiled into Slack message blocks.
-    This function will try to fill up blocks until
-    'slack_max_block_text_length' is reached.
+    Services will be grouped by host. The result objects will be consumed one
+    by one and are never modified. No more objects are requested once
+    'icinga.max_returned_results' is reached.
 
     Parameters
     ----------
     config : dict
         dictionary with items parsed from config file
     object_type : str
-        the object type to request (Host or Service)
-    result_objects : list
-        a list of objects to include in the Slack message
-    comment_downtime_list: list
-        a list of comments and downtimes which returned for the results , add speech bubble, zzz and handled
+        the object type to format (Host or Service)
+    result_objects : iterable
+        the objects to format
+    comment_downtime_index: CommentDowntimeIndex
+        index of comments and downtimes of the results, add speech bubble, zzz and handled
 
     Returns
     -------
-    list
-        returns a list of slack message blocks
+    Generator: yields a formatted text line per host, service or host service group header
     """
 
-    response = BotResponse()
+    icinga_states = IcingaStates()
+    web2_url = config["icinga.web2_url"]
+
+    max_returned_results = None
+    if config["icinga.max_returned_results"] != "":
+        max_returned_results = int(config["icinga.max_returned_results"])
+
+    if comment_downtime_index is None:
+        comment_downtime_index = CommentDowntimeIndex()
+
     current_host = None
     service_list = list()
-    response_objects = list()
     num_results = 0
-    icinga_states = IcingaStates()
 
-    if result_objects and len(result_objects) != 0:
-
-        # append an "end marker" to avoid code redundancy
-        result_objects.append({"last_object": True})
+    def service_group():
+        yield "*%s* (%d service%s)" % (
+            get_web2_slack_url(current_host, web2_url=web2_url),
+            len(service_list),
+            plural(len(service_list))
+        )
+        yield from service_list
 
-        # add formatted text for each object to response_objects
-        for result_object in result_objects:
-            last_check = result_object.get("last_check_result")
+    for result_object in result_objects or list():
+        last_check = result_object.get("last_check_result")
 
-            # take care of pending status which don't have a check result
-            output = None
-            if last_check is not None:
-                output = last_check.get("output")
+        # take care of pending status which don't have a check result
+        output = None
+        if last_check is not None:
+            output = last_check.get("output")
 
-            # get comments for this object
-            if object_type is "Host":
-                object_comment_downtime_list = \
-                    [item for item in comment_downtime_list
-                     if item["host_name"] == result_object.get("name") and item["service_name"] == ""]
-            else:
-                object_comment_downtime_list = \
-                    [item for item in comment_downtime_list
-                     if item["host_name"] == result_object.get("host_name") and
-                        item["service_name"] == result_object.get("name")]
+        # get host and service name of this object
+        if object_type == "Host":
+            host_name = result_object.get("name")
+            service_name = None
+        else:
+            host_name = result_object.get("host_name")
+            service_name = result_object.get("name")
 
-            # add speech bubble if object has comments
-            append_to_title = ""
-            if len([item for item in object_comment_downtime_list if item['type'] == 'Comment']) > 0:
-                append_to_title += " :speech_balloon:"
+        # add speech bubble if object has comments
+        append_to_title = ""
+        if comment_downtime_index.count(host_name, service_name, "Comment") > 0:
+            append_to_title += " :speech_balloon:"
 
-            # add zzz if object has downtime
-            if len([item for item in object_comment_downtime_list if item['type'] == 'Downtime']) > 0:
-                append_to_title += " :zzz:"
+        # add zzz if object has downtime
+        if comment_downtime_index.count(host_name, service_name, "Downtime") > 0:
+            append_to_title += " :zzz:"
 
-            # change attachment color and add hint to status text if object is taken care of
-            if result_object.get("state") is not None and result_object.get("state") > 0:
-                if result_object.get("acknowledgement") >= 1 or result_object.get("downtime_depth") >= 1:
-                    append_to_title += " (handled)"
+        # change attachment color and add hint to status text if object is taken care of
+        if result_object.get("state") is not None and result_object.get("state") > 0:
+            if result_object.get("acknowledgement") >= 1 or result_object.get("downtime_depth") >= 1:
+                append_to_title += " (handled)"
 
-            if object_type is "Host":
+        if object_type == "Host":
 
-                # stop if we found the "end marker"
-                if result_object.get("last_object"):
-                    break
+            yield "{state_emoji} {url}{additional_info}: {output}".format(
+                state_emoji=icinga_states.value(result_object.get("state"), object_type).icon,
+                url=get_web2_slack_url(host_name, web2_url=web2_url),
+                additional_info=append_to_title,
+                output=f"{output}"
+            )
 
-                text = "{state_emoji} {url}{additional_info}: {output}".format(
-                    state_emoji=icinga_states.value(result_object.get("state"), object_type).icon,
-                    url=get_web2_slack_url(result_object.get("name"), web2_url=config["icinga.web2_url"]),
-                    additional_info=append_to_title,
-                    output=f"{output}"
-                )
+        else:
+            # all services of the previous host have been collected
+            if current_host and current_host != host_name:
+                yield from service_group()
+                service_list = list()
 
-                response_objects.append(text)
+            current_host = host_name
 
-            else:
-                if (current_host and current_host != result_object.get("host_name")) or \
-                        result_object.get("last_object"):
+            service_list.append("&gt;{state_emoji} {url}{additional_info}: {output}".format(
+                state_emoji=icinga_states.value(result_object.get("state"), object_type).icon,
+                url=get_web2_slack_url(host_name, service_name, web2_url=web2_url),
+                additional_info=append_to_title,
+                output=f"{output}"
+            ))
 
-                    text = "*%s* (%d service%s)" % (
-                        get_web2_slack_url(current_host, web2_url=config["icinga.web2_url"]),
-                        len(service_list),
-                        plural(len(service_list))
-                    )
+        num_results += 1
 
-                    response_objects.append(text)
-                    response_objects.extend(service_list)
-                    service_list = []
+        if max_returned_results is not None and num_results >= max_returned_results:
+            if len(service_list) > 0:
+                yield from service_group()
 
-                # stop if we found the "end marker"
-                if result_object.get("last_object"):
-                    break
+            yield ":end: *reached maximum number (%s) of allowed results*" % config["icinga.max_returned_results"]
+            yield "\t\t*please narrow down your search pattern*"
 
-                current_host = result_object.get("host_name")
+            return
 
-                service_text = "&gt;{state_emoji} {url}{additional_info}: {output}"
+    if len(service_list) > 0:
+        yield from service_group()
 
-                service_text = service_text.format(
-                    state_emoji=icinga_states.value(result_object.get("state"), object_type).icon,
-                    url=get_web2_slack_url(current_host, result_object.get("name"), web2_url=config["icinga.web2_url"]),
-                    additional_info=append_to_title,
-                    output=f"{output}"
-                )
 
-                service_list.append(service_text)
+def iterate_slack_block_texts(text_lines, max_blocks=None):
+    """Fill text lines into Slack message block texts
 
-            num_results += 1
+    A block text will be emitted as soon as the next line would exceed
+    'slack_max_block_text_length'. Lines which don't fit into a block on their own
+    get truncated. If 'max_blocks' is reached, the last block will contain a hint
+    and no more lines will be consumed.
 
-            if config["icinga.max_returned_results"] != "":
-                if num_results >= int(config["icinga.max_returned_results"]):
-                    if object_type is "Service":
-                        text = "*%s* (%d service%s)" % (
-                            get_web2_slack_url(current_host, web2_url=config["icinga.web2_url"]),
-                            len(service_list),
-                            plural(len(service_list))
-                        )
+    Parameters
+    ----------
+    text_lines : iterable
+        formatted text lines, see iterate_formatted_objects()
+    max_blocks : int, optional
+        maximum number of block texts to emit (default: unlimited)
 
-                        response_objects.append(text)
-                        response_objects.extend(service_list)
+    Returns
+    -------
+    Generator: yields text for each block
+    """
 
-                    response_objects.append(":end: *reached maximum number (%s) of allowed results*" %
-                                            config["icinga.max_returned_results"])
-                    response_objects.append("\t\t*please narrow down your search pattern*")
-
-                    break
+    block_lines = list()
+    block_length = 0
+    num_blocks = 0
 
-    # fill blocks with formatted response
-    block_text = ""
-    for response_object in response_objects:
+    for text_line in text_lines:
 
-        if len(block_text) + len(response_object) + 2 > slack_max_block_text_length:
-            response.add_block(block_text)
-            block_text = ""
+        # Slack rejects blocks with too long texts
+        if len(text_line) + 2 > slack_max_block_text_length:
+            text_line = "%s..." % text_line[:(slack_max_block_text_length - 5)]
 
-        block_text += "%s\n\n" % response_object
+        if len(block_lines) > 0 and block_length + len(text_line) + 2 > slack_max_block_text_length:
+            yield "".join(block_lines)
+            num_blocks += 1
+            block_lines = list()
+            block_length = 0
 
-    else:
-        response.add_block(block_text)
+            if max_blocks is not None and num_blocks >= max_blocks - 1:
+                yield ":end: *reached maximum message size*\n\n\t\t*please narrow down your search pattern*\n\n"
+                return
+
+        block_lines.append("%s\n\n" % text_line)
+        block_length += len(text_line) + 2
+
+    if len(block_lines) > 0:
+        yield "".join(block_lines)
+
+
+def get_file_upload_threshold(config):
+    """
+    Return the number of objects above which results are uploaded as file
+
+    Parameters
+    ----------
+    config : dict
+        dictionary with items parsed from config file
+
+    Returns
+    -------
+    int: threshold, 0 means results are never uploaded as file
+    """
+
+    if config.get("slack.file_upload_threshold") is not None and str(config.get("slack.file_upload_threshold")) != "":
+        return int(config.get("slack.file_upload_threshold"))
+
+    return default_file_upload_threshold
+
+
+def iterate_csv_lines(rows):
+    """Format rows lazily as CSV lines
+
+    Parameters
+    ----------
+    rows : iterable
+        lists of values, one list for each row
+
+    Returns
+    -------
+    Generator: yields a CSV formatted line for each row
+    """
+
+    line_buffer = io.StringIO()
+    csv_writer = csv.writer(line_buffer)
+
+    for row in rows:
+        csv_writer.writerow(row)
+        yield line_buffer.getvalue()
+        line_buffer.seek(0)
+        line_buffer.truncate()
+
+
+def iterate_status_csv_rows(object_type="Host", result_objects=None, comment_downtime_index=None):
+    """Return the status of Icinga objects lazily as rows
+
+    Parameters
+    ----------
+    object_type : str
+        the object type of the results (Host or Service)
+    result_objects : iterable
+        the objects to return
+    comment_downtime_index: CommentDowntimeIndex
+        index of comments and downtimes of the results
+
+    Returns
+    -------
+    Generator: yields a header row and a row for each object
+    """
+
+    icinga_states = IcingaStates()
+
+    if comment_downtime_index is None:
+        comment_downtime_index = CommentDowntimeIndex()
+
+    yield ["host", "service", "state", "acknowledged", "in downtime", "comments", "downtimes", "output"]
+
+    for result_object in result_objects or list():
+
+        if object_type == "Host":
+            host_name = result_object.get("name")
+            service_name = None
+        else:
+            host_name = result_object.get("host_name")
+            service_name = result_object.get("name")
+
+        state = icinga_states.value(result_object.get("state"), object_type)
+
+        output = None
+        if result_object.get("last_check_result") is not None:
+            output = result_object.get("last_check_result").get("output")
 
-    return response.blocks
+        yield [
+            host_name,
+            service_name or "",
+            state.name if state is not None else "PENDING",
+            yes_no(result_object.get("acknowledgement") or 0),
+            yes_no(result_object.get("downtime_depth") or 0),
+            comment_downtime_index.count(host_name, service_name, "Comment"),
+            comment_downtime_index.count(host_name, service_name, "Downtime"),
+            output or ""
+        ]
 
 
 def slack_error_response(header=None, fallback_text=None, error_message=None):
@@ -0,0 +1,535 @@
+####
+#
+#   Send messages to Slack without blocking the event loop
+#
+
+import asyncio
+import inspect
+import itertools
+import json
+import logging
+import tempfile
+import time
+
+# internal
+from . import (
+    slack_max_message_blocks,
+    slack_max_message_text_length,
+    slack_max_block_text_length,
+    slack_max_message_attachments,
+    slack_post_priority_default
+)
+from .icinga_connection import RequestResponse
+
+# external
+import aiohttp
+import slack
+
+# Slack Web API rate limits as (requests per second, burst size)
+# see: https://api.slack.com/docs/rate-limits
+slack_method_rate_limits = {
+    "chat.postMessage": (1, 10),
+    "chat.update": (50 / 60, 5),
+    "files.getUploadURLExternal": (100 / 60, 10),
+    "files.completeUploadExternal": (100 / 60, 10),
+    "users.info": (100 / 60, 10),
+    "users.list": (20 / 60, 3),
+}
+slack_default_method_rate_limit = (20 / 60, 3)
+
+# Slack allows about one message per second per channel with short bursts
+slack_channel_rate_limit = (1, 3)
+
+# how often a rate limited (HTTP 429) request will be retried
+slack_max_rate_limit_retries = 3
+
+# default wait time if a rate limit response has no "Retry-After" header
+slack_default_retry_after = 1
+
+# name of the channel argument if it differs from "channel"
+slack_method_channel_args = {
+    "files.completeUploadExternal": "channel_id"
+}
+
+
+class TokenBucket:
+    """
+    A class used to limit the rate of requests.
+
+    Each request takes a token, tokens are refilled with 'rate' tokens
+    per second up to 'capacity' tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = time.monotonic()
+        self.paused_until = 0
+
+    def get_wait_time(self):
+        """
+        return the time in seconds until a token is available
+        """
+
+        now = time.monotonic()
+
+        if self.paused_until > now:
+            return self.paused_until - now
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+        if self.tokens >= 1:
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """
+        don't hand out any tokens for the next seconds, i.e. if Slack returned "Retry-After"
+        """
+
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class SlackPostPipeline:
+    """
+    A class used to post messages to Slack.
+
+    Each channel gets its own queue which is worked on by its own task.
+    All parts of a message and all messages of the same priority to the same
+    channel are posted in order, while posting to other channels continues in
+    parallel. The worker task of a channel ends once its queue is empty.
+
+    Requests are rate limited with token buckets per Web API method and per
+    channel. Messages with a higher priority (lower value) are posted first.
+    """
+
+    def __init__(self):
+        self.channel_queues = dict()
+        self.channel_workers = dict()
+        self.method_buckets = dict()
+        self.channel_buckets = dict()
+        self.waiting_requests = dict()
+        self.sequence = itertools.count()
+
+    @staticmethod
+    def pack_blocks(blocks):
+        """
+        merge adjacent text section blocks as long as the merged text fits into one block
+
+        Parameters
+        ----------
+        blocks: list
+            Slack message blocks
+
+        Returns
+        -------
+        list: packed Slack message blocks
+        """
+
+        def is_text_section(this_block):
+            return isinstance(this_block, dict) and set(this_block.keys()) == {"type", "text"} and \
+                this_block.get("type") == "section" and this_block["text"].get("type") == "mrkdwn"
+
+        packed_blocks = list()
+
+        for block in blocks or list():
+
+            if is_text_section(block) and len(packed_blocks) > 0 and is_text_section(packed_blocks[-1]):
+
+                previous_text = packed_blocks[-1]["text"]["text"]
+                separator = "" if previous_text.endswith("\n") else "\n\n"
+
+                if len(previous_text) + len(separator) + len(block["text"]["text"]) <= slack_max_block_text_length:
+                    packed_blocks[-1] = {
+                        "type": "section",
+                        "text": {"type": "mrkdwn", "text": previous_text + separator + block["text"]["text"]}
+                    }
+                    continue
+
+            packed_blocks.append(block)
+
+        return packed_blocks
+
+    def get_message_parts(self, slack_response):
+        """
+        pack a BotResponse into as few messages as possible
+
+        Text blocks are packed first, then the blocks are split into messages
+        which don't exceed 'slack_max_message_blocks' blocks. Attachments are sent
+        with the last message, if there are more than 'slack_max_message_attachments'
+        attachments, additional messages are added. As the order of blocks needs to be
+        preserved, filling up each message before starting the next one results in the
+        least number of messages.
+
+        Parameters
+        ----------
+        slack_response: BotResponse
+            Slack response object
+
+        Returns
+        -------
+        list: of tuples (text, blocks, attachments) for each message to post
+        """
+
+        blocks = self.pack_blocks(slack_response.blocks)
+        attachments = slack_response.attachments or list()
+
+        message_parts = list()
+        for index in range(0, len(blocks), slack_max_message_blocks):
+            message_parts.append([blocks[index:index + slack_max_message_blocks], list()])
+
+        if len(message_parts) == 0:
+            message_parts.append([list(), list()])
+
+        for index in range(0, len(attachments), slack_max_message_attachments):
+            if index > 0:
+                message_parts.append([list(), list()])
+            message_parts[-1][1] = attachments[index:index + slack_max_message_attachments]
+
+        if len(message_parts) > 1:
+            logging.debug("Sending %d Slack messages for %d blocks and %d attachments" %
+                          (len(message_parts), len(blocks), len(attachments)))
+
+        return [(slack_response.text, message_blocks or None, json.dumps(message_attachments)
+                 if len(message_attachments) > 0 else None)
+                for message_blocks, message_attachments in message_parts]
+
+    def get_method_bucket(self, method):
+
+        if method not in self.method_buckets:
+            self.method_buckets[method] = TokenBucket(*slack_method_rate_limits.get(method,
+                                                                                   slack_default_method_rate_limit))
+        return self.method_buckets[method]
+
+    def get_channel_bucket(self, channel):
+
+        if channel not in self.channel_buckets:
+            self.channel_buckets[channel] = TokenBucket(*slack_channel_rate_limit)
+
+        return self.channel_buckets[channel]
+
+    async def wait_for_rate_limit(self, method, channel=None, priority=slack_post_priority_default):
+        """
+        wait until a request to this method and channel is allowed
+
+        Requests with a higher priority (lower value) which are waiting
+        for one of the same token buckets will be sent first.
+
+        Parameters
+        ----------
+        method: str
+            Slack Web API method name
+        channel: str, optional
+            Slack channel the request is sent to
+        priority: int, optional
+            priority of this request
+        """
+
+        buckets = {("method", method): self.get_method_bucket(method)}
+        if channel is not None:
+            buckets[("channel", channel)] = self.get_channel_bucket(channel)
+
+        # count waiting requests per bucket and priority
+        for bucket_key in buckets.keys():
+            waiting = self.waiting_requests.setdefault(bucket_key, dict())
+            waiting[priority] = waiting.get(priority, 0) + 1
+
+        try:
+            while True:
+                wait_time = max(bucket.get_wait_time() for bucket in buckets.values())
+
+                # let requests with a higher priority go first if they wait for the same bucket
+                if wait_time <= 0:
+                    contended_buckets = [
+                        bucket for bucket_key, bucket in buckets.items()
+                        if any(num > 0 for waiting_priority, num in self.waiting_requests[bucket_key].items()
+                               if waiting_priority < priority)
+                    ]
+
+                    if len(contended_buckets) > 0:
+                        wait_time = max(1 / bucket.rate for bucket in contended_buckets)
+
+                if wait_time <= 0:
+                    for bucket in buckets.values():
+                        bucket.take()
+                    return
+
+                await asyncio.sleep(wait_time)
+
+        finally:
+            for bucket_key in buckets.keys():
+                self.waiting_requests[bucket_key][priority] -= 1
+
+    async def call_api(self, handle, method, channel=None, priority=slack_post_priority_default, **kwargs):
+        """
+        call a Slack Web API method obeying the rate limits
+
+        If Slack responds with HTTP 429 (rate limited), the method will be paused
+        for "Retry-After" seconds and the request will be retried.
+
+        Parameters
+        ----------
+        handle: slack.WebClient
+            the Slack client handle to use
+        method: str
+            Slack Web API method name like "chat.postMessage"
+        channel: str, optional
+            Slack channel the request is sent to
+        priority: int, optional
+            priority of this request
+        kwargs:
+            arguments passed on to the WebClient method
+
+        Returns
+        -------
+        RequestResponse: with the Slack response as text
+        """
+
+        this_response = RequestResponse()
+
+        if channel is not None:
+            kwargs[slack_method_channel_args.get(method, "channel")] = channel
+
+        for attempt in range(slack_max_rate_limit_retries + 1):
+
+            await self.wait_for_rate_limit(method, channel, priority)
+
+            this_response = RequestResponse()
+
+            try:
+                api_function = getattr(handle, method.replace(".", "_"), None)
+
+                if api_function is not None:
+                    this_response.text = api_function(**kwargs)
+                else:
+                    # methods the client library doesn't implement yet
+                    this_response.text = handle.api_call(method, data=kwargs)
+
+                # async clients return a future
+                if inspect.isawaitable(this_response.text):
+                    this_response.text = await this_response.text
+
+            except slack.errors.SlackApiError as e:
+                this_response.text = e.response
+                this_response.error = this_response.text.get("error")
+
+                if e.response.status_code == 429 and attempt < slack_max_rate_limit_retries:
+                    retry_after = int(e.response.headers.get("Retry-After", slack_default_retry_after))
+
+                    logging.warning("Slack API method '%s' is rate limited, retrying in %d seconds" %
+                                    (method, retry_after))
+
+                    self.get_method_bucket(method).pause(retry_after)
+                    continue
+
+            except Exception as e:
+                this_response.error = str(e)
+
+            break
+
+        return this_response
+
+    def post(self, handle, channel, slack_response):
+        """
+        add a message to the queue of this channel
+
+        Messages are queued by their 'post_priority'.
+
+        Parameters
+        ----------
+        handle: slack.WebClient
+            the Slack client handle to use
+        channel: str
+            Slack channel to post message to
+        slack_response: BotResponse
+            Slack response object
+
+        Returns
+        -------
+        asyncio.Future: resolves to RequestResponse of the last message part which has been posted
+        """
+
+        posted = asyncio.get_event_loop().create_future()
+
+        priority = getattr(slack_response, "post_priority", slack_post_priority_default)
+
+        queue = self.channel_queues.setdefault(channel, asyncio.PriorityQueue())
+        queue.put_nowait((priority, next(self.sequence), handle, self.get_message_parts(slack_response),
+                          getattr(slack_response, "files", list()), posted))
+
+        if self.channel_workers.get(channel) is None:
+            self.channel_workers[channel] = asyncio.ensure_future(self.channel_worker(channel))
+
+        return posted
+
+    async def channel_worker(self, channel):
+        """
+        post all queued messages of a channel in order
+
+        Parameters
+        ----------
+        channel: str
+            Slack channel to work on
+        """
+
+        queue = self.channel_queues.get(channel)
+
+        try:
+            while not queue.empty():
+                priority, _, handle, message_parts, files, posted = queue.get_nowait()
+
+                response = RequestResponse()
+                try:
+                    for text, blocks, attachments in message_parts:
+                        response = await self.do_post(handle, channel, text, blocks, attachments, priority)
+
+                        if response.error:
+                            break
+
+                    # upload files after the message has been posted
+                    for slack_file in files:
+                        if response.error:
+                            break
+
+                        response = await self.upload_file(handle, channel, slack_file, priority)
+
+                except Exception as e:
+                    response = RequestResponse(error=str(e))
+
+                if not posted.done():
+                    posted.set_result(response)
+
+        finally:
+            # no awaits after the queue is empty, no message can be added without starting a new worker
+            del self.channel_workers[channel]
+            del self.channel_queues[channel]
+
+    async def do_post(self, handle, channel, text, blocks, attachments, priority=slack_post_priority_default):
+        """
+        post a single message to Slack
+
+        Parameters
+        ----------
+        handle: slack.WebClient
+            the Slack client handle to use
+        channel: str
+            Slack channel to post message to
+        text: str
+            message text
+        blocks: list
+            message blocks
+        attachments: str
+            json dump of message attachments
+        priority: int, optional
+            priority of this message
+
+        Returns
+        -------
+        RequestResponse: slack response from posting a message
+        """
+
+        logging.debug("Posting Slack message to channel '%s'" % channel)
+
+        return await self.call_api(handle, "chat.postMessage", channel, priority,
+                                   text=text[:slack_max_message_text_length],
+                                   blocks=blocks,
+                                   attachments=attachments)
+
+    @staticmethod
+    def write_upload_file(slack_file, upload_file):
+        """
+        write all lines of a file to upload to a file object
+
+        Parameters
+        ----------
+        slack_file: SlackFile
+            the file to upload
+        upload_file: file object
+            opened binary file to write to
+
+        Returns
+        -------
+        int: size of the file in bytes
+        """
+
+        for line in slack_file.lines:
+            upload_file.write(line.encode("utf-8"))
+
+        return upload_file.tell()
+
+    async def upload_file(self, handle, channel, slack_file, priority=slack_post_priority_default):
+        """
+        upload a file to Slack
+
+        The lines of the file are written to a temporary file in an executor,
+        big files would block the event loop otherwise. The file is then sent
+        to an upload url requested with "files.getUploadURLExternal" and shared
+        to the channel with "files.completeUploadExternal".
+
+        Parameters
+        ----------
+        handle: slack.WebClient
+            the Slack client handle to use
+        channel: str
+            Slack channel to upload the file to
+        slack_file: SlackFile
+            the file to upload
+        priority: int, optional
+            priority of this upload
+
+        Returns
+        -------
+        RequestResponse: slack response from completing the upload
+        """
+
+        logging.debug("Uploading file '%s' to Slack channel '%s'" % (slack_file.filename, channel))
+
+        # a real file object, aiohttp can't stream a SpooledTemporaryFile before Python 3.11
+        with tempfile.TemporaryFile() as upload_file:
+
+            file_length = await asyncio.get_event_loop().run_in_executor(
+                None, self.write_upload_file, slack_file, upload_file)
+
+            url_response = await self.call_api(handle, "files.getUploadURLExternal", None, priority,
+                                               filename=slack_file.filename, length=file_length)
+
+            if url_response.error:
+                return url_response
+
+            upload_file.seek(0)
+
+            request_args = dict()
+            if getattr(handle, "ssl", None) is not None:
+                request_args["ssl"] = handle.ssl
+            if getattr(handle, "proxy", None):
+                request_args["proxy"] = handle.proxy
+
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(url_response.text.get("upload_url"), data=upload_file,
+                                            headers={"Content-Length": str(file_length)},
+                                            **request_args) as response:
+
+                        if not 200 <= response.status <= 299:
+                            return RequestResponse(error="Uploading file '%s' failed with status %d" %
+                                                         (slack_file.filename, response.status))
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                return RequestResponse(error="Uploading file '%s' failed: %s" %
+                                             (slack_file.filename, str(e) or e.__class__.__name__))
+
+        return await self.call_api(handle, "files.completeUploadExternal", channel, priority,
+                                   files=json.dumps([{"id": url_response.text.get("file_id"),
+                                                      "title": slack_file.title}]))
+
+
+slack_post_pipeline = SlackPostPipeline()
+
+# EOF
@@ -0,0 +1,222 @@
+####
+#
+#   Receive Slack events through a Socket Mode connection
+#
+
+import asyncio
+import json
+import logging
+import random
+
+# external
+import aiohttp
+
+default_slack_api_url = "https://slack.com/api/"
+
+# seconds between websocket pings to detect dead connections
+socket_mode_ping_interval = 30
+
+# reconnect backoff in seconds, doubled after each failed attempt
+socket_mode_min_reconnect_delay = 1
+socket_mode_max_reconnect_delay = 60
+
+
+class SlackSocketModeClient:
+    """
+    A Slack Socket Mode client which dispatches received events to event handlers
+
+    Every envelope is acknowledged before its event is handled. Event handlers
+    are called like RTMClient callbacks with the keyword arguments "data"
+    (the event) and "web_client". The connection is reopened with an
+    exponential backoff if it gets lost or Slack asks to reconnect.
+    """
+
+    def __init__(self, app_token, web_client=None, ssl=None, proxy=None, api_url=None):
+        """
+        Parameters
+        ----------
+        app_token: str
+            Slack app-level token (xapp-...) with the scope "connections:write"
+        web_client: slack.WebClient
+            passed on to the event handlers
+        ssl: ssl.SSLContext
+            SSL context to use for all connections
+        proxy: str
+            HTTP proxy to connect through
+        api_url: str
+            Slack Web API url (default: https://slack.com/api/)
+        """
+
+        self.app_token = app_token
+        self.web_client = web_client
+        self.ssl = ssl
+        self.proxy = proxy or None
+        self.api_url = api_url or default_slack_api_url
+        self.event_handlers = dict()
+        self.stopped = False
+        self.websocket = None
+
+    def add_event_handler(self, event_type, event_handler):
+        """
+        Add an event handler for an event type
+
+        Parameters
+        ----------
+        event_type: str
+            Slack event type like "message"
+        event_handler: function
+            coroutine function called with the keyword arguments data and web_client
+        """
+
+        self.event_handlers.setdefault(event_type, list()).append(event_handler)
+
+    def get_request_args(self):
+        """
+        Returns
+        -------
+        dict: ssl and proxy arguments for aiohttp requests, unset arguments are omitted
+        """
+
+        request_args = dict()
+        if self.ssl is not None:
+            request_args["ssl"] = self.ssl
+        if self.proxy is not None:
+            request_args["proxy"] = self.proxy
+
+        return request_args
+
+    async def open_connection_url(self, session):
+        """
+        Request a new websocket url with apps.connections.open
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession
+            session to send request with
+
+        Returns
+        -------
+        str: websocket url
+        """
+
+        async with session.post("%s/apps.connections.open" % self.api_url.rstrip("/"),
+                                headers={"Authorization": "Bearer %s" % self.app_token},
+                                **self.get_request_args()) as response:
+            response_data = await response.json(content_type=None)
+
+        if response_data.get("ok") is not True:
+            raise ConnectionError("apps.connections.open failed: %s" % response_data.get("error"))
+
+        return response_data.get("url")
+
+    async def start(self):
+        """
+        Connect to Slack and keep receiving events until stop() is called
+        """
+
+        reconnect_delay = socket_mode_min_reconnect_delay
+
+        async with aiohttp.ClientSession() as session:
+            while not self.stopped:
+                try:
+                    connection_url = await self.open_connection_url(session)
+
+                    if await self.receive_events(session, connection_url) is True:
+                        # connection was established, reconnect right away
+                        reconnect_delay = socket_mode_min_reconnect_delay
+                        continue
+
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error("Slack Socket Mode connection error: %s" % str(e))
+
+                if self.stopped:
+                    break
+
+                # add some jitter to avoid reconnecting in lockstep with other clients
+                this_delay = reconnect_delay * random.uniform(0.5, 1.0)
+                logging.info("Reconnecting to Slack in %.1f seconds" % this_delay)
+                await asyncio.sleep(this_delay)
+
+                reconnect_delay = min(reconnect_delay * 2, socket_mode_max_reconnect_delay)
+
+    async def stop(self):
+        """
+        Stop receiving events and close the connection
+        """
+
+        self.stopped = True
+
+        if self.websocket is not None:
+            await self.websocket.close()
+
+    async def receive_events(self, session, connection_url):
+        """
+        Receive envelopes on a websocket until it gets closed
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession
+            session to open the websocket with
+        connection_url: str
+            websocket url returned by apps.connections.open
+
+        Returns
+        -------
+        bool: True if Slack said hello on this connection
+        """
+
+        connected = False
+
+        async with session.ws_connect(connection_url, heartbeat=socket_mode_ping_interval,
+                                      **self.get_request_args()) as websocket:
+            self.websocket = websocket
+
+            try:
+                async for ws_message in websocket:
+                    if ws_message.type != aiohttp.WSMsgType.TEXT:
+                        break
+
+                    envelope = json.loads(ws_message.data)
+
+                    if envelope.get("type") == "hello":
+                        logging.info("Connected to Slack through Socket Mode")
+                        connected = True
+
+                    elif envelope.get("type") == "disconnect":
+                        logging.info("Slack requested to reconnect: %s" % envelope.get("reason"))
+                        break
+
+                    elif envelope.get("envelope_id") is not None:
+                        # acknowledge first, Slack retries events which aren't acknowledged within 3 seconds
+                        await websocket.send_json({"envelope_id": envelope.get("envelope_id")})
+
+                        if envelope.get("type") == "events_api":
+                            self.dispatch_event((envelope.get("payload") or dict()).get("event") or dict())
+            finally:
+                self.websocket = None
+
+        return connected
+
+    def dispatch_event(self, event):
+        """
+        Call all event handlers for this event in the background
+
+        Parameters
+        ----------
+        event: dict
+            Slack event
+        """
+
+        for event_handler in self.event_handlers.get(event.get("type"), list()):
+            event_task = asyncio.ensure_future(event_handler(data=event, web_client=self.web_client))
+
+            def event_handled(future):
+                if not future.cancelled() and future.exception() is not None:
+                    logging.error("Error while handling Slack event '%s': %s" %
+                                  (event.get("type"), str(future.exception())))
+
+            event_task.add_done_callback(event_handled)
+
+# EOF
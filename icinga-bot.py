@@ -19,6 +19,7 @@ import slack
 
 from i2_slack_modules.classes import BotResponse, SlackUsers, SlackUser
 from i2_slack_modules.icinga_connection import RequestResponse
+from i2_slack_modules.icinga_state_mirror import state_mirror
 from i2_slack_modules.common import (
     parse_command_line,
     parse_own_config,
@@ -26,9 +27,13 @@ from i2_slack_modules.common import (
     do_error_exit,
     my_own_function_name
 )
-from i2_slack_modules.command_definition import BotCommands
+from i2_slack_modules.command_definition import bot_commands
 from i2_slack_modules.slack_helper import slack_error_response
-from i2_slack_modules import slack_max_message_blocks, slack_max_message_text_length
+from i2_slack_modules.slack_post_pipeline import slack_post_pipeline
+from i2_slack_modules.message_dispatcher import message_dispatcher
+from i2_slack_modules.slack_socket_mode import SlackSocketModeClient
+from i2_slack_modules.action_jobs import action_job_queue
+from i2_slack_modules import slack_post_priority_high
 
 
 __version__ = "1.0.0"
@@ -46,6 +51,7 @@ __url__ = "https://github.com/bb-Ricardo/icinga-slack-bot"
 
 default_log_level = "INFO"
 default_config_file_path = "./icinga-bot.ini"
+default_command_timeout = 60
 
 #################
 #
@@ -54,6 +60,12 @@ default_config_file_path = "./icinga-bot.ini"
 
 mention_regex = "^<@(|[WU].+?)>(.*)"
 
+# responses of these command handlers (questions, confirmations and action results) are posted first
+conversation_command_handlers = ["reset_conversation", "chat_with_user", "enable_disable_action"]
+
+# seconds after which the user is told that a command is still running
+command_still_working_delay = 10
+
 args = None
 config = None
 user_info = SlackUsers()
@@ -65,7 +77,77 @@ user_info = SlackUsers()
 #
 
 
-async def handle_command(slack_message, slack_user=None):
+async def call_command_handler(command_handler, command_timeout=None, still_working=None, **kwargs):
+    """call a command handler and await the result
+
+    All command handlers are coroutine functions. A command handler which times out
+    gets canceled, so it can't change the state of the user once the next message is handled.
+
+    Parameters
+    ----------
+    command_handler : Callable
+        the command handler coroutine function to call
+    command_timeout : int
+        seconds after which the command handler times out (default: no timeout)
+    still_working : Callable
+        called once if the command handler is still running after command_still_working_delay seconds
+    kwargs:
+        the arguments passed on to the command handler
+
+    Returns
+    -------
+    BotResponse: with response of the command handler
+    """
+
+    loop = asyncio.get_event_loop()
+    start_time = loop.time()
+
+    pending_response = asyncio.ensure_future(command_handler(**kwargs))
+
+    try:
+        if still_working is not None and (command_timeout is None or command_timeout > command_still_working_delay):
+            done, _ = await asyncio.wait({pending_response}, timeout=command_still_working_delay)
+            if len(done) == 0:
+                still_working()
+
+        if command_timeout is not None:
+            command_timeout = max(0, command_timeout - (loop.time() - start_time))
+
+        response = await asyncio.wait_for(pending_response, timeout=command_timeout)
+
+    except asyncio.TimeoutError:
+        logging.error("Command handler '%s' timed out after %.1f seconds" %
+                      (command_handler.__name__, loop.time() - start_time))
+        return slack_error_response(header="Command timed out",
+                                    error_message="The command didn't finish in time. "
+                                                  "Please try again later or narrow down your request.")
+
+    return response
+
+
+def get_command_timeout(command=None):
+    """return the timeout of a command
+
+    Parameters
+    ----------
+    command : BotCommands._SingleCommand
+        command to return the timeout for
+
+    Returns
+    -------
+    int: timeout of this command in seconds
+    """
+
+    if getattr(command, "timeout", None) is not None:
+        return command.timeout
+
+    if config.get("slack.command_timeout") is not None and str(config.get("slack.command_timeout")) != "":
+        return int(config.get("slack.command_timeout"))
+
+    return default_command_timeout
+
+
+async def handle_command(slack_message, slack_user=None, still_working=None, slack_user_id=None):
     """parse a Slack message and try to interpret commands
 
     Currently implemented commands:
@@ -83,6 +165,10 @@ async def handle_command(slack_message, slack_user=None):
         Slack message to parse
     slack_user : SlackUser
         SlackUser object of user who sent this message
+    still_working : Callable
+        called once if the command takes a while
+    slack_user_id : str
+        Slack id of the user who sent this message
 
     Returns
     -------
@@ -98,7 +184,6 @@ async def handle_command(slack_message, slack_user=None):
     if matches:
         slack_message = matches.group(2).strip()
 
-    bot_commands = BotCommands()
     called_command = bot_commands.get_command_called(slack_message)
 
     """
@@ -110,18 +195,24 @@ async def handle_command(slack_message, slack_user=None):
         "config": config,
         "bot_commands": bot_commands,
         "slack_message": slack_message,
-        "slack_user": slack_user
+        "slack_user": slack_user,
+        "slack_user_id": slack_user_id
     }
 
+    conversation_response = False
+
     # special case to reset conversation
     if called_command is not None and called_command.name == "reset":
-        response = called_command.get_command_handler()(**command_handler_args)
+        response = await call_command_handler(called_command.get_command_handler(), **command_handler_args)
 
     # continue with conversion if there is one ongoing
     if response is None and slack_user.conversation is not None:
         this_command_handler = slack_user.conversation.command.get_command_handler()
         # try to chat with user
-        response = this_command_handler(**command_handler_args)
+        response = await call_command_handler(this_command_handler,
+                                              command_timeout=get_command_timeout(slack_user.conversation.command),
+                                              still_working=still_working, **command_handler_args)
+        conversation_response = response is not None
 
     # any regular command which is not reset
     if response is None and called_command is not None and called_command.name != "reset":
@@ -131,7 +222,9 @@ async def handle_command(slack_message, slack_user=None):
         command_handler = called_command.get_command_handler()
 
         if command_handler:
-            response = command_handler(**command_handler_args)
+            response = await call_command_handler(command_handler,
+                                                  command_timeout=get_command_timeout(called_command),
+                                                  still_working=still_working, **command_handler_args)
         else:
             logging.error("command_handler for command '%s' not defined in command_definition.py" %
                           called_command.name)
@@ -141,6 +234,11 @@ async def handle_command(slack_message, slack_user=None):
     if not response:
         response = BotResponse(text=default_response_text)
 
+    # give conversation responses precedence over status responses
+    elif conversation_response is True or \
+            getattr(called_command, "command_handler", None) in conversation_command_handlers:
+        response.post_priority = slack_post_priority_high
+
     return response
 
 
@@ -149,9 +247,11 @@ async def handle_command(slack_message, slack_user=None):
 async def message(**payload):
     """parse payload of every Slack message received
 
+    Called for message events received through RTM or Socket Mode.
     This functions extracts the text entry from payload and passes
-    it to handle_command(). Payloads which contain a bot_id entry are ignored.
-    The response will be posted to the same channel.
+    it to process_message(). Payloads which contain a bot_id entry are ignored.
+    Messages of the same user are processed in order, messages of
+    different users in parallel.
 
     Parameters
     ----------
@@ -176,27 +276,52 @@ async def message(**payload):
         # noinspection PyTypeChecker
         user_info.set_web_handle(web_client)
 
-        # parse command
-        response = await handle_command(data.get("text"), user_info.get(data.get("user")))
+        # don't wait for the command to finish, next message can be received right away
+        message_dispatcher.dispatch(data.get("user"), process_message, web_client, channel_id, data)
+
+    return
 
-        slack_api_response = post_slack_message(web_client, channel_id, response)
 
-        if slack_api_response.error:
-            error_message = slack_error_response(
-                header="Slack API error while posting to Slack",
-                error_message=slack_api_response.error)
+async def process_message(web_client, channel_id, data):
+    """handle the command of a Slack message and post the response
 
-            post_slack_message(web_client, channel_id, error_message)
+    The response will be posted to the same channel.
 
-        await user_info.fetch_slack_user_info(data.get("user"))
+    Parameters
+    ----------
+    web_client : slack.WebClient
+        the Slack client handle to use
+    channel_id : str
+        Slack channel the message was sent to
+    data : dict
+        data of the Slack message
+
+    """
+
+    def still_working():
+        asyncio.ensure_future(post_slack_response(web_client, channel_id,
+                                                  BotResponse(text="Still working on it, please stand by ...")))
+
+    # parse command
+    response = await handle_command(data.get("text"), user_info.get(data.get("user")), still_working=still_working,
+                                    slack_user_id=data.get("user"))
+
+    # post response in the background, the response is queued in order for this channel
+    asyncio.ensure_future(post_slack_response(web_client, channel_id, response))
+
+    # refresh user data in the background if it expired
+    user_info.schedule_user_info_refresh(data.get("user"))
 
     return
 
 
-def post_slack_message(handle=None, channel=None, slack_response=None):
+async def post_slack_message(handle=None, channel=None, slack_response=None):
     """
     Post a message to Slack
 
+    The message will be queued and posted by the slack_post_pipeline
+    in order with all other messages to this channel.
+
     Parameters
     ----------
     handle: object
@@ -211,33 +336,6 @@ def post_slack_message(handle=None, channel=None, slack_response=None):
     RequestResponse: slack response from posting a message
     """
 
-    def __do_post(text, blocks, attachments):
-
-        this_response = RequestResponse()
-
-        # try to send of message
-        try:
-            logging.debug("Posting Slack message to channel '%s'" % channel)
-
-            # noinspection PyUnresolvedReferences
-            this_response.text = handle.chat_postMessage(
-                channel=channel,
-                text=text[:slack_max_message_text_length],
-                blocks=blocks,
-                attachments=attachments
-            )
-
-        except slack.errors.SlackApiError as e:
-            this_response.text = e.response
-            this_response.error = this_response.text.get("error")
-
-        except Exception as e:
-            this_response.error = str(e)
-
-        return this_response
-
-    response = RequestResponse()
-
     if handle is None:
         return RequestResponse(error="Error in function '%s': no client handle defined" % (my_own_function_name()))
     if channel is None:
@@ -245,49 +343,53 @@ def post_slack_message(handle=None, channel=None, slack_response=None):
     if slack_response is None:
         return RequestResponse(error="Error in function '%s': no slack_response defined" % (my_own_function_name()))
 
-    # split post into multiple posts
-    if slack_response.blocks is not None and len(slack_response.blocks) > 50:
+    response = await slack_post_pipeline.post(handle, channel, slack_response)
 
-        # use lambda function to split message_blocks to chunks of 'slack_max_message_blocks' blocks
-        split_blocks = lambda a, n=slack_max_message_blocks: [a[i:i + n] for i in range(0, len(a), n)]
+    if response.error:
+        logging.error("Posting Slack message to channel '%s' failed: %s" % (channel, response.error))
 
-        splitted_blocks = split_blocks(slack_response.blocks)
+    # only the response of the last message will be returned
+    return response
 
-        logging.debug("Sending multiple Slack messages as the number of blocks %d exceeds the maximum of %d" %
-                      (len(slack_response.blocks), slack_max_message_blocks))
 
-        post_iteration = 1
-        for message_blocks in splitted_blocks:
+async def post_slack_response(handle=None, channel=None, slack_response=None):
+    """
+    Post a response to Slack and post an error message if that failed
 
-            last_message_attachments = None
+    If the response reports the progress of an action job, the job
+    will update the posted message.
 
-            # get attachments and send them only with the last message
-            if post_iteration == len(splitted_blocks):
-                last_message_attachments = slack_response.dump_attachments()
+    Parameters
+    ----------
+    handle: object
+        the Slack client handle to use
+    channel: str
+        Slack channel to post message to
+    slack_response: BotResponse
+        Slack response object
+    """
 
-            response = __do_post(slack_response.text, message_blocks, last_message_attachments)
+    action_job = getattr(slack_response, "action_job", None)
 
-            if response.error:
-                break
+    # the job result is posted to this channel even if the progress message can't be posted
+    if action_job is not None:
+        action_job.set_reply_channel(handle, channel)
 
-            post_iteration += 1
+    slack_api_response = await post_slack_message(handle, channel, slack_response)
 
-    else:
+    if slack_api_response.error:
+        error_message = slack_error_response(
+            header="Slack API error while posting to Slack",
+            error_message=slack_api_response.error)
 
-        response = __do_post(slack_response.text, slack_response.blocks, slack_response.dump_attachments())
-        """
-        if isinstance(slack_response, BotResponse):
-        else:
-            message can be sent like this with message builder classes
-            unfortunately it causes to many log messages
-            response.text = handle.chat_postMessage(channel=channel, **slack_response.to_dict())
-        """
+        await post_slack_message(handle, channel, error_message)
 
-    if response.error:
-        logging.error("Posting Slack message to channel '%s' failed: " % response.error)
+        if action_job is not None:
+            action_job.set_progress_message(handle, channel, None)
 
-    # only the response of the last message will be returned
-    return response
+    elif action_job is not None:
+        action_job.set_progress_message(handle, slack_api_response.text.get("channel"),
+                                        slack_api_response.text.get("ts"))
 
 
 if __name__ == "__main__":
@@ -325,26 +427,53 @@ if __name__ == "__main__":
     # set up slack ssl context
     slack_ssl_context = ssl_lib.create_default_context(cafile=certifi.where())
 
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
     # get command handler and call it to get startup message
-    icinga_status_command = BotCommands().get_command_called("icinga status").get_command_handler()
+    icinga_status_command = bot_commands.get_command_called("icinga status").get_command_handler()
 
-    # message about start
-    client = slack.WebClient(token=config["slack.bot_token"], ssl=slack_ssl_context)
+    message_dispatcher.setup(config)
+    action_job_queue.setup(config)
 
-    post_response = post_slack_message(client, config["slack.default_channel"],
-                                       icinga_status_command(config=config, startup=True))
+    # users known from last run are available right away
+    user_info.set_cache_file(config["slack.user_cache_file"])
+    user_info.load_cache_file()
 
-    del client
+    # message about start
+    client = slack.WebClient(token=config["slack.bot_token"],
+                             base_url=config["slack.api_url"] or slack.WebClient.BASE_URL,
+                             ssl=slack_ssl_context, proxy=config["slack.proxy"] or None, run_async=True, loop=loop)
+
+    post_response = loop.run_until_complete(
+        post_slack_message(client, config["slack.default_channel"],
+                           loop.run_until_complete(
+                               call_command_handler(icinga_status_command, config=config, startup=True))))
 
     if post_response.error:
         do_error_exit("Error while posting startup message to slack (%s): %s" %
                       (config["slack.default_channel"], post_response.error))
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    rtm_client = slack.RTMClient(
-        token=config["slack.bot_token"], ssl=slack_ssl_context, run_async=True, loop=loop
-    )
-    loop.run_until_complete(rtm_client.start())
+    # load all Slack users in the background and refresh them once they expire
+    loop.create_task(user_info.run_user_list_refresh(client))
+
+    # keep local copy of Icinga states in sync
+    if config["icinga.state_mirror"] is True:
+        loop.create_task(state_mirror.run(config))
+
+    # use Socket Mode if an app token is configured, otherwise fall back to RTM
+    if config["slack.app_token"] != "":
+        socket_mode_client = SlackSocketModeClient(
+            app_token=config["slack.app_token"], web_client=client, ssl=slack_ssl_context, proxy=config["slack.proxy"],
+            api_url=config["slack.api_url"]
+        )
+        socket_mode_client.add_event_handler("message", message)
+        loop.run_until_complete(socket_mode_client.start())
+    else:
+        rtm_client = slack.RTMClient(
+            token=config["slack.bot_token"], ssl=slack_ssl_context, proxy=config["slack.proxy"] or None,
+            run_async=True, loop=loop
+        )
+        loop.run_until_complete(rtm_client.start())
 
 # EOF
@@ -0,0 +1,108 @@
+import asyncio
+
+import i2_slack_modules.action_jobs as action_jobs
+from i2_slack_modules.classes import BotResponse, SlackUser
+from i2_slack_modules.icinga_connection import RequestResponse
+
+
+class FakePostPipeline:
+
+    def __init__(self, post_error=None):
+        self.post_error = post_error
+        self.posted = list()
+        self.updated = list()
+
+    async def post(self, handle, channel, slack_response):
+        self.posted.append((channel, slack_response))
+        return RequestResponse(text={"channel": channel, "ts": "2"}, error=self.post_error)
+
+    async def call_api(self, handle, method, channel=None, priority=None, **kwargs):
+        self.updated.append((channel, kwargs.get("ts"), kwargs.get("text")))
+        return RequestResponse(text={"ok": True})
+
+
+def run_job(monkeypatch, post_pipeline, set_reply_channel=True, set_progress_message=False):
+
+    monkeypatch.setattr(action_jobs, "slack_post_pipeline", post_pipeline)
+    monkeypatch.setattr(action_jobs, "action_job_progress_message_timeout", 0.1)
+
+    followup_calls = list()
+    canceled = list()
+
+    async def followup(update_result=None):
+        followup_calls.append(update_result)
+        await update_result(text="result with follow-up")
+
+    async def action(action_job=None):
+        action_job.set_followup(followup, status="_following up_", cancel_function=lambda: canceled.append(True))
+        return BotResponse(text="result")
+
+    async def run():
+        job = action_jobs.ActionJob(1, "tester", "test job", action)
+        if set_reply_channel:
+            job.set_reply_channel(None, "C1")
+        if set_progress_message:
+            job.set_progress_message(None, "C1", "1")
+        await action_jobs.ActionJobQueue().run_job(job)
+        await asyncio.sleep(0.05)
+        return job
+
+    return asyncio.run(run()), followup_calls, canceled
+
+
+def test_result_is_posted_without_progress_message(monkeypatch):
+
+    post_pipeline = FakePostPipeline()
+    job, followup_calls, canceled = run_job(monkeypatch, post_pipeline)
+
+    assert job.status == "finished"
+    assert [x[0] for x in post_pipeline.posted] == ["C1"]
+    assert len(followup_calls) == 1
+    assert post_pipeline.updated == [("C1", "2", "result with follow-up")]
+    assert canceled == list()
+
+
+def test_result_is_posted_with_high_priority(monkeypatch):
+
+    post_pipeline = FakePostPipeline()
+    run_job(monkeypatch, post_pipeline, set_progress_message=True)
+
+    assert post_pipeline.posted[0][1].post_priority == action_jobs.slack_post_priority_high
+
+
+def test_followup_is_canceled_if_result_post_fails(monkeypatch):
+
+    post_pipeline = FakePostPipeline(post_error="channel_not_found")
+    job, followup_calls, canceled = run_job(monkeypatch, post_pipeline, set_progress_message=True)
+
+    assert len(followup_calls) == 0
+    assert canceled == [True]
+    assert job.followup_function is None
+
+
+def test_followup_is_canceled_if_channel_is_unknown(monkeypatch):
+
+    post_pipeline = FakePostPipeline()
+    job, followup_calls, canceled = run_job(monkeypatch, post_pipeline, set_reply_channel=False)
+
+    assert post_pipeline.posted == list()
+    assert len(followup_calls) == 0
+    assert canceled == [True]
+
+
+def test_job_user_falls_back_to_slack_user_id():
+
+    async def action(action_job=None):
+        return BotResponse(text="result")
+
+    async def run():
+        job_queue = action_jobs.ActionJobQueue()
+        job_queue.num_workers = 0
+
+        named_job = job_queue.submit(SlackUser({"real_name": "Jane Doe"}), "ack", action, slack_user_id="U123")
+        unnamed_job = job_queue.submit(SlackUser(), "ack", action, slack_user_id="U456")
+        unknown_job = job_queue.submit(None, "ack", action)
+
+        return named_job.user_name, unnamed_job.user_name, unknown_job.user_name
+
+    assert asyncio.run(run()) == ("Jane Doe", "<@U456>", None)
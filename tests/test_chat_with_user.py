@@ -0,0 +1,119 @@
+import asyncio
+import importlib
+
+from i2_slack_modules.classes import SlackConversation
+from i2_slack_modules.icinga_connection import RequestResponse
+from i2_slack_modules.command_definition import bot_commands
+
+chat_with_user = importlib.import_module("i2_slack_modules.bot_commands.chat_with_user")
+
+
+def perform_remove(monkeypatch, sub_command, filter_result):
+
+    requests = list()
+
+    async def fake_perform_i2_action(config, action, object_type, filter_list, action_job=None, **params):
+        requests.append((action, object_type, filter_list))
+        response = RequestResponse()
+        # grouped service filters select one object per listed service
+        response.data = [{"code": 200.0}] * sum([1 + x.count(", ") for x in filter_list])
+        return response
+
+    monkeypatch.setattr(chat_with_user, "async_perform_i2_action", fake_perform_i2_action)
+
+    conversation = SlackConversation()
+    conversation.command = bot_commands.remove
+    conversation.sub_command = getattr(bot_commands.remove.sub_commands, sub_command)
+    conversation.filter_result = filter_result
+
+    response = asyncio.run(chat_with_user.perform_confirmed_action(dict(), conversation, "tester"))
+
+    return requests, response
+
+
+def test_remove_comment_filters_are_quoted(monkeypatch):
+
+    requests, response = perform_remove(monkeypatch, "comment", [
+        {"host_name": 'web"1', "service_name": "", "name": "c1"},
+        {"host_name": "web2", "service_name": "disk\\root", "name": "c2"},
+    ])
+
+    assert requests == [("remove-comment", "Comment", [
+        'comment.__name=="web\\"1!c1"',
+        'comment.__name=="web2!disk\\\\root!c2"',
+    ])]
+    assert response.text == "Successfully removed 2 comments!"
+
+
+def test_remove_acknowledgement_filters_are_grouped_and_quoted(monkeypatch):
+
+    requests, response = perform_remove(monkeypatch, "acknowledgement", [
+        {"host_name": 'web"1', "service_name": ""},
+        {"host_name": "web2", "service_name": "ntp"},
+        {"host_name": "web2", "service_name": 'disk"'},
+    ])
+
+    assert requests == [
+        ("remove-acknowledgement", "Host", ['host.name=="web\\"1"']),
+        ("remove-acknowledgement", "Service", ['( host.name=="web2" && service.name in ["ntp", "disk\\""] )']),
+    ]
+    assert response.text == "Successfully removed 3 acknowledgements!"
+
+
+class FakeCheckResultWaiter:
+
+    instances = list()
+
+    def __init__(self, config, object_type, i2_objects):
+        self.closed = False
+        FakeCheckResultWaiter.instances.append(self)
+
+    async def subscribe(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def perform_reschedule_and_wait(monkeypatch, fake_perform_i2_action):
+
+    FakeCheckResultWaiter.instances = list()
+
+    monkeypatch.setattr(chat_with_user, "CheckResultWaiter", FakeCheckResultWaiter)
+    monkeypatch.setattr(chat_with_user, "async_perform_i2_action", fake_perform_i2_action)
+
+    conversation = SlackConversation()
+    conversation.command = bot_commands.reschedule_and_wait
+    conversation.object_type = "Host"
+    conversation.filter_result = [{"name": "web1"}]
+
+    async def run():
+        action_job = object()
+        return await chat_with_user.perform_confirmed_action({"icinga.filter": ""}, conversation, "tester",
+                                                             action_job=action_job)
+
+    return asyncio.run(run())
+
+
+def test_check_result_waiter_is_closed_if_rescheduling_fails(monkeypatch):
+
+    async def fake_perform_i2_action(config, action, object_type, filter_list, action_job=None, **params):
+        raise ConnectionError("connection refused")
+
+    response = perform_reschedule_and_wait(monkeypatch, fake_perform_i2_action)
+
+    assert "connection refused" in str(response.attachments)
+    assert [x.closed for x in FakeCheckResultWaiter.instances] == [True]
+
+
+def test_check_result_waiter_is_closed_if_job_gets_canceled(monkeypatch):
+
+    async def fake_perform_i2_action(config, action, object_type, filter_list, action_job=None, **params):
+        raise asyncio.CancelledError()
+
+    try:
+        perform_reschedule_and_wait(monkeypatch, fake_perform_i2_action)
+    except asyncio.CancelledError:
+        pass
+
+    assert [x.closed for x in FakeCheckResultWaiter.instances] == [True]
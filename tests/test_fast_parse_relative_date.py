@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+from i2_slack_modules.common import fast_parse_relative_date
+
+# a Tuesday
+now = datetime(2019, 11, 5, 17, 33, 20)
+
+
+@pytest.mark.parametrize("string_to_parse, expected", [
+    ("1h", datetime(2019, 11, 5, 18, 33)),
+    ("30m waiting for vendor", datetime(2019, 11, 5, 18, 3)),
+    ("in 2 days", datetime(2019, 11, 7, 17, 33)),
+    ("until 3 HOURS", datetime(2019, 11, 5, 20, 33)),
+    ("1w", datetime(2019, 11, 12, 17, 33)),
+    ("2019-11-06", datetime(2019, 11, 6, 17, 33)),
+    ("2019-11-06 08:15 maintenance", datetime(2019, 11, 6, 8, 15)),
+    ("2019-11-06T08:15:00", datetime(2019, 11, 6, 8, 15)),
+    ("tomorrow 9am", datetime(2019, 11, 6, 9, 0)),
+    ("today 12am", datetime(2019, 11, 5, 0, 0)),
+    ("friday 17:30", datetime(2019, 11, 8, 17, 30)),
+    ("tuesday 10pm", datetime(2019, 11, 12, 22, 0)),
+    ("at 12pm", datetime(2019, 11, 6, 12, 0)),
+    ("9:45pm", datetime(2019, 11, 5, 21, 45)),
+    ("17:30", datetime(2019, 11, 6, 17, 30)),
+])
+def test_fast_parse_relative_date(string_to_parse, expected):
+
+    result = fast_parse_relative_date(string_to_parse, now=now)
+
+    assert result is not None
+    assert result["dt"] == expected
+    assert (result["year"], result["month"], result["day"], result["hour"], result["minute"]) == \
+           (expected.year, expected.month, expected.day, expected.hour, expected.minute)
+
+
+def test_fast_parse_relative_date_match_position():
+
+    result = fast_parse_relative_date("until tomorrow 9am because of a reboot", now=now)
+
+    assert result["mstart"] == len("until ")
+    assert result["mend"] == len("until tomorrow 9am")
+
+
+@pytest.mark.parametrize("string_to_parse", [
+    "",
+    "reboot in 1h",
+    "tomorrow morning",
+    "friday at noon",
+    "1h and 30m",
+    "5 parsecs",
+    "2019-02-30",
+    "25:00",
+])
+def test_fast_parse_relative_date_leaves_other_strings_to_ctparse(string_to_parse):
+
+    assert fast_parse_relative_date(string_to_parse, now=now) is None
@@ -0,0 +1,37 @@
+import asyncio
+import importlib.util
+import inspect
+import os
+
+from i2_slack_modules.command_definition import bot_commands
+
+spec = importlib.util.spec_from_file_location(
+    "icinga_bot", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "icinga-bot.py"))
+icinga_bot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(icinga_bot)
+
+
+def test_all_command_handlers_are_coroutine_functions():
+
+    for command in bot_commands:
+        if getattr(command, "command_handler", None) is not None:
+            assert inspect.iscoroutinefunction(command.get_command_handler()), command.name
+
+
+def test_timed_out_command_handler_gets_canceled():
+
+    user_state = list()
+
+    async def slow_command_handler(**kwargs):
+        await asyncio.sleep(0.2)
+        user_state.append("changed")
+
+    async def run():
+        response = await icinga_bot.call_command_handler(slow_command_handler, command_timeout=0.05)
+        await asyncio.sleep(0.3)
+        return response
+
+    response = asyncio.run(run())
+
+    assert response.blocks[0]["text"]["text"] == "*Command timed out*"
+    assert user_state == list()
@@ -0,0 +1,114 @@
+import asyncio
+
+import i2_slack_modules.icinga_connection as icinga_connection
+from i2_slack_modules.icinga_connection import ResponseCache
+
+cache_config = {"icinga.cache_ttl": 60, "icinga.cache_size": 10, "icinga.filter": ""}
+
+
+def test_response_cache_drops_responses_of_older_generations():
+
+    cache = ResponseCache()
+    generation = cache.generation
+
+    cache.invalidate()
+    cache.add(cache_config, "key", ["outdated"], generation)
+
+    assert cache.get(cache_config, "key") is None
+
+    cache.add(cache_config, "key", ["current"], cache.generation)
+
+    assert cache.get(cache_config, "key") == ["current"]
+
+
+def test_request_in_flight_during_invalidation_is_not_cached(monkeypatch):
+
+    requests = list()
+
+    class FakeIcingaClient:
+
+        async def objects_list(self, object_type, attrs=None, filters=None):
+            requests.append(object_type)
+            state = 0 if len(requests) == 1 else 2
+            await asyncio.sleep(0.1)
+            return [{"attrs": {"name": "web1", "state": state}}]
+
+    monkeypatch.setattr(icinga_connection, "response_cache", ResponseCache())
+    monkeypatch.setattr(icinga_connection, "setup_async_icinga_connection", lambda config: (FakeIcingaClient(), None))
+
+    async def run():
+        before_action = asyncio.ensure_future(icinga_connection.async_get_i2_object(cache_config, "Host"))
+        await asyncio.sleep(0.01)
+
+        # an action changes objects while the first request is in flight
+        icinga_connection.response_cache.invalidate()
+
+        after_action = await icinga_connection.async_get_i2_object(cache_config, "Host")
+        await before_action
+
+        return after_action, await icinga_connection.async_get_i2_object(cache_config, "Host")
+
+    after_action, cached = asyncio.run(run())
+
+    assert len(requests) == 2
+    assert after_action.data[0]["state"] == 2
+    assert cached.data[0]["state"] == 2
+
+
+def test_action_filters_quote_object_names():
+
+    hosts = [{"name": 'web"1'}, {"name": "db\\2"}]
+
+    assert icinga_connection.get_i2_action_filters("Host", hosts) == \
+        ['host.name=="web\\"1"', 'host.name=="db\\\\2"']
+
+    services = [{"host_name": 'web"1', "name": "load %s"}, {"host_name": "db%1", "name": "disk"}]
+
+    assert icinga_connection.get_i2_action_filters("Service", services, host_attr="event.host",
+                                                   service_attr="event.service") == \
+        ['( event.host=="web\\"1" && event.service=="load %s" )', '( event.host=="db%1" && event.service=="disk" )']
+
+
+def test_action_filters_group_services_by_host():
+
+    services = [{"host_name": "web1", "name": "load"}, {"host_name": "web2", "name": "disk"},
+                {"host_name": "web1", "name": "ping"}, {"host_name": "web1", "name": "ssh"}]
+
+    assert icinga_connection.get_i2_action_filters("Service", services) == [
+        '( host.name=="web1" && service.name in ["load", "ping", "ssh"] )',
+        '( host.name=="web2" && service.name=="disk" )'
+    ]
+
+
+def test_action_filters_split_large_service_groups():
+
+    services = [{"host_name": "web1", "name": "service %02d" % x} for x in range(40)]
+
+    filter_list = icinga_connection.get_i2_action_filters("Service", services, max_length=200)
+
+    assert len(filter_list) > 1
+    assert all(len(x) <= 200 for x in filter_list)
+    assert all(x.startswith('( host.name=="web1" && service.name') for x in filter_list)
+    assert sum(x.count('"service ') for x in filter_list) == 40
+
+
+def test_chunk_filters_stay_within_max_length():
+
+    filter_list = ['host.name=="host%03d"' % x for x in range(100)]
+
+    chunks = list(icinga_connection.chunk_i2_filters(filter_list, max_length=100))
+
+    assert [x for chunk in chunks for x in chunk] == filter_list
+    assert all(len("(" + " || ".join(chunk) + ")") <= 100 for chunk in chunks)
+
+    # each chunk is filled up, so the next filter wouldn't have fit
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        assert len("(" + " || ".join(chunk + next_chunk[0:1]) + ")") > 100
+
+
+def test_chunk_filters_keep_oversized_filters_in_their_own_chunk():
+
+    filter_list = ["a==1", "x" * 50, "b==2"]
+
+    assert list(icinga_connection.chunk_i2_filters(filter_list, max_length=20)) == [["a==1"], ["x" * 50], ["b==2"]]
+    assert list(icinga_connection.chunk_i2_filters(list(), max_length=20)) == list()
@@ -0,0 +1,23 @@
+import asyncio
+
+from i2_slack_modules.icinga_connection_manager import IcingaEndpoint, max_consecutive_failures
+
+
+def test_unhealthy_endpoint_closes_its_session():
+
+    async def run():
+        endpoint = IcingaEndpoint(url="https://127.0.0.1:5665/")
+        session = endpoint.get_async_session()
+
+        for _ in range(max_consecutive_failures):
+            endpoint.mark_failure("connection refused")
+
+        await asyncio.sleep(0.1)
+
+        return endpoint, session
+
+    endpoint, session = asyncio.run(run())
+
+    assert endpoint.healthy is False
+    assert endpoint.async_session is None
+    assert session.closed is True
@@ -0,0 +1,155 @@
+import asyncio
+
+import i2_slack_modules.icinga_state_mirror as icinga_state_mirror
+from i2_slack_modules.icinga_state_mirror import IcingaStateMirror
+
+mirror_objects = {
+    "Host": [
+        {"name": "web1", "state": 0, "acknowledgement": 0, "downtime_depth": 0, "enable_notifications": True},
+        {"name": "db1", "state": 0, "acknowledgement": 0, "downtime_depth": 0, "enable_notifications": True},
+    ],
+    "Service": [
+        {"name": "ntp", "host_name": "web1", "state": 0, "acknowledgement": 0, "downtime_depth": 0},
+        {"name": "disk", "host_name": "db1", "state": 2, "acknowledgement": 0, "downtime_depth": 0},
+    ],
+    "Comment": list(),
+    "Downtime": list(),
+}
+
+
+class FakeIcingaClient:
+
+    def __init__(self, events=None, stream_error=None):
+        self.events = events or list()
+        self.stream_error = stream_error
+        self.num_objects_requests = 0
+
+    async def objects_list(self, object_type, attrs=None, filters=None):
+        self.num_objects_requests += 1
+        return [{"attrs": dict(x)} for x in mirror_objects[object_type]]
+
+    def events_subscribe(self, types, queue, filters=None, connected=None):
+
+        async def stream():
+            if self.stream_error is not None:
+                raise self.stream_error
+            connected.set()
+            for event in self.events:
+                yield event
+            await asyncio.sleep(10)
+
+        return stream()
+
+
+def get_synced_mirror():
+
+    mirror = IcingaStateMirror()
+    asyncio.run(mirror.full_sync(FakeIcingaClient(), {"icinga.filter": ""}))
+
+    return mirror
+
+
+def test_full_sync_and_problems():
+
+    mirror = get_synced_mirror()
+
+    assert mirror.ready is True
+    assert [x["attrs"]["name"] for x in mirror.query("Service", ["service.state != 0"])] == ["disk"]
+    assert mirror.query("Host", ["host.state != 0"]) == list()
+
+
+def test_state_change_and_acknowledgement_events():
+
+    mirror = get_synced_mirror()
+
+    with mirror.lock:
+        mirror.handle_event({"type": "StateChange", "host": "web1", "service": "ntp", "state": 2,
+                             "timestamp": 1000, "check_result": {"output": "CRITICAL - no sync"}})
+        mirror.handle_event({"type": "AcknowledgementSet", "host": "web1", "service": "ntp"})
+        mirror.handle_event({"type": "StateChange", "host": "db1", "service": "disk", "state": 0, "timestamp": 1001})
+        # unknown objects are ignored
+        mirror.handle_event({"type": "StateChange", "host": "unknown", "state": 1})
+
+    problems = mirror.query("Service", ["service.state != 0"])
+
+    assert len(problems) == 1
+    assert problems[0]["attrs"]["name"] == "ntp"
+    assert problems[0]["attrs"]["acknowledgement"] == 1
+    assert problems[0]["attrs"]["last_check_result"] == {"output": "CRITICAL - no sync"}
+    assert mirror.query("Service", ["service.state != 0"], acknowledged=False) == list()
+
+
+def test_downtime_and_comment_events():
+
+    mirror = get_synced_mirror()
+    downtime = {"name": "dt1", "host_name": "db1", "service_name": "", "author": "jane", "comment": "maintenance"}
+    comment = {"name": "c1", "host_name": "web1", "service_name": "ntp", "author": "jane", "text": "looking"}
+
+    with mirror.lock:
+        mirror.handle_event({"type": "DowntimeAdded", "downtime": downtime})
+        mirror.handle_event({"type": "DowntimeTriggered", "downtime": downtime, "timestamp": 1000})
+        mirror.handle_event({"type": "CommentAdded", "comment": comment})
+
+    assert mirror.objects["Host"][("db1",)]["downtime_depth"] == 1
+    assert [x["attrs"]["name"] for x in mirror.query("Downtime")] == ["dt1"]
+    assert [x["attrs"]["name"] for x in mirror.query("Comment")] == ["c1"]
+
+    with mirror.lock:
+        mirror.handle_event({"type": "DowntimeRemoved", "downtime": downtime})
+        mirror.handle_event({"type": "CommentRemoved", "comment": comment})
+
+    assert mirror.objects["Host"][("db1",)]["downtime_depth"] == 0
+    assert mirror.query("Downtime") == list()
+    assert mirror.query("Comment") == list()
+
+
+def test_query_only_returns_requested_attributes():
+
+    mirror = get_synced_mirror()
+
+    result = mirror.query("Host", filter_names=["web"], list_attrs=["name", "state"])
+
+    assert result == [{"attrs": {"name": "web1", "state": 0}}]
+
+
+def test_query_filters_which_can_not_be_evaluated_locally():
+
+    mirror = get_synced_mirror()
+
+    assert mirror.query("Host", ['match("web*", host.name)']) is None
+    assert IcingaStateMirror().query("Host") is None
+
+
+def test_events_received_during_sync_are_applied(monkeypatch):
+
+    mirror = IcingaStateMirror()
+    i2_handle = FakeIcingaClient(events=[
+        {"type": "StateChange", "host": "web1", "state": 1, "timestamp": 1000}
+    ])
+
+    async def run():
+        mirror_task = asyncio.ensure_future(mirror.run({"icinga.filter": ""}))
+        await asyncio.sleep(0.1)
+        mirror_task.cancel()
+
+    monkeypatch.setattr(icinga_state_mirror.connection_manager, "get_async_client", lambda config: i2_handle)
+    asyncio.run(run())
+
+    assert mirror.ready is True
+    assert [x["attrs"]["name"] for x in mirror.query("Host", ["host.state != 0"])] == ["web1"]
+
+
+def test_rejected_event_stream_disables_mirror(monkeypatch):
+
+    mirror = IcingaStateMirror()
+    i2_handle = FakeIcingaClient(stream_error=Exception('Request "https://icinga:5665/v1/events" '
+                                                        'failed with status 403: {"status": "No permission"}'))
+
+    monkeypatch.setattr(icinga_state_mirror.connection_manager, "get_async_client", lambda config: i2_handle)
+
+    asyncio.run(asyncio.wait_for(mirror.run({"icinga.filter": ""}), 5))
+
+    assert mirror.disabled is True
+    assert mirror.ready is False
+    assert i2_handle.num_objects_requests == 0
+    assert mirror.query("Host") is None
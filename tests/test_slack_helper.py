@@ -0,0 +1,36 @@
+from i2_slack_modules import slack_max_block_text_length
+from i2_slack_modules.slack_helper import iterate_slack_block_texts
+
+
+def test_block_texts_are_filled_up_to_the_block_text_length():
+
+    text_lines = ["line %04d" % x for x in range(1000)]
+
+    block_texts = list(iterate_slack_block_texts(text_lines))
+
+    assert len(block_texts) > 1
+    assert all(0 < len(x) <= slack_max_block_text_length for x in block_texts)
+    assert "".join(block_texts) == "".join("%s\n\n" % x for x in text_lines)
+
+
+def test_oversized_lines_are_truncated_and_no_empty_blocks_are_emitted():
+
+    text_lines = ["x" * (slack_max_block_text_length * 2), "short", "y" * slack_max_block_text_length]
+
+    block_texts = list(iterate_slack_block_texts(text_lines))
+
+    assert len(block_texts) == 3
+    assert all(0 < len(x) <= slack_max_block_text_length for x in block_texts)
+    assert block_texts[0].startswith("xxx") and block_texts[0].endswith("...\n\n")
+    assert block_texts[1] == "short\n\n"
+    assert block_texts[2].startswith("yyy") and block_texts[2].endswith("...\n\n")
+
+
+def test_block_texts_stop_at_max_blocks():
+
+    text_lines = ["x" * 1000 for _ in range(20)]
+
+    block_texts = list(iterate_slack_block_texts(text_lines, max_blocks=3))
+
+    assert len(block_texts) == 3
+    assert "reached maximum message size" in block_texts[-1]
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+
+from i2_slack_modules import slack_post_priority_high, slack_post_priority_default, \
+    slack_max_block_text_length, slack_max_message_blocks, slack_max_message_attachments
+from i2_slack_modules.classes import BotResponse
+from i2_slack_modules.slack_post_pipeline import SlackPostPipeline
+
+
+def test_priority_only_reorders_requests_of_the_same_bucket():
+
+    async def run():
+        pipeline = SlackPostPipeline()
+
+        # no chat.update tokens left for the next seconds
+        pipeline.get_method_bucket("chat.update").pause(2)
+
+        high_priority_update = asyncio.ensure_future(
+            pipeline.wait_for_rate_limit("chat.update", "A", slack_post_priority_high))
+        await asyncio.sleep(0)
+
+        start = time.monotonic()
+        await asyncio.wait_for(pipeline.wait_for_rate_limit("chat.postMessage", "B", slack_post_priority_default), 1)
+        low_priority_wait = time.monotonic() - start
+
+        high_priority_update.cancel()
+
+        return low_priority_wait
+
+    assert asyncio.run(run()) < 0.1
+
+
+def test_higher_priority_goes_first_on_the_same_bucket():
+
+    async def run():
+        pipeline = SlackPostPipeline()
+        order = list()
+
+        pipeline.get_channel_bucket("A").pause(0.2)
+
+        async def request(method, priority):
+            await pipeline.wait_for_rate_limit(method, "A", priority)
+            order.append(priority)
+
+        low_priority = asyncio.ensure_future(request("chat.postMessage", slack_post_priority_default))
+        await asyncio.sleep(0)
+        high_priority = asyncio.ensure_future(request("chat.update", slack_post_priority_high))
+
+        await asyncio.wait_for(asyncio.gather(low_priority, high_priority), 5)
+
+        return order
+
+    assert asyncio.run(run()) == [slack_post_priority_high, slack_post_priority_default]
+
+
+def test_upload_file_uses_external_upload():
+
+    from aiohttp import web
+    from i2_slack_modules.classes import SlackFile
+
+    uploads = list()
+    api_calls = list()
+
+    async def receive_upload(request):
+        uploads.append(await request.read())
+        return web.Response(text="OK")
+
+    class FakeWebClient:
+
+        def __init__(self, upload_url):
+            self.upload_url = upload_url
+
+        async def api_call(self, api_method, data=None):
+            api_calls.append((api_method, data))
+            if api_method == "files.getUploadURLExternal":
+                return {"ok": True, "upload_url": self.upload_url, "file_id": "F1"}
+            return {"ok": True, "files": [{"id": "F1"}]}
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/upload", receive_upload)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        try:
+            slack_file = SlackFile("status.csv", title="Status", filetype="csv", lines=["a,b\n", "1,2\n"])
+            return await SlackPostPipeline().upload_file(FakeWebClient("http://127.0.0.1:%d/upload" % port),
+                                                         "C1", slack_file)
+        finally:
+            await runner.cleanup()
+
+    response = asyncio.run(run())
+
+    assert response.error is None
+    assert uploads == [b"a,b\n1,2\n"]
+    assert api_calls == [
+        ("files.getUploadURLExternal", {"filename": "status.csv", "length": 8}),
+        ("files.completeUploadExternal", {"channel_id": "C1", "files": '[{"id": "F1", "title": "Status"}]'}),
+    ]
+
+
+def text_block(text):
+    return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
+
+
+def test_pack_blocks_merges_adjacent_text_sections():
+
+    divider = {"type": "divider"}
+    fields = {"type": "section", "text": {"type": "mrkdwn", "text": "fields"}, "fields": [{"type": "mrkdwn"}]}
+
+    packed = SlackPostPipeline.pack_blocks([text_block("a"), text_block("b\n"), text_block("c"), divider,
+                                            text_block("d"), fields, text_block("e")])
+
+    assert packed == [text_block("a\n\nb\nc"), divider, text_block("d"), fields, text_block("e")]
+
+
+def test_pack_blocks_respects_block_text_length():
+
+    half = "x" * (slack_max_block_text_length // 2)
+    # the separator makes the two halves exceed the limit, the last two blocks fill it exactly
+    blocks = [text_block(half), text_block(half), text_block("y" * (slack_max_block_text_length - 3)),
+              text_block("z")]
+
+    packed = SlackPostPipeline.pack_blocks(blocks)
+
+    assert [x["text"]["text"] for x in packed] == [half, half, "y" * (slack_max_block_text_length - 3) + "\n\nz"]
+    assert all(len(x["text"]["text"]) <= slack_max_block_text_length for x in packed)
+
+
+def test_get_message_parts_splits_blocks_and_attachments():
+
+    divider = {"type": "divider"}
+    num_blocks = slack_max_message_blocks * 2 + 1
+    num_attachments = slack_max_message_attachments + 1
+
+    slack_response = BotResponse(text="summary", blocks=[divider] * num_blocks,
+                                 attachments=[{"text": str(x)} for x in range(num_attachments)])
+
+    message_parts = SlackPostPipeline().get_message_parts(slack_response)
+
+    assert len(message_parts) == 4
+    assert all(x[0] == "summary" for x in message_parts)
+    assert [len(x[1] or list()) for x in message_parts] == [slack_max_message_blocks, slack_max_message_blocks, 1, 0]
+
+    assert message_parts[0][2] is None and message_parts[1][2] is None
+    assert json.loads(message_parts[2][2]) == [{"text": str(x)} for x in range(slack_max_message_attachments)]
+    assert json.loads(message_parts[3][2]) == [{"text": str(slack_max_message_attachments)}]
+
+
+def test_get_message_parts_of_text_only_response():
+
+    message_parts = SlackPostPipeline().get_message_parts(BotResponse(text="just text"))
+
+    assert message_parts == [("just text", None, None)]
+
+
+def test_get_message_parts_packs_text_blocks_into_one_message():
+
+    slack_response = BotResponse(text="status", blocks=[text_block("line %d" % x) for x in range(100)])
+
+    message_parts = SlackPostPipeline().get_message_parts(slack_response)
+
+    assert len(message_parts) == 1
+    assert message_parts[0][1] == [text_block("\n\n".join("line %d" % x for x in range(100)))]
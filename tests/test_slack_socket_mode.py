@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+import i2_slack_modules.slack_socket_mode as slack_socket_mode
+from i2_slack_modules.slack_socket_mode import SlackSocketModeClient
+
+
+class FakeSlackServer:
+    """
+    Serves apps.connections.open and a Socket Mode websocket
+
+    The first connection delivers one event and then asks to reconnect,
+    the second connection delivers another event and is closed by the server.
+    """
+
+    def __init__(self):
+        self.num_connections = 0
+        self.acks = list()
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/apps.connections.open", self.connections_open)
+        app.router.add_get("/socket", self.socket)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+
+        self.url = "http://127.0.0.1:%d" % site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def connections_open(self, request):
+        if request.headers.get("Authorization") != "Bearer xapp-test":
+            return web.json_response({"ok": False, "error": "invalid_auth"})
+
+        return web.json_response({"ok": True, "url": self.url.replace("http", "ws") + "/socket"})
+
+    async def socket(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        self.num_connections += 1
+        connection = self.num_connections
+
+        await websocket.send_json({"type": "hello"})
+        await websocket.send_json({"type": "events_api", "envelope_id": "envelope-%d" % connection,
+                                   "payload": {"event": {"type": "message", "text": "event %d" % connection}}})
+
+        ack = await websocket.receive_json(timeout=5)
+        self.acks.append(ack.get("envelope_id"))
+
+        if connection == 1:
+            await websocket.send_json({"type": "disconnect", "reason": "refresh_requested"})
+            await websocket.receive()
+        else:
+            await websocket.close()
+
+        return websocket
+
+
+def test_events_are_acknowledged_before_dispatch_and_client_reconnects(monkeypatch):
+
+    monkeypatch.setattr(slack_socket_mode, "socket_mode_min_reconnect_delay", 0.01)
+
+    order = list()
+    events = list()
+
+    send_json = aiohttp.ClientWebSocketResponse.send_json
+
+    async def record_ack(self, data, *args, **kwargs):
+        order.append("ack %s" % data.get("envelope_id"))
+        return await send_json(self, data, *args, **kwargs)
+
+    monkeypatch.setattr(aiohttp.ClientWebSocketResponse, "send_json", record_ack)
+
+    async def run():
+        server = FakeSlackServer()
+        await server.start()
+
+        client = SlackSocketModeClient("xapp-test", web_client="web client", api_url=server.url + "/api/")
+
+        async def handle_message(data=None, web_client=None):
+            order.append("dispatch %s" % data.get("text"))
+            events.append((data, web_client))
+
+            if len(events) == 2:
+                await client.stop()
+
+        client.add_event_handler("message", handle_message)
+
+        try:
+            await asyncio.wait_for(client.start(), 10)
+        finally:
+            await server.stop()
+
+        return server
+
+    server = asyncio.run(run())
+
+    assert server.num_connections == 2
+    assert server.acks == ["envelope-1", "envelope-2"]
+    assert order == ["ack envelope-1", "dispatch event 1", "ack envelope-2", "dispatch event 2"]
+    assert [x[1] for x in events] == ["web client", "web client"]
+
+
+def test_failed_connection_open_is_retried(monkeypatch):
+
+    monkeypatch.setattr(slack_socket_mode, "socket_mode_min_reconnect_delay", 0.01)
+
+    async def run():
+        server = FakeSlackServer()
+        await server.start()
+
+        client = SlackSocketModeClient("xapp-invalid", api_url=server.url + "/api")
+        attempts = list()
+
+        open_connection_url = client.open_connection_url
+
+        async def count_attempts(session):
+            attempts.append(True)
+            if len(attempts) == 3:
+                await client.stop()
+            return await open_connection_url(session)
+
+        client.open_connection_url = count_attempts
+
+        try:
+            await asyncio.wait_for(client.start(), 10)
+        finally:
+            await server.stop()
+
+        return server, attempts
+
+    server, attempts = asyncio.run(run())
+
+    assert len(attempts) == 3
+    assert server.num_connections == 0
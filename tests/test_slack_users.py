@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import i2_slack_modules.classes as classes
+from i2_slack_modules.icinga_connection import RequestResponse
+
+
+def get_slack_users(monkeypatch, tmp_path):
+
+    async def fake_call_api(handle, method, channel=None, priority=None, **kwargs):
+        return RequestResponse(text={"ok": True, "user": {"id": kwargs.get("user"), "real_name": "Jane Doe",
+                                                          "profile": {"image": "dropped"}}})
+
+    monkeypatch.setattr(classes.slack_post_pipeline, "call_api", fake_call_api)
+
+    slack_users = classes.SlackUsers()
+    slack_users.users = dict()
+    slack_users.refresh_tasks = dict()
+    slack_users.web_handle = object()
+    slack_users.set_cache_file(str(tmp_path / "users.json"))
+
+    return slack_users
+
+
+def test_user_refresh_writes_cache_file_debounced(monkeypatch, tmp_path):
+
+    slack_users = get_slack_users(monkeypatch, tmp_path)
+    slack_users.user_cache_write_delay = 0.1
+
+    async def run():
+        await slack_users.request_slack_user_info("U1")
+        await slack_users.request_slack_user_info("U2")
+
+        # nothing is written right after a refresh
+        written_before_delay = (tmp_path / "users.json").exists()
+
+        await asyncio.sleep(0.3)
+
+        return written_before_delay
+
+    assert asyncio.run(run()) is False
+
+    cached_users = json.loads((tmp_path / "users.json").read_text())
+    assert sorted(cached_users.keys()) == ["U1", "U2"]
+    assert cached_users["U1"]["data"] == {"id": "U1", "real_name": "Jane Doe"}
+    assert slack_users.cache_dirty is False
+
+
+def test_cache_file_round_trip(monkeypatch, tmp_path):
+
+    slack_users = get_slack_users(monkeypatch, tmp_path)
+    slack_users.set_user_data("U1", {"id": "U1", "name": "jane"}, 1000)
+    slack_users.cache_dirty = True
+
+    asyncio.run(slack_users.flush_cache_file())
+
+    loaded_users = get_slack_users(monkeypatch, tmp_path)
+    loaded_users.load_cache_file()
+
+    assert loaded_users.get("U1").data == {"id": "U1", "name": "jane"}
+    assert loaded_users.get("U1").data_last_updated == 1000